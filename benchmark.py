@@ -0,0 +1,685 @@
+#! /usr/bin/env python
+"""
+Benchmarks for scholar.py and citation_scraper.py. Each benchmark is a
+subcommand, e.g.
+
+  python3 benchmark.py parsers --pages saved/*.html
+
+runs the results page parsers over saved Google Scholar results pages.
+Without saved pages, benchmarks use synthetic ones in the current
+Scholar layout.
+"""
+
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from operator import itemgetter
+from queue import Empty
+
+import citation_scraper
+
+from citation_scraper import TEMPLATES, bibtex_to_dict_key, iter_bibtex
+from mock_scholar import MockScholar, synthetic_results_page
+from scholar import ScholarConf, ScholarArticle, ScholarArticleParser120726, ScholarArticleParserLxml, ScholarArticleParserStream, \
+    SoupKitchen, AsyncScholarQuerier, ScholarAsyncClient, ScholarQuerier, SearchScholarQuery
+
+
+def collect_articles(parser_class, html):
+    """
+    :return: num_results and the attribute values of every article the parser finds
+    """
+    found = {'articles': [], 'num_results': None}
+
+    class Collector(parser_class):
+        def handle_article(self, art):
+            found['articles'].append({key: art[key] for key in art.LABELS})
+
+        def handle_num_results(self, num_results):
+            found['num_results'] = num_results
+
+    Collector().parse(html)
+    return found
+
+
+def bench_parsers(options):
+    """
+    times each results page parser on the same pages, after checking they all
+    produce identical articles
+    """
+    if options.pages:
+        pages = []
+        for path in options.pages:
+            with open(path, 'rb') as fd:
+                pages.append(fd.read())
+    else:
+        pages = [synthetic_results_page(seed).encode('utf-8') for seed in range(options.synthetic)]
+
+    parsers = [('bs4', ScholarArticleParser120726), ('lxml', ScholarArticleParserLxml),
+               ('stream', ScholarArticleParserStream)]
+    expected = [collect_articles(ScholarArticleParser120726, page) for page in pages]
+    for name, parser_class in parsers[1:]:
+        for page, page_expected in zip(pages, expected):
+            if collect_articles(parser_class, page) != page_expected:
+                print('{} parser disagrees with bs4'.format(name))
+                return 1
+
+    num_articles = sum(len(page['articles']) for page in expected)
+    print('{} pages, {} articles, {} rounds'.format(len(pages), num_articles, options.rounds))
+    for name, parser_class in parsers:
+        start = time.perf_counter()
+        for _ in range(options.rounds):
+            for page in pages:
+                parser_class().parse(page)
+        elapsed = (time.perf_counter() - start) / options.rounds
+        print('{:>6}: {:8.2f} ms/page {:10.0f} articles/s'.format(
+            name, 1000 * elapsed / len(pages), num_articles / elapsed))
+    return 0
+
+
+def synthetic_bibtex(seed: int, num_authors: int = None) -> str:
+    """
+    returns a BibTeX entry the way Scholar exports them: one field per line in a fixed
+    order, only the fields known for the article
+    """
+    rnd = random.Random(seed)
+    words = ['Genome', 'graphs', 'and', 'the', 'evolution', 'of', '{DNA}', 'sequences', 'a', 'human',
+             'pangenome', 'reference', 'Cactus', 'alignment', 'for', 'thousands', 'species']
+    names = ['Paten', 'Novak', 'Eizenga', 'Garrison', 'Hickey', 'Rosen', 'Haussler', 'Sirén', 'Monlong']
+    kind = rnd.choice(['article', 'article', 'inproceedings', 'book', 'phdthesis'])
+    authors = ' and '.join('{}, {}'.format(rnd.choice(names), rnd.choice('ABCDEFGHJ'))
+                           for _ in range(num_authors or rnd.randint(1, 12)))
+    fields = [('title', ' '.join(rnd.choice(words) for _ in range(rnd.randint(3, 14)))), ('author', authors)]
+    if kind == 'article':
+        fields += [('journal', 'Genome research'), ('volume', str(rnd.randint(1, 40))),
+                   ('number', str(rnd.randint(1, 12))), ('pages', '{}--{}'.format(rnd.randint(1, 500),
+                                                                                     rnd.randint(501, 999)))]
+    elif kind == 'inproceedings':
+        fields += [('booktitle', 'Proceedings of the {} conference'.format(rnd.choice(words))),
+                   ('pages', '{}--{}'.format(rnd.randint(1, 500), rnd.randint(501, 999)))]
+    fields.append(('year', str(rnd.randint(1970, 2020))))
+    if kind != 'phdthesis':
+        fields.append(('publisher', rnd.choice(['Cold Spring Harbor Lab', 'Nature Publishing Group', 'IEEE'])))
+    else:
+        fields.append(('school', 'UC Santa Cruz'))
+    return '@{}{{{}{}{},\n{}\n}}\n'.format(kind, rnd.choice(names).lower(), rnd.randint(1970, 2020),
+                                           rnd.choice(words).strip('{}').lower(),
+                                           ',\n'.join('  {}={{{}}}'.format(key, val) for key, val in fields))
+
+
+def legacy_bibtex_to_dict_key(bibtex: str):
+    """
+    the regex based parser citation_scraper.py used before iter_bibtex, for comparison
+    """
+    rex = ('@.+?\\{(?P<id>.+?),\n'
+           '(?:.*title=\\{(?P<title>.+?)\\},?\n)?'
+           '(?:.*author=\\{(?P<author>.+?)\\},?\n)?'
+           '(?:.*journal=\\{(?P<journal>.+?)\\},?\n)?'
+           '(?:.*booktitle=\\{(?P<booktitle>.+?)\\},?\n)?'
+           '(?:.*volume=\\{(?P<volume>.+?)\\},?\n)?'
+           '(?:.*number=\\{(?P<number>.+?)\\},?\n)?'
+           '(?:.*pages=\\{(?P<pages>.+?)\\},?\n)?'
+           '(?:.*year=\\{(?P<year>.+?)\\},?\n)?'
+           '(?:.*publisher=\\{(?P<publisher>.+?)\\},?\n)?'
+           '\\}')
+    match = re.search(rex, bibtex)
+    if match is None:
+        raise ValueError
+    match_dict = {}
+    match_dict.update(match.groupdict())
+    bib_id = match_dict.pop('id')
+    match_dict['sort_year'] = match_dict['year'] or '0'
+    return bib_id, match_dict
+
+
+def pathological_bibtex(seed: int):
+    """
+    :return: dict of name to entries the legacy parser handles badly
+    """
+    rnd = random.Random(seed)
+    entries = [synthetic_bibtex(seed + i) for i in range(20)]
+
+    def reorder(entry):
+        lines = entry.split('\n')
+        fields = [line.rstrip(',') for line in lines[1:-2]]
+        rnd.shuffle(fields)
+        return '\n'.join([lines[0]] + [field + ',' for field in fields[:-1]] + [fields[-1], '}', ''])
+
+    return {
+        'long author lists': [synthetic_bibtex(seed + i, num_authors=1000) for i in range(5)],
+        'reordered fields': [reorder(entry) for entry in entries],
+        'multi-line values': [entry.replace(' and ', ' and\n    ') for entry in entries],
+        'truncated entries': [synthetic_bibtex(seed + i, num_authors=200)[:-3] for i in range(5)],
+    }
+
+
+def count_fields(parse, entry):
+    try:
+        return sum(1 for key, val in parse(entry)[1].items() if val is not None and key != 'sort_year')
+    except ValueError:
+        return 0
+
+
+def time_per_entry(parse, entries, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for entry in entries:
+            try:
+                parse(entry)
+            except ValueError:
+                pass
+    return (time.perf_counter() - start) / rounds / len(entries)
+
+
+def bench_bibtex(options):
+    """
+    compares the BibTeX parser with the legacy regex: equal results and speed on well
+    formed Scholar exports, and fields recovered and speed on pathological ones
+    """
+    if options.exports:
+        buffer = ''
+        for path in options.exports:
+            with open(path, encoding='utf-8') as fd:
+                buffer += fd.read() + '\n'
+        entries = [match.group() for match in re.finditer(r'@.*?\n\}', buffer, re.S)]
+    else:
+        entries = [synthetic_bibtex(seed) for seed in range(options.synthetic)]
+        buffer = ''.join(entries)
+
+    disagreements = 0
+    for entry in entries:
+        try:
+            legacy = legacy_bibtex_to_dict_key(entry)
+        except ValueError:
+            continue
+        if bibtex_to_dict_key(entry) != legacy:
+            disagreements += 1
+    print('{} Scholar exports, {} parsed differently by the legacy regex'.format(len(entries), disagreements))
+
+    for name, parse in [('legacy', legacy_bibtex_to_dict_key), ('tokenizer', bibtex_to_dict_key)]:
+        elapsed = time_per_entry(parse, entries, options.rounds)
+        print('{:>10}: {:8.2f} us/entry {:10.0f} entries/s'.format(name, 1e6 * elapsed, 1 / elapsed))
+    start = time.perf_counter()
+    for _ in range(options.rounds):
+        num_parsed = sum(1 for _ in iter_bibtex(buffer))
+    elapsed = (time.perf_counter() - start) / options.rounds / max(1, num_parsed)
+    print('{:>10}: {:8.2f} us/entry {:10.0f} entries/s ({} entries in one buffer)'.format(
+        'batch', 1e6 * elapsed, 1 / elapsed, num_parsed))
+
+    print('\npathological inputs (fields recovered, time per entry):')
+    for name, cases in pathological_bibtex(options.synthetic).items():
+        res = []
+        for parse in (legacy_bibtex_to_dict_key, bibtex_to_dict_key):
+            fields = sum(count_fields(parse, entry) for entry in cases)
+            res.append('{:5} fields {:10.2f} us'.format(fields, 1e6 * time_per_entry(parse, cases, options.rounds)))
+        print('{:>18}: legacy {} | tokenizer {}'.format(name, *res))
+    return 0
+
+
+def synthetic_citation(rnd: random.Random, num: int) -> dict:
+    """
+    returns a citation dict like the ones parsed from BibTeX, with some fields missing
+    """
+    year = str(rnd.randint(1970, 2020)) if rnd.random() < 0.95 else None
+    curr = {
+        'title': 'Genome graphs and the evolution of {{DNA}} sequences, part {}'.format(num),
+        'author': ' and '.join('Author{}, {}'.format(rnd.randint(1, 999), 'ABCDEF'[i % 6])
+                               for i in range(rnd.randint(1, 8))),
+        'journal': 'Genome research',
+        'booktitle': None,
+        'volume': str(rnd.randint(1, 40)),
+        'number': str(rnd.randint(1, 12)),
+        'pages': '{}--{}'.format(rnd.randint(1, 500), rnd.randint(501, 999)),
+        'year': year,
+        'publisher': 'Cold Spring Harbor Lab',
+        'sort_year': year or '0',
+        'url': 'http://example.com/paper{}.pdf'.format(num),
+    }
+    for field in ('journal', 'volume', 'number', 'pages', 'publisher', 'url'):
+        if rnd.random() < 0.2:
+            curr[field] = None
+    return curr
+
+
+def legacy_citation_to_txt(curr: dict) -> str:
+    """
+    how dict_to_txt_lines rendered each citation before templates, for comparison
+    """
+    cit_html = ''
+    split_string = ['{author}; ',
+                    '<strong><a href="{url}">{title}</a></strong>. ' if curr['url']
+                    else '<strong>{title}</strong>. ',
+                    '<i>{journal}</i>. ',
+                    '<strong>',
+                    '{volume}',
+                    '-{number}',
+                    '</strong>. ' if curr['volume'] or curr['number'] else '</strong> ',
+                    '{pages} ',
+                    '({year}) ',
+                    '{publisher}',
+                    '\n\n']
+    for s in split_string:
+        s = s.format(**curr)
+        if 'None' not in s:
+            cit_html += s
+    return cit_html
+
+
+def bench_render(options):
+    """
+    render throughput of the legacy code and of every template, checking that the html
+    template writes what the legacy code did
+    """
+    rnd = random.Random(0)
+    citations = [synthetic_citation(rnd, num) for num in range(options.citations)]
+
+    legacy = [legacy_citation_to_txt(curr) for curr in citations]
+    html = [TEMPLATES['html'].render(curr) for curr in citations]
+    mismatches = sum(1 for old, new in zip(legacy, html) if old != new)
+    print('{} citations, {} rendered differently by the html template'.format(len(citations), mismatches))
+
+    renderers = [('legacy', legacy_citation_to_txt)]
+    renderers += [(name, template.render) for name, template in sorted(TEMPLATES.items())]
+    for name, render in renderers:
+        best = None
+        for _ in range(options.rounds):
+            start = time.perf_counter()
+            for curr in citations:
+                render(curr)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        compiled = '' if name == 'legacy' else ', {} compiled formats'.format(len(TEMPLATES[name].compiled))
+        print('{:>10}: {:8.3f} s {:10.0f} citations/s{}'.format(name, best, len(citations) / best, compiled))
+    return 0
+
+
+class LegacyArticle:
+    """
+    how ScholarArticle kept its attributes before __slots__: a dict of value, label and
+    ordering index for each, in every article
+    """
+    def __init__(self):
+        self.attrs = {
+            'title':         [None, 'Title',          0],
+            'url':           [None, 'URL',            1],
+            'year':          [None, 'Year',           2],
+            'num_citations': [0,    'Citations',      3],
+            'num_versions':  [0,    'Versions',       4],
+            'cluster_id':    [None, 'Cluster ID',     5],
+            'url_pdf':       [None, 'PDF link',       6],
+            'url_citations': [None, 'Citations list', 7],
+            'url_versions':  [None, 'Versions list',  8],
+            'url_citation':  [None, 'Citation link',  9],
+            'excerpt':       [None, 'Excerpt',       10],
+        }
+        self.citation_data = None
+        self.citation_loader = None
+
+    def __setitem__(self, key, item):
+        self.attrs[key][0] = item
+
+
+class LegacyParser120726(ScholarArticleParser120726):
+    """
+    ScholarArticleParser120726 as it was before it released its tree, which then stayed
+    in memory until the next garbage collection
+    """
+    def parse(self, html):
+        self.soup = SoupKitchen.make_soup(html)
+        self._parse_globals()
+        for div in self.soup.findAll(ScholarArticleParser120726._tag_results_checker):
+            self._parse_article(div)
+            self._clean_article()
+            if self.article['title']:
+                self.handle_article(self.article)
+
+
+def article_collector(parser_class):
+    """
+    :return: a parser_class that keeps the articles it parses in its articles list
+    """
+    class Collector(parser_class):
+        def __init__(self):
+            parser_class.__init__(self)
+            self.articles = []
+
+        def handle_article(self, art):
+            self.articles.append(art)
+
+    return Collector
+
+
+def traced(func, collect: bool = True):
+    """
+    :return: what func returns and the memory it allocated that is still in use after it,
+        as traced by tracemalloc. With collect False, the garbage collector is kept off
+        meanwhile, like it may well be for some time after a page is parsed in a real run
+    """
+    gc.collect()
+    if not collect:
+        gc.disable()
+    tracemalloc.start()
+    try:
+        result = func()
+        if collect:
+            gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return result, size
+
+
+def bench_memory(options):
+    """
+    memory used by articles, with and without __slots__, and memory a parsed page leaves
+    behind until the garbage collector runs, with and without releasing the tree
+    """
+    pages = [synthetic_results_page(seed).encode('utf-8') for seed in range(options.synthetic)]
+    collector = article_collector(ScholarArticleParserLxml)
+    articles = []
+    for page in pages:
+        parser = collector()
+        parser.parse(page)
+        articles.extend(parser.articles)
+
+    def copy_articles(article_class):
+        copies = []
+        for art in articles:
+            copy = article_class()
+            for key in ScholarArticle.LABELS:
+                copy[key] = art[key]
+            copies.append(copy)
+        return copies
+
+    print('{} pages, {} articles'.format(len(pages), len(articles)))
+    # the values are the same strings for both, only what holds them counts
+    for name, article_class in [('legacy', LegacyArticle), ('slots', ScholarArticle)]:
+        _, size = traced(lambda: copy_articles(article_class))
+        print('{:>10}: {:8.0f} bytes/article'.format(name, size / len(articles)))
+
+    def parse_pages(parser_class):
+        collector = article_collector(parser_class)
+        found = []
+        for page in pages:
+            parser = collector()
+            parser.parse(page)
+            found.extend(parser.articles)
+        return found
+
+    parsers = [('legacy bs4', LegacyParser120726), ('bs4', ScholarArticleParser120726),
+               ('lxml', ScholarArticleParserLxml), ('stream', ScholarArticleParserStream)]
+    for name, parser_class in parsers:
+        # warm up, so only what parsing leaves behind gets traced
+        parse_pages(parser_class)
+        _, size = traced(lambda: parse_pages(parser_class), collect=False)
+        print('{:>10}: {:8.1f} KB/page left until garbage collection'.format(name, size / 1024 / len(pages)))
+    return 0
+
+
+def scrape_with_mock(site: str, workdir: str, argv: list, results):
+    """
+    runs citation_scraper.main() with argv in workdir, against the mock Scholar at site,
+    and puts its exit status, wall and CPU time and peak memory in the results queue.
+    Meant for a process of its own, since scholar.py keeps process-wide state
+    """
+    ScholarConf.SCHOLAR_SITE = site
+    os.chdir(workdir)
+    sys.argv = ['citation_scraper.py'] + argv
+    run = {'status': 0}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        with open('scraper.log', 'w') as log, redirect_stdout(log), redirect_stderr(log):
+            citation_scraper.main()
+    except SystemExit as e:
+        run['status'] = e.code
+    except BaseException as e:
+        run['status'] = repr(e)
+    finally:
+        run['wall'] = time.perf_counter() - wall
+        run['cpu'] = time.process_time() - cpu
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        run['peak'] = peak if sys.platform == 'darwin' else peak * 1024
+        results.put(run)
+
+
+def bench_e2e(options):
+    """
+    scrapes synthetic author lists of every size from a mock Scholar, each in a process of
+    its own, reporting requests per second, wall and CPU time and peak memory of each run
+    """
+    context = multiprocessing.get_context('spawn')
+    print('{} results per author, {:g} s latency, citation_scraper.py {}'.format(
+        options.results, options.latency, options.scraper_args))
+    print('{:>7} {:>9} {:>9} {:>9} {:>9} {:>9}  {}'.format(
+        'authors', 'requests', 'req/s', 'wall s', 'cpu s', 'peak MB', 'status'))
+    for num_authors in options.authors:
+        mock = MockScholar(results=options.results, latency=options.latency, block_every=options.block_every,
+                           captcha_every=options.captcha_every)
+        with tempfile.TemporaryDirectory() as workdir, mock:
+            with open(os.path.join(workdir, 'authors.txt'), 'w') as fh:
+                fh.write(''.join('Author {}\n'.format(i) for i in range(num_authors)))
+            argv = ['authors.txt', 'output.txt'] + shlex.split(options.scraper_args)
+            results = context.Queue()
+            process = context.Process(target=scrape_with_mock, args=(mock.site, workdir, argv, results))
+            process.start()
+            process.join()
+            try:
+                run = results.get(timeout=1)
+            except Empty:
+                run = {'status': 'died with {}'.format(process.exitcode), 'wall': float('nan'),
+                       'cpu': float('nan'), 'peak': float('nan')}
+        status = 'ok' if run['status'] in (0, None) else run['status']
+        if mock.stats['blocked'] or mock.stats['captcha']:
+            status = '{}, {} blocked, {} CAPTCHAs'.format(status, mock.stats['blocked'], mock.stats['captcha'])
+        print('{:>7} {:>9} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.1f}  {}'.format(
+            num_authors, mock.stats['requests'], mock.stats['requests'] / run['wall'], run['wall'], run['cpu'],
+            run['peak'] / 1024 / 1024, status))
+    return 0
+
+
+def import_times(stderr: str) -> dict:
+    """
+    :return: seconds spent importing each module imported at the top level, not by another
+    module, from what python -X importtime wrote to stderr
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        # nested imports are indented by two more spaces per level
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            times[name.strip()] = times.get(name.strip(), 0) + int(cumulative) / 1e6
+    return times
+
+
+def bench_startup(options):
+    """
+    times starting citation_scraper.py cold, in a new interpreter every time: for --help
+    and for only writing the output from a progress cache (--merge), which never touches
+    the network. Reports the wall time of each and what it spends importing, according
+    to python -X importtime
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    scraper = os.path.join(here, 'citation_scraper.py')
+    with tempfile.TemporaryDirectory() as workdir:
+        store = citation_scraper.ProgressStore(os.path.join(workdir, citation_scraper.PROGRESS_DB))
+        rnd = random.Random(0)
+        authors = []
+        for first in range(0, options.citations, 20):
+            authors.append('Author {}'.format(len(authors)))
+            store.save_page(authors[-1], None, {'key{}'.format(num): synthetic_citation(rnd, num)
+                                                for num in range(first, min(first + 20, options.citations))})
+            store.complete_author(authors[-1])
+        store.close()
+        with open(os.path.join(workdir, 'authors.txt'), 'w') as fh:
+            fh.write(''.join(author + '\n' for author in authors))
+
+        commands = [('python -c pass', ['-c', 'pass']),
+                    ('scholar.py --help', [os.path.join(here, 'scholar.py'), '--help']),
+                    ('--help', [scraper, '--help']),
+                    ('--merge', [scraper, 'authors.txt', 'output.txt', '--merge'])]
+        print('{} runs each, --merge of {} citations'.format(options.runs, options.citations))
+        print('{:>18} {:>9} {:>9} {:>9}  {}'.format('command', 'first s', 'median s', 'import s', 'slowest imports'))
+        for name, args in commands:
+            walls = []
+            for _ in range(options.runs):
+                start = time.perf_counter()
+                subprocess.run([sys.executable] + args, cwd=workdir, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                walls.append(time.perf_counter() - start)
+            # once more for the imports, as -X importtime slows them down
+            run = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=workdir, check=True,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+            times = import_times(run.stderr)
+            slowest = sorted(times.items(), key=itemgetter(1), reverse=True)[:options.top]
+            print('{:>18} {:>9.3f} {:>9.3f} {:>9.3f}  {}'.format(
+                name, walls[0], statistics.median(walls), sum(times.values()),
+                ', '.join('{} {:.0f} ms'.format(module, seconds * 1000) for module, seconds in slowest)))
+    return 0
+
+
+def author_queries(num_authors: int) -> list:
+    queries = []
+    for num in range(num_authors):
+        query = SearchScholarQuery()
+        query.set_author('Author {}'.format(num))
+        queries.append(query)
+    return queries
+
+
+def bench_async(options):
+    """
+    sends the queries for the first results page of many authors to a slow mock Scholar at
+    once, from one AsyncScholarQuerier in one event loop and from a pool of threads with a
+    ScholarQuerier each, with as many connections as threads, reporting the wall and CPU time
+    and queries per second of both
+    """
+    ScholarConf.LOG_LEVEL = 0
+    ScholarConf.PARSER = options.parser
+    print('{} authors, {:g} s latency, results pages only, {} parser'.format(
+        options.authors, options.latency, options.parser))
+    print('{:>11} {:>8} {:>9} {:>9} {:>9}  {}'.format(
+        'connections', 'querier', 'queries/s', 'wall s', 'cpu s', 'articles'))
+
+    async def send_async(connections):
+        querier = AsyncScholarQuerier(client=ScholarAsyncClient(max_connections=connections))
+        querier.lazy_citations = True
+        try:
+            return await asyncio.gather(*[querier.send_query(query) for query in author_queries(options.authors)])
+        finally:
+            await querier.close()
+
+    def send_threaded(connections):
+        def send(query):
+            querier = ScholarQuerier()
+            querier.lazy_citations = True
+            querier.send_query(query)
+            return querier.articles
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            return list(pool.map(send, author_queries(options.authors)))
+
+    for connections in options.connections:
+        for name, send in [('async', lambda: asyncio.run(send_async(connections))),
+                           ('threads', lambda: send_threaded(connections))]:
+            with MockScholar(latency=options.latency) as mock:
+                ScholarConf.SCHOLAR_SITE = mock.site
+                wall, cpu = time.perf_counter(), time.process_time()
+                results = send()
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            print('{:>11} {:>8} {:>9.1f} {:>9.2f} {:>9.2f}  {}'.format(
+                connections, name, options.authors / wall, wall, cpu, sum(len(articles) for articles in results)))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmarks for scholar.py and citation_scraper.py')
+    subparsers = parser.add_subparsers(dest='benchmark', metavar='benchmark')
+    subparsers.required = True
+
+    sub = subparsers.add_parser('parsers', help='results page parsers (BeautifulSoup, lxml and streaming)')
+    sub.add_argument('--pages', nargs='+', metavar='FILE',
+                     help='saved Google Scholar results pages. Default is synthetic pages.')
+    sub.add_argument('--synthetic', metavar='N', type=int, default=50,
+                     help='number of synthetic pages, if no --pages are given. Default is 50.')
+    sub.add_argument('--rounds', metavar='N', type=int, default=5,
+                     help='number of times to parse every page. Default is 5.')
+    sub.set_defaults(func=bench_parsers)
+
+    sub = subparsers.add_parser('bibtex', help='BibTeX parser against the legacy regex')
+    sub.add_argument('--exports', nargs='+', metavar='FILE',
+                     help='files of BibTeX exported from Google Scholar. Default is synthetic exports.')
+    sub.add_argument('--synthetic', metavar='N', type=int, default=2000,
+                     help='number of synthetic exports, if no --exports are given. Default is 2000.')
+    sub.add_argument('--rounds', metavar='N', type=int, default=5,
+                     help='number of times to parse every export. Default is 5.')
+    sub.set_defaults(func=bench_bibtex)
+
+    sub = subparsers.add_parser('render', help='citation templates against the legacy renderer')
+    sub.add_argument('--citations', metavar='N', type=int, default=100000,
+                     help='number of synthetic citations to render. Default is 100000.')
+    sub.add_argument('--rounds', metavar='N', type=int, default=3,
+                     help='number of times to render them, the best time counts. Default is 3.')
+    sub.set_defaults(func=bench_render)
+
+    sub = subparsers.add_parser('memory', help='memory of articles and of what parsing a page leaves behind')
+    sub.add_argument('--synthetic', metavar='N', type=int, default=50,
+                     help='number of synthetic pages to parse. Default is 50.')
+    sub.set_defaults(func=bench_memory)
+
+    sub = subparsers.add_parser('e2e', help='citation_scraper.py end to end, against a local mock Scholar')
+    sub.add_argument('--authors', nargs='+', metavar='N', type=int, default=[10, 100, 1000],
+                     help='sizes of the author lists to scrape. Default is 10, 100 and 1000.')
+    sub.add_argument('--results', metavar='N', type=int, default=20,
+                     help='number of results of every author. Default is 20.')
+    sub.add_argument('--latency', metavar='SECONDS', type=float, default=0.0,
+                     help='time every response of the mock takes. Default is none.')
+    sub.add_argument('--block-every', metavar='N', type=int, default=0,
+                     help='answer every N-th request with a 503. Default is never.')
+    sub.add_argument('--captcha-every', metavar='N', type=int, default=0,
+                     help='answer every N-th results page with a CAPTCHA. Default is never.')
+    sub.add_argument('--scraper-args', metavar='ARGS', default='',
+                     help='more arguments for citation_scraper.py, e.g. "--workers 4 --backoff 0.1".')
+    sub.set_defaults(func=bench_e2e)
+
+    sub = subparsers.add_parser('startup', help='cold start of citation_scraper.py, for --help and --merge')
+    sub.add_argument('--citations', metavar='N', type=int, default=1000,
+                     help='number of citations in the progress cache written by --merge. Default is 1000.')
+    sub.add_argument('--runs', metavar='N', type=int, default=10,
+                     help='number of times to start every command. Default is 10.')
+    sub.add_argument('--top', metavar='N', type=int, default=5,
+                     help='number of slowest imports to show. Default is 5.')
+    sub.set_defaults(func=bench_startup)
+
+    sub = subparsers.add_parser('async', help='AsyncScholarQuerier against threads, with many queries in flight')
+    sub.add_argument('--authors', metavar='N', type=int, default=500,
+                     help='number of authors to query at once. Default is 500.')
+    sub.add_argument('--connections', nargs='+', metavar='N', type=int, default=[8, 64, 256],
+                     help='connections to the mock at most, or threads. Default is 8, 64 and 256.')
+    sub.add_argument('--latency', metavar='SECONDS', type=float, default=0.2,
+                     help='time every response of the mock takes. Default is 0.2.')
+    sub.add_argument('--parser', choices=sorted(ScholarQuerier.PARSERS), default='stream',
+                     help='results page parser. Default is stream.')
+    sub.set_defaults(func=bench_async)
+
+    options = parser.parse_args()
+    return options.func(options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,27 +2,155 @@
 # HTML.
 #
 # outstanding issues/possible improvements:
-#   - The pickled cache isn't used at all other than to save stuff.
 #   - Maybe we could try and find links for the articles and embed that in the html output
 #
 # Author: Jesse Brennan
 
 
 import argparse
-import pickle
+import heapq
+import html
+import json
+import os
+import socket
+import sqlite3
+import string
 import sys
-from urllib.error import HTTPError
+import tempfile
+import threading
+from contextlib import ExitStack, closing, contextmanager
+from operator import itemgetter
+from queue import Queue
+from urllib.error import HTTPError, URLError
 
 import re
 
 import time
 
-from scholar import ScholarQuerier, ScholarSettings, SearchScholarQuery, ScholarConf, ScholarUtils, ScholarArticle
-from typing import List, Dict, Optional, Tuple, Set
+from scholar import ScholarQuerier, ScholarSettings, SearchScholarQuery, ScholarConf, ScholarUtils, ScholarArticle, \
+    ScholarRateLimiter, ScholarSession, ScholarMetrics, ScholarProfiler, ScholarPagePipeline
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Set
 
 Citations = Dict[str, Dict]
+# a range of publication years, None meaning no limit on that side
+Years = Tuple[Optional[int], Optional[int]]
+ALL_YEARS = (None, None)
+# where a range without a first year gets split evenly from when its first page shows no years
+SPLIT_FLOOR_YEAR = 1900
 
+PROGRESS_DB = "./.progress_cache.sqlite"
+# where versions before PROGRESS_DB saved their progress
 PIK = "./.pickle_cache.dat"
+# citations sorted in memory at most when writing the output, see sort_by_year
+SORT_BUFFER = 10000
+
+
+# fields of BibTeX entries we keep, any others are ignored
+BIBTEX_FIELDS = ('title', 'author', 'journal', 'booktitle', 'volume', 'number', 'pages', 'year', 'publisher')
+
+_BIBTEX_ENTRY = re.compile(r'@\s*(\w+)\s*[{(]\s*([^,\s]*)\s*,')
+_BIBTEX_FIELD = re.compile(r'\s*([A-Za-z][\w\-:.]*)\s*=\s*')
+# fast path for the usual case of a braced value without nested braces, separator included
+_BIBTEX_SIMPLE_FIELD = re.compile(r'\s*([A-Za-z][\w\-:.]*)\s*=\s*\{([^{}]*)\}\s*,?')
+_BIBTEX_BARE_VALUE = re.compile(r'[^,})\s]+')
+_BIBTEX_BRACES = re.compile(r'[{}]')
+_BIBTEX_QUOTE_OR_BRACES = re.compile(r'[{}"]')
+_BIBTEX_SEPARATOR = re.compile(r'\s*,?')
+_BIBTEX_END = re.compile(r'\s*[})]')
+_BIBTEX_LINE_BREAK = re.compile(r'\s*\n\s*')
+# where parsing picks up again after a malformed entry, rather than at an @ in one of its values
+_BIBTEX_NEXT_ENTRY = re.compile(r'^[ \t]*@', re.MULTILINE)
+
+
+def _read_bibtex_value(buffer: str, pos: int) -> Tuple[str, int]:
+    """
+    reads the field value starting at pos: {braced}, "quoted" or a bare word or number.
+    Braces nested inside the value are kept.
+    :return: the value and the position after it
+    """
+    if buffer.startswith('{', pos):
+        depth = 0
+        for match in _BIBTEX_BRACES.finditer(buffer, pos):
+            depth += 1 if match.group() == '{' else -1
+            if depth == 0:
+                return buffer[pos + 1:match.start()], match.end()
+        raise ValueError('unbalanced braces')
+    if buffer.startswith('"', pos):
+        depth = 0
+        for match in _BIBTEX_QUOTE_OR_BRACES.finditer(buffer, pos + 1):
+            char = match.group()
+            if char == '"' and depth == 0:
+                return buffer[pos + 1:match.start()], match.end()
+            if char != '"':
+                depth += 1 if char == '{' else -1
+        raise ValueError('unterminated quotes')
+    match = _BIBTEX_BARE_VALUE.match(buffer, pos)
+    if match is None:
+        raise ValueError('missing value')
+    return match.group(), match.end()
+
+
+def _read_bibtex_fields(buffer: str, pos: int) -> Tuple[Dict[str, str], int]:
+    """
+    reads the fields of the entry whose first field starts at pos, in whatever order
+    :return: dict of lower case field names to values and the position after the entry
+    """
+    fields = {}
+    while True:
+        match = _BIBTEX_SIMPLE_FIELD.match(buffer, pos)
+        if match is not None:
+            name, value = match.groups()
+            pos = match.end()
+        else:
+            match = _BIBTEX_FIELD.match(buffer, pos)
+            if match is None:
+                match = _BIBTEX_END.match(buffer, pos)
+                if match is None:
+                    raise ValueError('malformed entry')
+                return fields, match.end()
+            name = match.group(1)
+            value, pos = _read_bibtex_value(buffer, match.end())
+            pos = _BIBTEX_SEPARATOR.match(buffer, pos).end()
+        if '\n' in value:
+            value = _BIBTEX_LINE_BREAK.sub(' ', value)
+        name = name.lower()
+        if name not in fields:
+            fields[name] = value
+
+
+def iter_bibtex(buffer: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    parses every BibTeX entry in buffer in a single pass, skipping malformed ones
+    :param buffer: any number of entries, e.g. a whole .bib file
+    :return: iterator of (bibtex entry id, dict of fields) like :func:`bibtex_to_dict_key`
+    """
+    pos = 0
+    while True:
+        match = _BIBTEX_ENTRY.search(buffer, pos)
+        if match is None:
+            return
+        try:
+            fields, pos = _read_bibtex_fields(buffer, match.end())
+        except ValueError:
+            match = _BIBTEX_NEXT_ENTRY.search(buffer, match.end())
+            if match is None:
+                return
+            pos = match.start()
+            continue
+        # empty fields count as missing
+        bib_dict = {field: fields.get(field) or None for field in BIBTEX_FIELDS}
+        bib_dict['sort_year'] = bib_dict['year'] or '0'
+        yield match.group(2), bib_dict
+
+
+def is_bibtex(data: bytes) -> bool:
+    """
+    :return: whether a citation export holds a BibTeX entry, rather than e.g. an error page
+    """
+    try:
+        return next(iter_bibtex(data.decode('utf-8')), None) is not None
+    except UnicodeDecodeError:
+        return False
 
 
 def bibtex_to_dict_key(bibtex: str):
@@ -31,50 +159,41 @@ def bibtex_to_dict_key(bibtex: str):
     :param bibtex: the bibtex string
     :return: tuple with bibtex entry id and dict of other fields
     """
-    rex = ('@.+?\{(?P<id>.+?),\n'
-           '(?:.*title=\{(?P<title>.+?)\},?\n)?'
-           '(?:.*author=\{(?P<author>.+?)\},?\n)?'
-           '(?:.*journal=\{(?P<journal>.+?)\},?\n)?'
-           # for inproceedings entries:
-           '(?:.*booktitle=\{(?P<booktitle>.+?)\},?\n)?'
-           '(?:.*volume=\{(?P<volume>.+?)\},?\n)?'
-           '(?:.*number=\{(?P<number>.+?)\},?\n)?'
-           '(?:.*pages=\{(?P<pages>.+?)\},?\n)?'
-           '(?:.*year=\{(?P<year>.+?)\},?\n)?'
-           '(?:.*publisher=\{(?P<publisher>.+?)\},?\n)?'
-           '\}')
-    match = re.search(rex, bibtex)
-    if match is None:
-        raise ValueError
-    match_dict = {}
-    match_dict.update(match.groupdict())
-    bib_id = match_dict.pop('id')
-    match_dict['sort_year'] = match_dict['year'] or '0'
-    return bib_id, match_dict
+    with ScholarMetrics.timer('scholar_bibtex_parse_seconds'), ScholarProfiler.phase('bibtex'):
+        for bib_id, bib_dict in iter_bibtex(bibtex):
+            return bib_id, bib_dict
+    raise ValueError
 
 
 def url_from_article(article: ScholarArticle) -> Optional[str]:
     """
     Tries a few different possible urls. If all fail, then url is None
     """
-    url = article.attrs['url'][0]
+    url = article['url']
     if url:
         # sometimes url comes back with prefix that makes it invalid
         prefix = 'http://scholar.google.com/'
         url = url[len(prefix):] if url.startswith(prefix) else url
     else:
-        url = article.attrs['url_citations'][0]
+        url = article['url_citations']
     return url
 
 
-def make_dict_from_bibtex(querier: ScholarQuerier) -> Citations:
+def make_dict_from_bibtex(querier: ScholarQuerier, articles: Optional[List[ScholarArticle]] = None) -> Citations:
     """
-    turns all articles from query into a dictionary
-    :param querier: the querier object
+    turns all articles from query into a dictionary. The BibTeX of articles seen before,
+    e.g. co-authored with an author done earlier, comes from the querier's cluster index
+    :param querier: the querier object, in lazy citation mode or not
+    :param articles: the ones of the querier's articles to convert. Default is all of them
     :return: dict where keys are article ids, and val is dict of title, author, etc
     """
+    if articles is None:
+        articles = querier.articles
+    # get the BibTeX of all articles at once, it's concurrent if the querier allows
+    querier.fetch_citation_data(articles)
+
     out_dict = {}
-    for article in querier.articles:
+    for article in articles:
         try:
             bib_id, bib_dict = bibtex_to_dict_key(article.as_citation().decode('utf-8'))
         except ValueError:
@@ -84,84 +203,760 @@ def make_dict_from_bibtex(querier: ScholarQuerier) -> Citations:
     return out_dict
 
 
-def get_citations(author: str, options):
+def make_session(rate_limiter: Optional[ScholarRateLimiter] = None) -> ScholarSession:
     """
-    gets all citations for author
-    :param author: author's full name (e.g. 'benedict paten')
-    :param options: Namespace from argparse
-    :return: the dict format described in :func:`make_dict_from_bibtex`
+    creates a session set up for BibTeX exports, to be reused for many authors
+    :param rate_limiter: limiter shared by every querier of this run, if any
     """
     settings = ScholarSettings()
     settings.set_citation_format(ScholarSettings.CITFORM_BIBTEX)
+    session = ScholarSession(settings, rate_limiter)
+    # BibTeX is only downloaded for the articles make_dict_from_bibtex wants
+    session.querier.lazy_citations = True
+    # anything else isn't kept in the cache or the cluster index
+    session.querier.citation_check = is_bibtex
+    return session
+
+
+def article_key(article: ScholarArticle) -> Optional[str]:
+    """
+    :return: what tells the article apart in an author's results: its cluster id, or its
+        title for articles without one, such as [CITATION] entries
+    """
+    return article['cluster_id'] or article['title']
+
 
-    querier = ScholarQuerier()
-    querier.apply_settings(settings)
+def years_key(years: Years) -> str:
+    """
+    :return: how the progress store refers to a range of years, e.g. '1990-1999', or
+        '-1989' for all years up to 1989
+    """
+    return '-'.join('' if year is None else str(year) for year in years)
 
+
+def author_query(author: str, options, years: Years = ALL_YEARS) -> SearchScholarQuery:
+    """
+    :return: the query for the articles of author published in the given years
+    """
     query = SearchScholarQuery()
     query.set_author('"' + author + '"')
     if options.words:
         query.set_words(options.words)
     query.set_num_page_results(ScholarConf.MAX_PAGE_RESULTS)
+    query.set_timeframe(*years)
+    return query
+
+
+def split_years(years: Years, num_results: int, page_years: Iterable[int], slice_size: int) -> List[Years]:
+    """
+    splits a range of years into slices of about slice_size results each, going by its
+    number of results and assuming they spread evenly over the years. Slices that turn out
+    to have more get split again.
+    :param page_years: years of some of the results, to tell where a range without a first
+        year really starts. Any earlier results get a slice of their own. Without any in the
+        range, it's taken to start at SPLIT_FLOOR_YEAR
+    :return: the slices, covering the same years as the range, or none for a single year
+    """
+    first, last = years
+    high = time.localtime().tm_year if last is None else last
+    if first is None:
+        low = min((year for year in page_years if year <= high), default=SPLIT_FLOOR_YEAR)
+        if low > high:
+            # the range ends before the floor, and its results tell nothing more
+            return []
+        slices = [(None, low - 1)]
+    else:
+        low = first
+        slices = []
+    num_years = high - low + 1
+    count = min(-(-num_results // slice_size), num_years)
+    if count < 2 and not slices:
+        return []
+    starts = [low + num_years * i // count for i in range(count)]
+    ends = [start - 1 for start in starts[1:]] + [last]
+    return slices + list(zip(starts, ends))
+
+
+def iter_years_pages(author: str, years: Years, options, session: ScholarSession,
+                     store: Optional['ProgressStore'] = None, incremental: bool = False,
+                     stop: Optional[threading.Event] = None) -> Iterator[Tuple[Citations, List[Years]]]:
+    """
+    gets the citations of author published in a range of years page by page, see
+    :func:`iter_citation_pages`
+    :return: for every page as soon as it's parsed, its citations in the dict format described
+        in :func:`make_dict_from_bibtex`, and the slices to get instead of the range when it has
+        more than options.slice_size results. Then only its first page is fetched, and they come
+        with it. Other pages come with no slices. A page is committed to the store when the
+        next one is asked for
+    """
+    query = author_query(author, options, years)
 
     # iterate through pages of queries
-    output_dict = {}
-    num_results = 0
-    while True:
-        query.set_start(num_results)
+    if incremental:
+        query.set_sort_by_date(True)
+        known = store.known_articles(author)
+        last_total = store.num_results(author)
+        num_results = 0
+    else:
+        num_results = store.next_start(author, years) if store else 0
+        if num_results:
+            ScholarUtils.log('info', 'resuming {} at result {}'.format(author, num_results))
+    # once the number of results is known, the next pages get fetched ahead, see --prefetch
+    pipeline = None
+    try:
+        while True:
+            if stop is not None and stop.is_set():
+                raise ScrapeStopped()
+            page_query = pipeline.next_page() if pipeline else None
+            if page_query is None:
+                query.set_start(num_results)
+                session.send_query(query)
+            else:
+                query = page_query
+            articles = session.querier.articles
+            keys = [article_key(art) for art in articles]
+            if incremental:
+                articles = [art for art, key in zip(articles, keys) if key not in known]
+            page_dict = make_dict_from_bibtex(session.querier, articles)
+            total = query['num_results'] or 0
+            if not num_results and not incremental and total > options.slice_size:
+                slices = split_years(years, total, [int(art['year']) for art in articles if art['year']],
+                                     options.slice_size)
+                if slices:
+                    ScholarUtils.log('info', '{} has {} results in years {}, splitting them into {} slices'
+                                     .format(author, total, years_key(years), len(slices)))
+                    yield page_dict, slices
+                    if store:
+                        store.save_page(author, None, page_dict, keys)
+                    return
+                if total > ScholarConf.MAX_RESULTS:
+                    ScholarUtils.log('warn', 'only the first {} of the {} results of {} in {} can be fetched'
+                                     .format(ScholarConf.MAX_RESULTS, total, author, years_key(years)))
+            num_results += ScholarConf.MAX_PAGE_RESULTS
+            yield page_dict, []
+            # only now that the page was taken, or it would be skipped after a restart
+            if store:
+                # refreshes start over from the first page, they have no cursor to move
+                store.save_page(author, None if incremental else num_results, page_dict, keys, years)
 
-        querier.send_query(query)
-        page_dict = make_dict_from_bibtex(querier)
+            if len(session.querier.articles) < ScholarConf.MAX_PAGE_RESULTS:
+                break
+            if incremental:
+                if not articles:
+                    break
+                if num_results == ScholarConf.MAX_PAGE_RESULTS and query['num_results'] == last_total:
+                    ScholarUtils.log('info', '{} has as many results as last time'.format(author))
+                    break
+            elif pipeline is None and options.prefetch:
+                # refreshes usually stop after a page or two, fetching ahead would be a waste
+                page_queries = []
+                for start in range(num_results, min(total, ScholarConf.MAX_RESULTS), ScholarConf.MAX_PAGE_RESULTS):
+                    page_queries.append(author_query(author, options, years))
+                    page_queries[-1].set_start(start)
+                pipeline = ScholarPagePipeline(session, page_queries, options.prefetch)
+    finally:
+        if pipeline:
+            pipeline.close()
+    if incremental and query['num_results'] is not None:
+        store.set_num_results(author, query['num_results'])
+    if store and years != ALL_YEARS:
+        store.complete_slice(author, years)
 
-        if not page_dict or len(querier.articles) < ScholarConf.MAX_PAGE_RESULTS:
-            break
 
-        output_dict.update(page_dict)
-        num_results += ScholarConf.MAX_PAGE_RESULTS
-    return output_dict
+class ScrapeStopped(Exception):
+    """
+    raised in a thread scraping pages once it's told to stop, before it fetches another page
+    """
 
 
-def load_progress() -> Tuple[Set[str], Citations]:
+class PageStream:
     """
-    Uses the cache file PIK to try and load any progress from a previous run of
-    the program that may have failed
+    Hands the pages of citations scraped by a pool of worker threads to the thread iterating
+    over the stream, as they come. Every job submitted gets a callable to pass its pages to as
+    its first argument, which returns once the page was taken, i.e. the iterating thread asked
+    for the next item, so the job may commit it then. Each worker has a page waiting at most.
+    Once a job is done, its future comes through the stream as well, after its pages, so its
+    result can be acted on
+    """
+
+    def __init__(self, workers: int):
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.queue = Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.stopped = False
+        # set when the iterating thread has taken the page last handed to it
+        self.handed = None
+
+    def submit(self, fn, *args):
+        future = self.pool.submit(fn, self.emit, *args)
+        self.pending.add(future)
+        future.add_done_callback(self.queue.put)
+
+    def emit(self, page):
+        """
+        passes a page to the iterating thread, waiting until it was taken
+        :raises ScrapeStopped: if the stream was closed before the page was taken
+        """
+        taken = threading.Event()
+        with self.lock:
+            if self.stopped:
+                raise ScrapeStopped()
+            self.queue.put((page, taken))
+        taken.wait()
+        if self.stopped:
+            raise ScrapeStopped()
+
+    def __iter__(self) -> Iterator:
+        """
+        :return: pages and the futures of finished jobs, until all jobs submitted are done
+        """
+        from concurrent.futures import Future
+        while self.pending:
+            item = self.queue.get()
+            if isinstance(item, Future):
+                self.pending.discard(item)
+                yield item
+                continue
+            page, self.handed = item
+            yield page
+            self.handed.set()
+
+    def close(self):
+        """
+        stops the jobs, those running once they are done with the page they are on, which
+        doesn't get committed unless it was taken, and waits for them
+        """
+        with self.lock:
+            self.stopped = True
+        if self.handed is not None:
+            self.handed.set()
+        while not self.queue.empty():
+            item = self.queue.get()
+            if isinstance(item, tuple):
+                item[1].set()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
 
-    :return: tuple of set of completed authors and
+def iter_citation_pages(author: str, options, session: Optional[ScholarSession] = None,
+                        store: Optional['ProgressStore'] = None, incremental: bool = False,
+                        stop: Optional[threading.Event] = None) -> Iterator[Citations]:
     """
+    gets all citations for author, page by page. Scholar serves no more than
+    ScholarConf.MAX_RESULTS results of a query, so when an author has more than
+    options.slice_size, the query gets split into slices by year of publication, which are
+    scraped options.slice_workers at a time
+    :param author: author's full name (e.g. 'benedict paten')
+    :param options: Namespace from argparse
+    :param session: session from :func:`make_session` to reuse. A new one is made if not given
+    :param store: if given, every page is committed to it once the caller asks for the next
+        one, and paging resumes from the offset it recorded for this author, or for each of its
+        slices. Pages get delivered at least once: one the caller stopped on before asking for
+        the next comes again after a restart
+    :param incremental: only look for articles the store doesn't know of yet, for an author
+        completed before. Results come newest first, and paging stops at the first page
+        without new articles, or after the first page if the number of results is the same
+        as at the last refresh. Needs a store
+    :param stop: if given, paging stops with :class:`ScrapeStopped` once it's set, before
+        another page gets fetched
+    :return: the citations of every page fetched, in the dict format described in
+        :func:`make_dict_from_bibtex`, as soon as it's parsed. The pages of slices come in
+        the order they are parsed in
+    """
+    from concurrent.futures import Future
+    session = session or make_session()
+    todo = []
+    for page, todo in iter_years_pages(author, ALL_YEARS, options, session, store, incremental, stop):
+        yield page
+    if not todo:
+        return
+
+    done = store.completed_slices(author) if store else set()
+    # the caller's session plus one more per extra worker
+    sessions = Queue()
+    sessions.put(session)
+    for _ in range(options.slice_workers - 1):
+        sessions.put(make_session(session.querier.rate_limiter))
+
+    def get_years_pooled(emit, years):
+        pooled = sessions.get()
+        try:
+            slices = []
+            with closing(iter_years_pages(author, years, options, pooled, store, stop=stop)) as pages:
+                for page, slices in pages:
+                    emit(page)
+            return slices
+        finally:
+            sessions.put(pooled)
+
+    stream = PageStream(options.slice_workers)
     try:
-        # find out which authors have been completed already (load set from file)
-        with open(PIK, 'rb') as fd:
-            # assume that first thing pickled was set of authors
+        for years in todo:
+            if years_key(years) not in done:
+                stream.submit(get_years_pooled, years)
+        for item in stream:
+            if not isinstance(item, Future):
+                yield item
+                continue
+            for years in item.result():
+                if years_key(years) not in done:
+                    stream.submit(get_years_pooled, years)
+    finally:
+        stream.close()
+        while not sessions.empty():
+            pooled = sessions.get()
+            if pooled is not session:
+                pooled.close()
+
+
+def iter_citations(author: str, options, session: Optional[ScholarSession] = None,
+                   store: Optional['ProgressStore'] = None, incremental: bool = False,
+                   stop: Optional[threading.Event] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    gets all citations for author, see :func:`iter_citation_pages`
+    :return: (bib id, citation dict) pairs, those of each page as soon as it's parsed. A page
+        is committed to the store once all of its citations were taken
+    """
+    for page in iter_citation_pages(author, options, session, store, incremental, stop):
+        yield from page.items()
+
+
+def get_citations(author: str, options, session: Optional[ScholarSession] = None,
+                  store: Optional['ProgressStore'] = None, incremental: bool = False,
+                  stop: Optional[threading.Event] = None) -> Citations:
+    """
+    gets all citations for author, see :func:`iter_citation_pages`
+    :return: the dict format described in :func:`make_dict_from_bibtex`, for the pages
+        fetched by this call
+    """
+    return dict(iter_citations(author, options, session, store, incremental, stop))
+
+
+class ProgressStore:
+    """
+    Scraping progress, kept in an SQLite database in WAL mode. Each page of results is
+    committed in its own transaction along with the offset of the next page, so a run
+    that dies for any reason loses at most the page it was working on, and the next run
+    resumes every author where it stopped. Citations stay on disk until asked for.
+
+    A store may be shared by several threads.
+    """
+
+    # WAL needs the database on a local file system
+    JOURNAL_MODE = 'WAL'
+    # seconds to wait for other connections to finish writing
+    BUSY_TIMEOUT = 5
+
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS authors (name TEXT PRIMARY KEY, completed INTEGER NOT NULL)',
+              # offset of the next page to fetch, for authors not completed yet
+              'CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, next_start INTEGER NOT NULL)',
+              'CREATE TABLE IF NOT EXISTS citations (bib_id TEXT PRIMARY KEY, data TEXT NOT NULL)',
+              # watermark of incremental refreshes: article_key() of every article found for an author
+              'CREATE TABLE IF NOT EXISTS known_articles (name TEXT NOT NULL, article TEXT NOT NULL, '
+              'PRIMARY KEY (name, article))',
+              # number of results the last incremental refresh of an author reported
+              'CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, num_results INTEGER NOT NULL)',
+              # the same as cursors and authors, for the year slices of authors with too many results
+              # for one query, see get_citations. Slices that got split again are not recorded
+              'CREATE TABLE IF NOT EXISTS slices (name TEXT NOT NULL, years TEXT NOT NULL, '
+              'next_start INTEGER NOT NULL, completed INTEGER NOT NULL, PRIMARY KEY (name, years))')
+
+    def __init__(self, path: str = PROGRESS_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        # autocommit mode, transactions are started explicitly
+        self.conn = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode={}'.format(self.JOURNAL_MODE))
+        # with WAL this is still safe against crashes of the program, only a power
+        # loss can roll back the last few commits
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+
+    def completed_authors(self) -> Set[str]:
+        with self.lock:
+            return {name for name, in self.conn.execute('SELECT name FROM authors WHERE completed')}
+
+    def next_start(self, author: str, years: Years = ALL_YEARS) -> int:
+        with self.lock:
+            if years == ALL_YEARS:
+                row = self.conn.execute('SELECT next_start FROM cursors WHERE name = ?', (author,)).fetchone()
+            else:
+                row = self.conn.execute('SELECT next_start FROM slices WHERE name = ? AND years = ?',
+                                        (author, years_key(years))).fetchone()
+        return row[0] if row else 0
+
+    def save_page(self, author: str, next_start: Optional[int], citations: Citations,
+                  articles: Iterable[Optional[str]] = (), years: Years = ALL_YEARS):
+        """
+        atomically adds the citations of one page and moves the author's cursor past it
+        :param next_start: the new cursor, or None to leave it alone
+        :param articles: article_key() of every article on the page, for known_articles()
+        :param years: the slice of the author's results the page is from, if any
+        """
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO citations VALUES (?, ?)',
+                                  [(bib_id, json.dumps(bib_dict)) for bib_id, bib_dict in citations.items()])
+            self.conn.executemany('INSERT OR IGNORE INTO known_articles VALUES (?, ?)',
+                                  [(author, key) for key in articles if key is not None])
+            if next_start is not None and years == ALL_YEARS:
+                self.conn.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (author, next_start))
+            elif next_start is not None:
+                self.conn.execute('INSERT OR REPLACE INTO slices VALUES (?, ?, ?, 0)',
+                                  (author, years_key(years), next_start))
+
+    def known_articles(self, author: str) -> Set[str]:
+        with self.lock:
+            return {key for key, in self.conn.execute('SELECT article FROM known_articles WHERE name = ?',
+                                                      (author,))}
+
+    def num_results(self, author: str) -> Optional[int]:
+        with self.lock:
+            row = self.conn.execute('SELECT num_results FROM totals WHERE name = ?', (author,)).fetchone()
+        return row[0] if row else None
+
+    def set_num_results(self, author: str, num_results: int):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO totals VALUES (?, ?)', (author, num_results))
+
+    def completed_slices(self, author: str) -> Set[str]:
+        """
+        :return: years_key() of the author's year slices completed so far
+        """
+        with self.lock:
+            return {years for years, in self.conn.execute('SELECT years FROM slices WHERE name = ? AND completed',
+                                                          (author,))}
+
+    def complete_slice(self, author: str, years: Years):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO slices VALUES (?, ?, 0, 1)', (author, years_key(years)))
+
+    def complete_author(self, author: str):
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('INSERT OR REPLACE INTO authors VALUES (?, 1)', (author,))
+            self.conn.execute('DELETE FROM cursors WHERE name = ?', (author,))
+            self.conn.execute('DELETE FROM slices WHERE name = ?', (author,))
+
+    def iter_citations(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        yields (bib id, citation dict) pairs one at a time, without loading the others
+        """
+        # a connection of its own, so other threads can keep writing meanwhile
+        conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT)
+        try:
+            for bib_id, data in conn.execute('SELECT bib_id, data FROM citations'):
+                yield bib_id, json.loads(data)
+        finally:
+            conn.close()
+
+    def citations(self) -> Citations:
+        return dict(self.iter_citations())
+
+    def import_pickle(self, path: str):
+        """
+        imports the progress saved by older versions of this program to the pickle cache file
+        """
+        import pickle
+        with open(path, 'rb') as fd:
+            # first thing pickled was set of authors, then the citations
             completed_authors = pickle.load(fd)
-            # initialize output_dict with already completed author dicts
             output_dict = pickle.load(fd)
-            ScholarUtils.log('info', 'Successfully loaded {} author{} from cache file'
-                             .format(len(completed_authors),
-                                     '' if len(completed_authors) == 1 else 's'))
-    except FileNotFoundError:
-        # nothing to load... start from scratch
-        ScholarUtils.log('info', 'No cache file found. Expected file called {}'.format(PIK))
-        completed_authors = set()
-        output_dict = {}
-    return completed_authors, output_dict
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO citations VALUES (?, ?)',
+                                  [(bib_id, json.dumps(bib_dict)) for bib_id, bib_dict in output_dict.items()])
+            self.conn.executemany('INSERT OR REPLACE INTO authors VALUES (?, 1)',
+                                  [(author,) for author in completed_authors])
+
+    def close(self):
+        self.conn.close()
 
 
-def save_progress(completed_authors: Set[str], output_dict: Citations):
+class WorkQueue(ProgressStore):
     """
-    over writes any current PIK cache file with any new authors and their citations
+    A progress store shared by any number of scraper processes, on this host or others,
+    along with the authors they have to scrape. A process leases one author at a time and
+    keeps renewing the lease while it works on it. Leases that aren't renewed in time (say
+    the process died) expire, and the author goes to the next process asking for work,
+    which resumes from the last page committed.
+
+    The file may be on shared storage, so it uses a rollback journal instead of WAL.
+    Leases expire by wall clock time, so the clocks of the hosts should agree to within a
+    small part of the lease duration.
     """
-    with open(PIK, 'wb') as fd:
-        pickle.dump(completed_authors, fd)
-        pickle.dump(output_dict, fd)
-    # exit with warning explaining what happened
-    ScholarUtils.log('info', 'Google blocked us, progress saved to {}'.format(PIK))
+
+    JOURNAL_MODE = 'DELETE'
+    BUSY_TIMEOUT = 60
+
+    SCHEMA = ProgressStore.SCHEMA + (
+        # authors in the order they were queued. worker and lease_expires are set while leased
+        'CREATE TABLE IF NOT EXISTS work (author TEXT PRIMARY KEY, worker TEXT, lease_expires REAL, '
+        'done INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0)',)
+
+    def enqueue(self, authors: Iterable[str]):
+        """
+        adds authors not queued yet
+        """
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('INSERT OR IGNORE INTO work (author) VALUES (?)', [(a,) for a in authors])
+
+    def lease(self, worker: str, duration: float) -> Optional[str]:
+        """
+        leases the next author that is neither done nor leased by another worker
+        :param worker: name of the worker, unique across hosts
+        :param duration: seconds until the lease expires unless renewed
+        :return: the author, None if there is nothing to lease right now
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            # take the write lock right away, so no other process can lease the same author
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute('SELECT author, worker FROM work WHERE NOT done AND '
+                                    '(lease_expires IS NULL OR lease_expires < ?) ORDER BY rowid LIMIT 1',
+                                    (now,)).fetchone()
+            if row is None:
+                return None
+            author, previous = row
+            self.conn.execute('UPDATE work SET worker = ?, lease_expires = ?, attempts = attempts + 1 '
+                              'WHERE author = ?', (worker, now + duration, author))
+        if previous is not None:
+            ScholarUtils.log('info', 'the lease of {} on {} expired'.format(previous, author))
+        return author
+
+    def renew(self, author: str, worker: str, duration: float) -> bool:
+        """
+        :return: whether the worker still had the lease, which now lasts another duration seconds
+        """
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            cursor = self.conn.execute('UPDATE work SET lease_expires = ? WHERE author = ? AND worker = ? '
+                                       'AND NOT done', (time.time() + duration, author, worker))
+            return cursor.rowcount == 1
+
+    def release(self, author: str, worker: str):
+        """
+        gives the author back for other workers to lease
+        """
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('UPDATE work SET worker = NULL, lease_expires = NULL '
+                              'WHERE author = ? AND worker = ?', (author, worker))
+
+    def complete_author(self, author: str):
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('INSERT OR REPLACE INTO authors VALUES (?, 1)', (author,))
+            self.conn.execute('DELETE FROM cursors WHERE name = ?', (author,))
+            self.conn.execute('DELETE FROM slices WHERE name = ?', (author,))
+            self.conn.execute('UPDATE work SET done = 1, worker = NULL, lease_expires = NULL WHERE author = ?',
+                              (author,))
+
+    def status(self) -> Tuple[int, int, int]:
+        """
+        :return: numbers of authors waiting, leased and done
+        """
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute('SELECT done, lease_expires FROM work').fetchall()
+        waiting = sum(1 for done, expires in rows if not done and (expires is None or expires < now))
+        done = sum(1 for done, _ in rows if done)
+        return waiting, len(rows) - waiting - done, done
 
 
-def get_citations_authors(authors: List[str], options):
-    completed_authors, output_dict = load_progress()
+def keep_lease(queue: WorkQueue, author: str, worker: str, duration: float, stop: threading.Event):
+    """
+    renews the worker's lease on author every third of its duration until stop is set
+    """
+    while not stop.wait(duration / 3):
+        if not queue.renew(author, worker, duration):
+            ScholarUtils.log('warn', 'lost the lease on {}, another worker may be scraping it too'.format(author))
+            return
+
+
+def work_queue(queue: WorkQueue, options, rate_limiter: Optional[ScholarRateLimiter], worker: str,
+               stop_work: threading.Event):
+    """
+    scrapes authors leased from the queue until all of them are done, by this worker or others,
+    or until stop_work is set. Then the author being scraped is released after the page at hand
+    """
+    session = make_session(rate_limiter)
+    try:
+        while not stop_work.is_set():
+            author = queue.lease(worker, options.lease)
+            if author is None:
+                waiting, leased, _ = queue.status()
+                if not waiting and not leased:
+                    return
+                # the authors of other workers come back if their leases expire
+                stop_work.wait(min(options.lease / 3, 30))
+                continue
+
+            stop = threading.Event()
+            threading.Thread(target=keep_lease, args=(queue, author, worker, options.lease, stop),
+                             daemon=True).start()
+            try:
+                ScholarUtils.log('info', 'getting citations for {}...'.format(author))
+                new_citations = get_citations(author, options, session, queue, stop=stop_work)
+            except ScrapeStopped:
+                queue.release(author, worker)
+                return
+            except BaseException:
+                # let others have the author now rather than when the lease expires
+                queue.release(author, worker)
+                raise
+            finally:
+                stop.set()
+            ScholarUtils.log('info', '... {} citations found (some may be duplicates from other authors)'
+                             .format(len(new_citations)))
+            queue.complete_author(author)
+    finally:
+        session.close()
+
+
+def scrape_queue(authors: List[str], options) -> WorkQueue:
+    """
+    queues the authors in the options.queue file, unless already there, and scrapes them
+    along with any other processes working on the same queue
+    :return: the queue, holding the citations of all its authors
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    queue = WorkQueue(options.queue)
+    queue.enqueue(authors)
+    rate_limiter = ScholarRateLimiter(options.rate) if options.rate else None
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    stop_work = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=options.workers)
+    futures = [pool.submit(work_queue, queue, options, rate_limiter, '{}:{}'.format(worker, i), stop_work)
+               for i in range(options.workers)]
+    with handle_interruptions():
+        try:
+            for future in as_completed(futures):
+                future.result()
+        finally:
+            # if one worker failed, the others stop after the page they are working on
+            stop_work.set()
+            pool.shutdown(wait=True)
+    return queue
+
+
+@contextmanager
+def handle_interruptions():
+    """
+    exits with a message when Google blocks us, can't be reached or the user hits ^C
+    """
+    try:
+        yield
+    except HTTPError:
+        # only raised once Scholar kept blocking us through all retries
+        print('Google API blocked us. Progress was saved. To get around this use the '
+              '--cookie-file option. More info with --help.', file=sys.stderr)
+        exit(1)
+    except URLError as err:
+        # connection failures, likewise
+        print('Could not reach Google Scholar ({}). Progress was saved.'.format(err.reason), file=sys.stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        print('User forced quit. Progress was saved.', file=sys.stderr)
+        exit(1)
+
+
+def load_progress() -> ProgressStore:
+    """
+    Opens the progress store PROGRESS_DB left by previous runs of the program that may
+    have failed, creating it if needed. Progress saved to the old pickle cache file PIK
+    is imported into it once.
+    """
+    store = ProgressStore(PROGRESS_DB)
+    if os.path.exists(PIK):
+        store.import_pickle(PIK)
+        os.replace(PIK, PIK + '.imported')
+        ScholarUtils.log('info', 'Imported old cache file {} into {}'.format(PIK, PROGRESS_DB))
+    completed_authors = store.completed_authors()
+    ScholarUtils.log('info', 'Successfully loaded {} author{} from {}'
+                     .format(len(completed_authors), '' if len(completed_authors) == 1 else 's', PROGRESS_DB))
+    return store
+
+
+def iter_citation_pages_parallel(authors: List[str], options, rate_limiter: Optional[ScholarRateLimiter],
+                                 store: Optional[ProgressStore], refresh: Set[str] = frozenset()) -> Iterator[Citations]:
+    """
+    scrapes authors with a pool of options.workers queriers. Authors are marked
+    completed in the calling thread as workers finish.
+    :param refresh: the authors to scrape incrementally, see :func:`iter_citation_pages`
+    :return: the citations of every page, as soon as it's parsed
+    """
+    from concurrent.futures import Future
+    # one session per worker, each reused for all the authors the worker gets
+    sessions = Queue()
+    for _ in range(options.workers):
+        sessions.put(make_session(rate_limiter))
+
+    def get_citations_pooled(emit, author):
+        session = sessions.get()
+        try:
+            found = set()
+            with closing(iter_citation_pages(author, options, session, store, author in refresh)) as pages:
+                for page in pages:
+                    emit(page)
+                    found.update(page)
+            return author, len(found)
+        finally:
+            sessions.put(session)
+
+    stream = PageStream(options.workers)
+    try:
+        for author in authors:
+            stream.submit(get_citations_pooled, author)
+        for item in stream:
+            if not isinstance(item, Future):
+                yield item
+                continue
+            author, num_found = item.result()
+            ScholarUtils.log('info', 'citations for {}: {} found (some may be duplicates from other authors)'
+                             .format(author, num_found))
+            if store:
+                store.complete_author(author)
+    finally:
+        # stop the workers if one of them failed or the caller stopped asking for pages
+        stream.close()
+        # settings are kept in the cookies, so later runs don't have to apply them
+        while not sessions.empty():
+            sessions.get().close()
+
+
+def iter_citation_pages_authors(authors: List[str], options,
+                                store: Optional[ProgressStore] = None) -> Iterator[Citations]:
+    """
+    scrapes the citations of the authors not completed by earlier runs into the progress store,
+    options.workers authors at a time. With options.incremental, the completed ones get checked
+    for new articles as well
+    :param store: the progress store, see :func:`load_progress`. Without one, all the authors
+        get scraped from the start, and nothing is saved
+    :return: the citations of every page, as soon as it's parsed and committed to the store
+    """
+    completed_authors = store.completed_authors() if store else set()
+    # one limiter for the whole run, however many queriers share it
+    rate_limiter = ScholarRateLimiter(options.rate) if options.rate else None
+    if options.incremental:
+        remaining = authors
+        refresh = {x for x in authors if x in completed_authors}
+    else:
+        remaining = [x for x in authors if x not in completed_authors]
+        refresh = set()
+    if options.workers > 1:
+        yield from iter_citation_pages_parallel(remaining, options, rate_limiter, store, refresh)
+        return
+
+    session = make_session(rate_limiter)
     try:
         # iterate through authors and get citations
         first = True
-        for author in [x for x in authors if x not in completed_authors]:
+        for author in remaining:
             # wait, hopefully to prevent getting blocked by the API
             if not first and options.wait:
                 time.sleep(options.wait)
@@ -169,25 +964,193 @@ def get_citations_authors(authors: List[str], options):
                 first = False
 
             ScholarUtils.log('info', 'getting citations for {}...'.format(author))
-            new_citations = get_citations(author, options)
+            found = set()
+            for page in iter_citation_pages(author, options, session, store, author in refresh):
+                yield page
+                found.update(page)
             ScholarUtils.log('info', '... {} citations found (some may be duplicates from other authors)'
-                             .format(len(new_citations)))
-            output_dict.update(new_citations)
-            # add a completed author to the set of completed authors
-            completed_authors.add(author)
-        return output_dict
-
-    except HTTPError as err:
-        assert err.code == 503
-        save_progress(completed_authors, output_dict)
-        print('Google API blocked us. Progress was saved. To get around this use the '
-              '--cookie-file option. More info with --help.')
-        exit(1)
-    except KeyboardInterrupt:
-        save_progress(completed_authors, output_dict)
-        print('User forced quit. Progress was saved.')
+                             .format(len(found)))
+            if store:
+                store.complete_author(author)
+    finally:
+        # settings are kept in the cookies, so later runs don't have to apply them
+        session.close()
+
+
+def iter_citations_authors(authors: List[str], options,
+                           store: Optional[ProgressStore] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    scrapes the citations of the authors, see :func:`iter_citation_pages_authors`
+    :return: (bib id, citation dict) pairs, those of each page as soon as it's parsed. Citations
+        of several authors come only once
+    """
+    seen = set()
+    for page in iter_citation_pages_authors(authors, options, store):
+        for bib_id, curr in page.items():
+            if bib_id not in seen:
+                seen.add(bib_id)
+                yield bib_id, curr
+
+
+def scrape_authors(authors: List[str], options) -> ProgressStore:
+    """
+    scrapes the citations of the authors into the progress store, see
+    :func:`iter_citation_pages_authors`
+    :return: the store, holding the citations of all the authors
+    """
+    store = load_progress()
+    with handle_interruptions():
+        for _ in iter_citation_pages_authors(authors, options, store):
+            pass
+    return store
+
+
+def stream_authors(authors: List[str], options) -> ProgressStore:
+    """
+    scrapes the citations of the authors like :func:`scrape_authors`, writing each one to the
+    options.jsonl file ('-' for stdout) as soon as its page is parsed
+    :return: the store, holding the citations of all the authors
+    """
+    store = load_progress()
+    render = TEMPLATES['jsonl'].render
+    fh = sys.stdout if options.jsonl == '-' else open(options.jsonl, 'w', encoding='utf-8')
+    try:
+        with handle_interruptions():
+            for _, curr in iter_citations_authors(authors, options, store):
+                fh.write(render(curr))
+                # whoever reads the stream gets every citation right away
+                fh.flush()
+    except BrokenPipeError:
+        # the reader went away, e.g. head. Don't complain about stdout again on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        print('The --jsonl reader stopped reading. Progress was saved.', file=sys.stderr)
         exit(1)
-    save_progress(completed_authors, output_dict)
+    finally:
+        if fh is not sys.stdout:
+            fh.close()
+    return store
+
+
+def get_citations_authors(authors: List[str], options) -> Citations:
+    return scrape_authors(authors, options).citations()
+
+
+class CitationTemplate:
+    """
+    Renders citation dicts from a list of fragments, each kept only when the fields it needs
+    are present (not None) and those it excludes are absent. The fragments kept for a given
+    set of present fields are joined into a single format string the first time that set
+    comes up, and reused for every other citation with the same fields.
+    """
+
+    # fields a template may use, in the order they appear in JSON lines
+    FIELDS = BIBTEX_FIELDS + ('url',)
+
+    def __init__(self, fragments: List[Tuple[Tuple[str, ...], Tuple[str, ...], str]], escape=None,
+                 field_escapes: Optional[Dict] = None):
+        """
+        :param fragments: (fields required, fields excluded, format string) triples
+        :param escape: function returning a value the way it's inserted. Default inserts values
+            as they are
+        :param field_escapes: dict of field names to functions used instead of escape
+        """
+        self.fragments = fragments
+        self.escape = escape or str
+        self.field_escapes = field_escapes or {}
+        # present fields -> format method of the format string, escape function of each field
+        self.compiled = {}
+
+    def compile(self, present: Tuple[str, ...]) -> str:
+        """
+        :return: the format string for citations with exactly the present fields
+        """
+        return ''.join(text for required, excluded, text in self.fragments
+                       if all(f in present for f in required) and not any(f in present for f in excluded))
+
+    def render(self, curr: Dict) -> str:
+        present = tuple([f for f in self.FIELDS if curr.get(f) is not None])
+        compiled = self.compiled.get(present)
+        if compiled is None:
+            compiled = self.compiled[present] = self._compile_positional(present)
+        fmt, escapes = compiled
+        return fmt(*[escape(curr[f]) for f, escape in escapes])
+
+    def _compile_positional(self, present: Tuple[str, ...]):
+        # positional arguments are quicker to pass than keywords
+        positions = {f: i for i, f in enumerate(present)}
+        fmt = ''
+        for literal, field, _, _ in string.Formatter().parse(self.compile(present)):
+            fmt += literal.replace('{', '{{').replace('}', '}}')
+            if field is not None:
+                fmt += '{%d}' % positions[field]
+        escapes = [(f, self.field_escapes.get(f, self.escape)) for f in present]
+        return fmt.format, escapes
+
+
+class JsonLinesTemplate(CitationTemplate):
+    """
+    renders each citation as a JSON object of its present fields, on a line of its own
+    """
+
+    def __init__(self):
+        super().__init__([], json.JSONEncoder(ensure_ascii=False).encode)
+
+    def compile(self, present: Tuple[str, ...]) -> str:
+        return '{{' + ', '.join('"{0}": {{{0}}}'.format(f) for f in present) + '}}\n'
+
+
+_MARKDOWN_SPECIAL = re.compile(r'[\\`*_\[\]<>|#]')
+
+
+def _escape_markdown(value: str) -> str:
+    return _MARKDOWN_SPECIAL.sub(lambda match: '\\' + match.group(), value)
+
+
+def _escape_markdown_url(value: str) -> str:
+    return value.replace('(', '%28').replace(')', '%29').replace(' ', '%20')
+
+
+TEMPLATES = {
+    # the html snippets this program always wrote
+    'html': CitationTemplate([
+        (('author',), (), '{author}; '),
+        (('title', 'url'), (), '<strong><a href="{url}">{title}</a></strong>. '),
+        (('title',), ('url',), '<strong>{title}</strong>. '),
+        (('journal',), (), '<i>{journal}</i>. '),
+        ((), (), '<strong>'),
+        (('volume',), (), '{volume}'),
+        (('number',), (), '-{number}'),
+        (('volume',), (), '</strong>. '),
+        (('number',), ('volume',), '</strong>. '),
+        ((), ('volume', 'number'), '</strong> '),
+        (('pages',), (), '{pages} '),
+        (('year',), (), '({year}) '),
+        (('publisher',), (), '{publisher}'),
+        ((), (), '\n\n'),
+    ], html.escape),
+    'markdown': CitationTemplate([
+        (('author',), (), '{author}; '),
+        (('title', 'url'), (), '**[{title}]({url})**. '),
+        (('title',), ('url',), '**{title}**. '),
+        (('journal',), (), '*{journal}*. '),
+        (('volume', 'number'), (), '**{volume}-{number}**. '),
+        (('volume',), ('number',), '**{volume}**. '),
+        (('number',), ('volume',), '**-{number}**. '),
+        (('pages',), (), '{pages} '),
+        (('year',), (), '({year}) '),
+        (('publisher',), (), '{publisher}'),
+        ((), (), '\n\n'),
+    ], _escape_markdown, {'url': _escape_markdown_url}),
+    'jsonl': JsonLinesTemplate(),
+}
+
+
+def citation_to_txt(curr: Dict) -> str:
+    """
+    expects the citation to be an article. Not prepared to handle other things
+    :return: the html formatted citation
+    """
+    return TEMPLATES['html'].render(curr)
 
 
 def dict_to_txt_lines(cit_dict: Citations) -> List[str]:
@@ -195,32 +1158,84 @@ def dict_to_txt_lines(cit_dict: Citations) -> List[str]:
     expects the citations to be articles only. Not prepared to handle other things
     :return: an html formatted string with all of the citations from input
     """
-    output = []
-    for key in sorted(cit_dict, key=lambda k: cit_dict[k]['sort_year'], reverse=True):
-        curr = cit_dict[key]
-        cit_html = ''
-        split_string = ['{author}; ',
-                        '<strong><a href="{url}">{title}</a></strong>. ' if curr['url']
-                        else '<strong>{title}</strong>. ',
-                        '<i>{journal}</i>. ',
-                        '<strong>',
-                        '{volume}',
-                        '-{number}',
-                        '</strong>. ' if curr['volume'] or curr['number'] else '</strong> ',
-                        '{pages} ',
-                        '({year}) ',
-                        '{publisher}',
-                        '\n\n']
-        # we want to filter out fields if they are empty
-        for s in split_string:
-            s = s.format(**curr)
-            if 'None' not in s:
-                cit_html += s
-
-        output.append(cit_html)
+    with ScholarMetrics.timer('scholar_render_seconds', format='html'), ScholarProfiler.phase('render'):
+        output = [citation_to_txt(curr) for curr in sort_by_year(cit_dict.values())]
+    ScholarMetrics.inc('scholar_rendered_citations_total', len(output))
     return output
 
 
+def sort_by_year(citations: Iterable[Dict], max_in_memory: Optional[int] = None) -> Iterator[Dict]:
+    """
+    sorts citations by year, most recent first, in the order given within a year. Beyond
+    max_in_memory citations, sorted runs of that many get spilled to temporary files and
+    merged from there, so memory use doesn't grow with the number of citations
+    :param citations: any iterable of citation dicts, e.g. straight from the progress store
+    :param max_in_memory: the maximum number of citations held in memory. No limit if None
+    """
+    sort_key = itemgetter('sort_year')
+    if max_in_memory is None:
+        yield from sorted(citations, key=sort_key, reverse=True)
+        return
+
+    with ExitStack() as stack:
+        runs = []
+        chunk = []
+        for curr in citations:
+            chunk.append(curr)
+            if len(chunk) >= max_in_memory:
+                runs.append(_spill_run(stack, sorted(chunk, key=sort_key, reverse=True)))
+                chunk = []
+        chunk.sort(key=sort_key, reverse=True)
+        if not runs:
+            yield from chunk
+            return
+        if chunk:
+            runs.append(_spill_run(stack, chunk))
+        ScholarUtils.log('info', 'merging {} sorted runs of citations'.format(len(runs)))
+        # merge keeps ties in the order of the runs, so the sort stays stable
+        yield from heapq.merge(*(map(json.loads, run) for run in runs), key=sort_key, reverse=True)
+
+
+def _spill_run(stack: ExitStack, run: List[Dict]):
+    """
+    writes a sorted run of citations to a temporary file, one JSON object per line
+    :return: the file, positioned at its start
+    """
+    fd = stack.enter_context(tempfile.TemporaryFile('w+', encoding='utf-8'))
+    fd.writelines(json.dumps(curr) + '\n' for curr in run)
+    fd.seek(0)
+    return fd
+
+
+def write_citations(citations: Iterable[Dict], fh, max_in_memory: Optional[int] = None,
+                    output_format: str = 'html') -> int:
+    """
+    renders citations straight to a file, most recent first, without building the output
+    in memory
+    :param citations: see :func:`sort_by_year`
+    :param fh: file open for writing text
+    :param max_in_memory: see :func:`sort_by_year`
+    :param output_format: one of TEMPLATES
+    :return: the number of citations written
+    """
+    render = TEMPLATES[output_format].render
+    count = 0
+    with ScholarMetrics.timer('scholar_render_seconds', format=output_format), ScholarProfiler.phase('render'):
+        for curr in sort_by_year(citations, max_in_memory):
+            fh.write(render(curr))
+            count += 1
+    ScholarMetrics.inc('scholar_rendered_citations_total', count)
+    return count
+
+
+def write_metrics(path: str, interval: float, stop: threading.Event):
+    """
+    writes the metrics every interval seconds until stop is set
+    """
+    while not stop.wait(interval):
+        ScholarMetrics.write(path)
+
+
 def main():
     """
     expects first argument to be path to text file containing author names
@@ -229,16 +1244,100 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('input_file', metavar='input-file',
                         help='input file which contains author\'s names separated by newline characters')
-    parser.add_argument('output_file', metavar='output-file',
-                        help='output file which will contain formatted html of citations')
+    parser.add_argument('output_file', metavar='output-file', nargs='?',
+                        help='output file which will contain formatted html of citations. May be left out '
+                             'with --jsonl.')
     parser.add_argument('-c', '--cookie-file', metavar='cookie-file',
                         help='cookie file used to avoid getting blocked by API. If shit isn\'t working '
                              'then open firefox, install extension to download cookie file (make sure it '
                              'is in netscape format). Make a google scholar advanced search, click '
                              'cite -> bibtex, fill out captcha. download cookie for this page and '
                              'specify the cookie file as this argument.')
-    parser.add_argument('-w', '--wait', metavar='SECONDS',
+    parser.add_argument('-w', '--wait', metavar='SECONDS', type=float,
                         help='specify how long to wait between each API request. Default is not to wait.')
+    parser.add_argument('--workers', metavar='N', type=int, default=1,
+                        help='number of authors to scrape in parallel. Default is one at a time. --wait is '
+                             'ignored with more than one worker, use --rate instead.')
+    parser.add_argument('--rate', metavar='REQUESTS', type=float,
+                        help='maximum number of requests per second, shared between all workers. Default '
+                             'is no limit.')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='directory in which to cache downloaded pages and BibTeX exports. Reruns reuse '
+                             'them instead of asking Google again, as long as they are fresh (a day for '
+                             'result pages, three months for BibTeX).')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=200,
+                        help='maximum size of the --cache-dir cache in megabytes. The least recently used '
+                             'entries are removed beyond that. Default is 200.')
+    parser.add_argument('--parser', choices=sorted(ScholarQuerier.PARSERS), default='bs4',
+                        help='parser for the pages of results. "lxml" is faster, but needs lxml to be installed '
+                             '(pip3 install lxml). "stream" parses pages while they download. Default is "bs4".')
+    parser.add_argument('--prefetch', metavar='N', type=int, default=0,
+                        help='fetch up to N pages of results of an author ahead, while the current one is '
+                             'parsed. Default is one page at a time.')
+    parser.add_argument('--parse-workers', metavar='N', type=int, default=ScholarConf.PARSE_WORKERS,
+                        help='number of processes parsing the pages fetched ahead by --prefetch, using more '
+                             'than one core. Default is to parse them in the thread fetching them.')
+    parser.add_argument('--export-workers', metavar='N', type=int, default=1,
+                        help='number of BibTeX exports to download in parallel for each page of results. '
+                             'Default is one at a time.')
+    parser.add_argument('--slice-size', metavar='N', type=int, default=ScholarConf.MAX_RESULTS,
+                        help='Google serves no more than %(default)s results of a search, so authors with more '
+                             'results get them split into slices of about N results each, by year of '
+                             'publication. Smaller slices are more requests, but --slice-workers can scrape '
+                             'them in parallel. Default is %(default)s.')
+    parser.add_argument('--slice-workers', metavar='N', type=int, default=1,
+                        help='number of year slices of an author to scrape in parallel. Default is one at a '
+                             'time.')
+    parser.add_argument('--queue', metavar='FILE',
+                        help='share the authors with other processes, on this host or others, through this '
+                             'file on shared storage. Every process leases authors from it and stores their '
+                             'citations in it. Once all of them are done, each process writes the output file '
+                             'from it. Progress is saved in it instead of the local cache.')
+    parser.add_argument('--lease', metavar='SECONDS', type=float, default=300,
+                        help='how long an author stays leased to a --queue process without news from it. '
+                             'Default is %(default)s.')
+    parser.add_argument('--merge', action='store_true',
+                        help='only write the output file, from the --queue or else from the progress cache, '
+                             'without scraping.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='also check the authors completed by earlier runs for articles added since. Only '
+                             'their newest results are requested, usually a page or two per author.')
+    parser.add_argument('--format', choices=sorted(TEMPLATES), default='html',
+                        help='format of the output file: html snippets separated by blank lines, the same in '
+                             'markdown, or one JSON object per line. Default is "html".')
+    parser.add_argument('--jsonl', metavar='FILE',
+                        help='also write every citation this run scrapes to FILE ("-" for stdout) as soon as '
+                             'its page is parsed, one JSON object per line as with --format jsonl, but in the '
+                             'order they are found. Citations of several authors are written once.')
+    parser.add_argument('--sort-buffer', metavar='N', type=int, default=SORT_BUFFER,
+                        help='maximum number of citations to sort in memory when writing the output file. '
+                             'Longer lists get sorted in parts on disk, keeping memory use down. Default is '
+                             '%(default)s.')
+    parser.add_argument('--retries', metavar='N', type=int, default=ScholarConf.RETRIES,
+                        help='number of times to retry a request when Google blocks us (503 or 429), waiting '
+                             'longer each time and as long as Google asks to. Default is %(default)s.')
+    parser.add_argument('--error-retries', metavar='N', type=int, default=ScholarConf.RETRY_ERRORS,
+                        help='number of times to retry a request after other temporary errors, such as a 500 '
+                             'or a dropped connection. Default is %(default)s.')
+    parser.add_argument('--backoff', metavar='SECONDS', type=float, default=ScholarConf.RETRY_BACKOFF,
+                        help='how long to wait before the first retry when blocked, doubling with every retry '
+                             'of the same request. Default is %(default)s.')
+    parser.add_argument('--max-backoff', metavar='SECONDS', type=float, default=ScholarConf.RETRY_MAX_DELAY,
+                        help='longest wait before a retry. Google asking to wait longer ends the run. Default '
+                             'is %(default)s.')
+    parser.add_argument('--retry-budget', metavar='N', type=int, default=ScholarConf.RETRY_BUDGET,
+                        help='maximum number of retries during the whole run. Default is %(default)s.')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write counters and timings of requests, parsing and rendering to PATH.json and, '
+                             'in the Prometheus text format, to PATH.prom. They are written at the end of the '
+                             'run and every --metrics-interval seconds during it.')
+    parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=60,
+                        help='how often to write --metrics during the run. Default is every 60 seconds.')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='profile the run by phase: fetching pages and BibTeX, parsing pages, parsing BibTeX '
+                             'and rendering the output. Each phase gets a cProfile profile written to '
+                             'PATH.<phase>.pstats and a report of its top memory allocations written to '
+                             'PATH.<phase>.alloc.txt, at the end of the run. Slows the run down a lot.')
     parser.add_argument('-d', '--debug', action='count', default=3,
                         help='Enable verbose logging to stderr. Repeated options increase detail of debug '
                              'output.')
@@ -246,9 +1345,56 @@ def main():
                         help='words are included in the search for each author which can help refine a '
                              'search to a particular university or institution.')
     options = parser.parse_args()
+    if options.output_file is None and not options.jsonl:
+        parser.error('the following arguments are required: output-file')
+    if options.jsonl and (options.queue or options.merge):
+        parser.error('--jsonl does not work with --queue or --merge')
+    if options.workers < 1:
+        parser.error('--workers must be at least 1')
+    if options.export_workers < 1:
+        parser.error('--export-workers must be at least 1')
+    if not ScholarConf.MAX_PAGE_RESULTS <= options.slice_size <= ScholarConf.MAX_RESULTS:
+        parser.error('--slice-size must be between {} and {}'
+                     .format(ScholarConf.MAX_PAGE_RESULTS, ScholarConf.MAX_RESULTS))
+    if options.prefetch < 0 or options.parse_workers < 0:
+        parser.error('--prefetch and --parse-workers must not be negative')
+    if options.slice_workers < 1:
+        parser.error('--slice-workers must be at least 1')
+    if options.queue and options.incremental:
+        parser.error('--incremental does not work with --queue')
+    if options.lease <= 0:
+        parser.error('--lease must be positive')
+    if options.sort_buffer < 1:
+        parser.error('--sort-buffer must be at least 1')
+    if options.metrics_interval <= 0:
+        parser.error('--metrics-interval must be positive')
+    if min(options.retries, options.error_retries, options.retry_budget) < 0:
+        parser.error('--retries, --error-retries and --retry-budget must not be negative')
+    if options.backoff < 0 or options.max_backoff < 0:
+        parser.error('--backoff and --max-backoff must not be negative')
+    if options.profile:
+        # the profiles are only written at the end of the run, too late to find out they can't be
+        try:
+            os.makedirs(os.path.dirname(options.profile) or '.', exist_ok=True)
+        except OSError as err:
+            parser.error('--profile: {}'.format(err))
 
     if options.cookie_file:
         ScholarConf.COOKIE_JAR_FILE = options.cookie_file
+    ScholarConf.CITATION_WORKERS = options.export_workers
+    ScholarConf.PARSER = options.parser
+    ScholarConf.PARSE_WORKERS = options.parse_workers
+    # papers co-authored by several authors only have their BibTeX downloaded once,
+    # in this run or any later one until the progress cache is deleted
+    ScholarConf.CLUSTER_INDEX = PROGRESS_DB
+    ScholarConf.RETRIES = options.retries
+    ScholarConf.RETRY_ERRORS = options.error_retries
+    ScholarConf.RETRY_BACKOFF = options.backoff
+    ScholarConf.RETRY_MAX_DELAY = options.max_backoff
+    ScholarConf.RETRY_BUDGET = options.retry_budget
+    if options.cache_dir:
+        ScholarConf.CACHE_DIR = options.cache_dir
+        ScholarConf.CACHE_MAX_SIZE = options.cache_size * 1024 * 1024
 
     if options.debug > 0:
         options.debug = min(options.debug, ScholarUtils.LOG_LEVELS['debug'])
@@ -257,8 +1403,37 @@ def main():
 
     with open(options.input_file, 'r') as fh:
         authors = fh.read().splitlines()
-    with open(options.output_file, 'w') as fh:
-        fh.writelines(dict_to_txt_lines(get_citations_authors(authors, options)))
+    stop_metrics = threading.Event()
+    if options.metrics:
+        threading.Thread(target=write_metrics, args=(options.metrics, options.metrics_interval, stop_metrics),
+                         daemon=True).start()
+    if options.profile:
+        ScholarProfiler.start()
+    try:
+        if options.queue:
+            store = WorkQueue(options.queue) if options.merge else scrape_queue(authors, options)
+            waiting, leased, done = store.status()
+            if waiting or leased:
+                print('Only {} of {} authors are done, the output is missing the others.'
+                      .format(done, waiting + leased + done))
+        elif options.merge:
+            store = load_progress()
+        elif options.jsonl:
+            store = stream_authors(authors, options)
+        else:
+            store = scrape_authors(authors, options)
+        if options.output_file:
+            with open(options.output_file, 'w') as fh:
+                write_citations((curr for _, curr in store.iter_citations()), fh, options.sort_buffer,
+                                options.format)
+    finally:
+        # also when blocked or interrupted, that's when they are most interesting
+        stop_metrics.set()
+        ScholarPagePipeline.shutdown_pool()
+        if options.metrics:
+            ScholarMetrics.write(options.metrics)
+        if options.profile:
+            ScholarProfiler.write(options.profile)
 
 
 if __name__ == '__main__':
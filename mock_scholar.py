@@ -0,0 +1,429 @@
+#! /usr/bin/env python
+"""
+A stand-in for Google Scholar on localhost, to try out and benchmark
+scholar.py and citation_scraper.py without asking Google (and getting
+blocked). It serves the settings form and its submission, result pages
+with paging and BibTeX exports on the paths ScholarQuerier uses, so
+pointing ScholarConf.SCHOLAR_SITE at it is all it takes:
+
+  with MockScholar(latency=0.05) as mock:
+      ScholarConf.SCHOLAR_SITE = mock.site
+      ...
+
+Result pages are synthetic ones in the current Scholar layout, or
+recorded ones replayed in turn. Recorded responses of any kind (the
+settings form, result pages, BibTeX exports) can also be replayed for
+the requests they were recorded for, see load_recordings(); the
+mock_fixtures directory holds a small set. Latency, bursts of 503
+responses and CAPTCHA pages can be mixed in. Run on its own, it
+serves until ^C:
+
+  python3 mock_scholar.py --port 8000 --latency 0.1
+  python3 mock_scholar.py --recordings mock_fixtures
+"""
+
+import argparse
+import functools
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from scholar import ScholarConf
+
+WORDS = ['genome', 'variation', 'graph', 'alignment', 'reference', 'human', 'cancer', 'cell',
+         'sequencing', 'pangenome', 'assembly', 'analysis', 'browser', 'The', 'of', 'and', 'for']
+
+# cluster ids of the papers authors may have in common, see author_results
+SHARED_CLUSTERS = range(10 ** 17, 10 ** 17 + 1000)
+
+# what Scholar shows instead of results once it suspects a robot
+CAPTCHA_PAGE = ('<!doctype html><html><head><title>Google Scholar</title></head><body>'
+                '<div id="gs_captcha_ccl"><h1>Please show you\'re not a robot</h1>'
+                '<form id="gs_captcha_f" method="get" action="/scholar">'
+                '<div class="g-recaptcha" data-sitekey="x"></div></form></div></body></html>')
+
+SETTINGS_PAGE = ('<!doctype html><html><body><form id="gs_bdy_frm" method="get" action="/scholar_setprefs">'
+                 '<input type="hidden" name="scisig" value="AAGBfm0AAAAAmock">'
+                 '<input type="hidden" name="inststart" value="0"></form></body></html>')
+
+_EXPORT_TOKEN = re.compile(r'c(\d+)-(\d+)$')
+
+# a recorded response: the path and query arguments it answers, and its body
+Recording = Tuple[str, Dict[str, str], bytes]
+
+
+def synthetic_result(rnd: random.Random, i: int, cluster_id: Optional[int] = None,
+                     year: Optional[int] = None) -> str:
+    """
+    returns the i-th result of a page in the layout ScholarArticleParser120726 handles.
+    Depending on i, results come with or without link, PDF and excerpt
+    """
+    if cluster_id is None:
+        cluster_id = rnd.randrange(10 ** 18, 10 ** 19)
+    title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 12)))
+    if i % 7 == 6:
+        # citation-only result without link
+        heading = ('<span class="gs_ctu"><span class="gs_ct1">[CITATION]</span>'
+                   '<span class="gs_ct2">[C]</span></span> {}'.format(escape(title)))
+    else:
+        ext = '.pdf' if i % 5 == 4 else ''
+        heading = '<a href="https://example.org/{}/{}{}" data-clk="x">{} <b>{}</b> {}</a>'.format(
+            cluster_id, i, ext, escape(title), rnd.choice(WORDS), rnd.choice(WORDS))
+    side = ''
+    if i % 3 == 0:
+        side = ('<div class="gs_ggs gs_fl"><div class="gs_ggsd"><div class="gs_or_ggsm">'
+                '<a href="https://example.org/{}.pdf"><span class="gs_ctg2">[PDF]</span> example.org</a>'
+                '</div></div></div>'.format(cluster_id))
+    authors = ', '.join('{} {}'.format(rnd.choice('ABCDEFGH'), rnd.choice(WORDS).capitalize())
+                        for _ in range(rnd.randint(1, 6)))
+    excerpt = ''
+    if i % 4 != 3:
+        excerpt = '<div class="gs_rs">{}\n<b>{}</b> {}&#8230;</div>'.format(
+            ' '.join(rnd.choice(WORDS) for _ in range(20)), rnd.choice(WORDS),
+            ' '.join(rnd.choice(WORDS) for _ in range(15)))
+    journal = rnd.choice(WORDS).capitalize()
+    if year is None:
+        year = rnd.randint(1970, 2020)
+    return ('<div class="gs_r gs_or gs_scl" data-cid="{cid}" data-rp="{i}">{side}'
+            '<div class="gs_ri"><h3 class="gs_rt" ontouchstart="gs_evt_dsp(event)">{heading}</h3>'
+            '<div class="gs_a">{authors} - Journal of {journal}, {year} - example.org</div>{excerpt}'
+            '<div class="gs_fl"><a href="javascript:void(0)" class="gs_or_sav">Save</a> '
+            '<a href="/scholar?cites={cid}&amp;as_sdt=2005&amp;sciodt=0,5&amp;hl=en&amp;num=10">Cited by {cites}</a> '
+            '<a href="/scholar?q=related:x{i}:scholar.google.com/&amp;hl=en&amp;as_sdt=0,5">Related articles</a> '
+            '<a href="/scholar?cluster={cid}&amp;hl=en&amp;as_sdt=0,5&amp;num=10">All {versions} versions</a> '
+            '<a href="/scholar.bib?q=info:c{cid}-{year}:scholar.google.com/&amp;output=citation&amp;scisdr=CgX&amp;'
+            'scisig=AAGBfm0&amp;scisf=4&amp;ct=citation&amp;cd={i}&amp;hl=en">Import into BibTeX</a>'
+            '</div></div></div>'.format(cid=cluster_id, i=i, side=side, heading=heading, authors=escape(authors),
+                                        journal=journal, year=year, excerpt=excerpt, cites=rnd.randint(1, 5000),
+                                        versions=rnd.randint(2, 30)))
+
+
+def results_page(results: List[str], total: int) -> str:
+    """
+    returns a results page with the given results, reporting total results in all
+    """
+    return ('<!doctype html><html><head><meta charset="UTF-8"><title>Google Scholar</title></head><body>'
+            '<div id="gs_ab_md"><div class="gs_ab_mdw">About {:,} results (<b>0.05</b> sec)</div></div>'
+            '<div id="gs_res_ccl_mid">{}</div></body></html>').format(total, ''.join(results))
+
+
+def synthetic_results_page(seed: int, count: int = 10, total: int = 1234) -> str:
+    """
+    returns a results page in the layout ScholarArticleParser120726 handles, with
+    count articles of varying shape: with and without links, PDFs and excerpts
+    """
+    rnd = random.Random(seed)
+    return results_page([synthetic_result(rnd, i) for i in range(count)], total)
+
+
+@functools.lru_cache(maxsize=1024)
+def author_results(author: str, count: int, shared: float) -> Tuple[Tuple[int, int], ...]:
+    """
+    :return: cluster id and year of each of the count results of author, always the same.
+        A shared part of them are papers authors may have in common, from SHARED_CLUSTERS
+    """
+    rnd = random.Random(author)
+    results = []
+    for _ in range(count):
+        if rnd.random() < shared:
+            cluster_id = rnd.choice(SHARED_CLUSTERS)
+        else:
+            cluster_id = rnd.randrange(10 ** 18, 10 ** 19)
+        # more papers in recent years, like most authors
+        year = 2024 - int(rnd.triangular(0, 40, 0))
+        results.append((cluster_id, year))
+    return tuple(results)
+
+
+def synthetic_export(token: str) -> str:
+    """
+    :return: the BibTeX export of the result with the given info token, always the same
+    """
+    match = _EXPORT_TOKEN.match(token)
+    rnd = random.Random(token)
+    year = match.group(2) if match else rnd.randint(1970, 2020)
+    title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 12))).capitalize()
+    authors = ' and '.join('{}, {}'.format(rnd.choice(WORDS).capitalize(), rnd.choice('ABCDEFGH'))
+                           for _ in range(rnd.randint(1, 6)))
+    return ('@article{{{key},\n  title={{{title}}},\n  author={{{authors}}},\n'
+            '  journal={{Journal of {journal}}},\n  volume={{{volume}}},\n  number={{{number}}},\n'
+            '  pages={{{first}--{last}}},\n  year={{{year}}},\n  publisher={{{publisher}}}\n}}\n'.format(
+                key=re.sub(r'\W', '', token), year=year, title=title, authors=authors,
+                journal=rnd.choice(WORDS).capitalize(), volume=rnd.randint(1, 40), number=rnd.randint(1, 12),
+                first=rnd.randint(1, 500), last=rnd.randint(501, 999),
+                publisher=rnd.choice(['Cold Spring Harbor Lab', 'Nature Publishing Group', 'Elsevier'])))
+
+
+def load_recordings(directory: str) -> List[Recording]:
+    """
+    loads the recorded responses listed in the index.json file of directory. That's a list
+    of objects with the path of the request ("/scholar", "/scholar.bib", ...), its query
+    arguments to match ("query", optional) and the file holding the response body, relative
+    to directory ("file"). A query argument recorded as "" matches when it's blank or left out
+    :return: the recordings, in the order listed
+    """
+    with open(os.path.join(directory, 'index.json'), encoding='utf-8') as fd:
+        index = json.load(fd)
+    recordings = []
+    for entry in index:
+        with open(os.path.join(directory, entry['file']), 'rb') as fd:
+            recordings.append((entry['path'], entry.get('query', {}), fd.read()))
+    return recordings
+
+
+class MockScholarServer(ThreadingHTTPServer):
+    """serves every connection in a thread of its own"""
+    daemon_threads = True
+    # the default of 5 drops connections when many clients connect at once
+    request_queue_size = 1024
+
+
+class MockScholarHandler(BaseHTTPRequestHandler):
+    """Serves the requests of a MockScholar, see there."""
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, which Nagle's algorithm would hold back
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        mock = self.server.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+        url = urlsplit(self.path)
+        args = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if mock.blocked():
+            headers = [('Retry-After', str(mock.retry_after))] if mock.retry_after is not None else []
+            return self.respond(503, b'', headers)
+
+        recorded = mock.recorded(url.path, args)
+        if url.path == '/scholar_settings':
+            mock.count('settings')
+            return self.respond(200, recorded or SETTINGS_PAGE)
+        if url.path == '/scholar_setprefs':
+            mock.count('settings')
+            fields = ['ID=mock']
+            if args.get('scisf'):
+                fields.append('CF=' + args['scisf'])
+            if args.get('num', '').isdigit():
+                fields.append('NR=' + args['num'])
+            # recorded or not, the settings only hold with the cookie
+            cookie = 'GSP={}; Path=/; Expires=Fri, 01 Jan 2038 00:00:00 GMT'.format(':'.join(fields))
+            return self.respond(200, recorded or '<html><body>Settings saved</body></html>',
+                                [('Set-Cookie', cookie)])
+        if url.path == '/scholar.bib':
+            mock.count('citation')
+            if recorded is None:
+                recorded = synthetic_export(args.get('q', 'info:x').split(':')[1])
+            return self.respond(200, recorded, [('Content-Type', 'text/plain; charset=utf-8')])
+        if url.path == '/scholar':
+            if mock.captcha():
+                mock.count('captcha')
+                return self.respond(200, CAPTCHA_PAGE)
+            mock.count('results')
+            # like Scholar, without the settings cookie there are no export links
+            with_exports = 'CF=4' in (self.headers.get('Cookie') or '')
+            return self.respond(200, mock.results_page(args, with_exports, recorded))
+        mock.count('not found')
+        self.respond(404, b'')
+
+    def respond(self, status, body, headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if body and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockScholar(object):
+    """
+    A local HTTP server answering like Google Scholar, in a thread of its own. Authors
+    have results results each, with papers in common in a shared part of them, unless
+    recorded pages are given: then every results query gets them in turn, page after
+    page, and an empty page past the last. Any request with recordings, see
+    load_recordings(), gets one of them instead: of those for its path whose query
+    arguments it has too, the one with the most. Every block_every requests, the last
+    block_length get a 503, with a Retry-After of retry_after seconds if given, and
+    every captcha_every results page is a CAPTCHA instead. latency is the seconds every
+    response takes.
+
+    What was requested is counted in stats: 'requests', 'settings', 'results',
+    'citation', 'blocked', 'captcha' and 'not found'.
+    """
+
+    def __init__(self, port: int = 0, results: int = 25, shared: float = 0.1, latency: float = 0.0,
+                 block_every: int = 0, block_length: int = 1, retry_after: Optional[float] = None,
+                 captcha_every: int = 0, pages: Optional[List[bytes]] = None,
+                 recordings: Optional[List[Recording]] = None):
+        self.port = port
+        self.results = results
+        self.shared = shared
+        self.latency = latency
+        self.block_every = block_every
+        self.block_length = block_length
+        self.retry_after = retry_after
+        self.captcha_every = captcha_every
+        self.pages = pages
+        self.recordings = recordings or []
+        self.stats = Counter()
+        self.results_requests = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def site(self) -> str:
+        """The value for ScholarConf.SCHOLAR_SITE."""
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def start(self) -> 'MockScholar':
+        self.server = MockScholarServer(('127.0.0.1', self.port), MockScholarHandler)
+        self.server.mock = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, what: str):
+        with self.lock:
+            self.stats[what] += 1
+
+    def blocked(self) -> bool:
+        """
+        counts a request, and tells whether it gets a 503
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            blocked = bool(self.block_every) and \
+                (self.stats['requests'] - 1) % self.block_every >= self.block_every - self.block_length
+            if blocked:
+                self.stats['blocked'] += 1
+            return blocked
+
+    def captcha(self) -> bool:
+        """
+        counts a results page request, and tells whether it gets a CAPTCHA
+        """
+        with self.lock:
+            self.results_requests += 1
+            return bool(self.captcha_every) and self.results_requests % self.captcha_every == 0
+
+    def recorded(self, path: str, args) -> Optional[bytes]:
+        """
+        :param args: the query arguments of the request
+        :return: the body of the recording for the request, see the class, or None
+        """
+        best = None
+        for rec_path, query, body in self.recordings:
+            if rec_path == path and all(args.get(key, '') == value for key, value in query.items()) \
+                    and (best is None or len(query) > len(best[1])):
+                best = (rec_path, query, body)
+        return best[2] if best else None
+
+    def results_page(self, args, with_exports: bool, recorded: Optional[bytes] = None) -> str:
+        """
+        :param args: the query arguments of the request
+        :param recorded: the recording for the request, if any
+        """
+        start = int(args.get('start') or 0)
+        num = int(args.get('num') or ScholarConf.MAX_PAGE_RESULTS)
+        if recorded is not None:
+            page = recorded
+        elif self.pages is not None:
+            index = start // num
+            page = self.pages[index] if index < len(self.pages) else results_page([], 0)
+        elif 'cluster' in args:
+            rnd = random.Random(args['cluster'])
+            page = results_page([synthetic_result(rnd, 0, int(args['cluster']))], 1)
+        else:
+            page = self.author_page(args, start, num)
+        if isinstance(page, bytes):
+            page = page.decode('utf-8')
+        if not with_exports:
+            page = re.sub(r' ?<a href="/scholar\.bib[^>]*>Import into BibTeX</a>', '', page)
+        return page
+
+    def author_page(self, args, start: int, num: int) -> str:
+        author = args.get('as_sauthors', '').strip('"')
+        first = int(args.get('as_ylo') or 0)
+        last = int(args.get('as_yhi') or 9999)
+        found = author_results(author, self.results, self.shared)
+        indexes = [i for i, (_, year) in enumerate(found) if first <= year <= last]
+        if 'scisbd' in args:
+            indexes.sort(key=lambda i: found[i][1], reverse=True)
+        # like Scholar, nothing past the first MAX_RESULTS
+        shown = indexes[:ScholarConf.MAX_RESULTS][start:start + num]
+        return results_page([synthetic_result(random.Random('{}:{}'.format(author, i)), i, *found[i])
+                             for i in shown], len(indexes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='a local stand-in for Google Scholar')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on. Default is 8000.')
+    parser.add_argument('--results', metavar='N', type=int, default=25,
+                        help='number of results of every author. Default is 25.')
+    parser.add_argument('--shared', metavar='FRACTION', type=float, default=0.1,
+                        help='part of the results that authors may have in common. Default is 0.1.')
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.0,
+                        help='time every response takes. Default is none.')
+    parser.add_argument('--block-every', metavar='N', type=int, default=0,
+                        help='every N requests, answer the last --block-length with a 503. Default is never.')
+    parser.add_argument('--block-length', metavar='N', type=int, default=1,
+                        help='number of 503s in a row. Default is 1.')
+    parser.add_argument('--retry-after', metavar='SECONDS', type=float,
+                        help='Retry-After of the 503s. Default is none.')
+    parser.add_argument('--captcha-every', metavar='N', type=int, default=0,
+                        help='answer every N-th results page with a CAPTCHA. Default is never.')
+    parser.add_argument('--pages', nargs='+', metavar='FILE',
+                        help='recorded results pages to replay instead of synthetic ones.')
+    parser.add_argument('--recordings', metavar='DIR',
+                        help='directory of recorded responses to replay for the requests they were recorded for, '
+                             'listed in its index.json, e.g. mock_fixtures. Others get synthetic ones.')
+    options = parser.parse_args()
+
+    pages = None
+    if options.pages:
+        pages = []
+        for path in options.pages:
+            with open(path, 'rb') as fd:
+                pages.append(fd.read())
+    recordings = load_recordings(options.recordings) if options.recordings else None
+    mock = MockScholar(options.port, options.results, options.shared, options.latency, options.block_every,
+                       options.block_length, options.retry_after, options.captcha_every, pages, recordings)
+    with mock:
+        print('serving on {}, stop with ^C'.format(mock.site))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    print(', '.join('{} {}'.format(count, what) for what, count in sorted(mock.stats.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
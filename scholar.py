@@ -161,46 +161,28 @@ page. It is not a recursive crawler.
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import optparse
+import codecs
+from contextlib import contextmanager
+import gzip
+import json
 import os
+import random
 import re
+import sqlite3
 import sys
+import threading
+import time
+from types import MappingProxyType
 import warnings
+import zlib
 
-try:
-    # Try importing for Python 3
-    # pylint: disable-msg=F0401
-    # pylint: disable-msg=E0611
-    from urllib.request import HTTPCookieProcessor, Request, build_opener
-    from urllib.parse import quote, unquote
-    from urllib.error import HTTPError
-    from http.cookiejar import MozillaCookieJar
-except ImportError:
-    # Fallback for Python 2
-    from urllib2 import Request, build_opener, HTTPCookieProcessor, HTTPError
-    from urllib import quote, unquote
-    from cookielib import MozillaCookieJar
-
-# Import BeautifulSoup -- try 4 first, fall back to older
-try:
-    from bs4 import BeautifulSoup
-except ImportError:
-    try:
-        from BeautifulSoup import BeautifulSoup
-    except ImportError:
-        print('We need BeautifulSoup, sorry...')
-        sys.exit(1)
-
-# Support unicode in both Python 2 and 3. In Python 3, unicode is str.
-if sys.version_info[0] == 3:
-    unicode = str # pylint: disable-msg=W0622
-    encode = lambda s: unicode(s) # pylint: disable-msg=C0103
-else:
-    def encode(s):
-        if isinstance(s, basestring):
-            return s.encode('utf-8') # pylint: disable-msg=C0103
-        else:
-            return str(s)
+from urllib.parse import quote, unquote, urlsplit
+from urllib.error import HTTPError, URLError
+from html.parser import HTMLParser
+
+# Modules only some runs need, such as bs4 and urllib.request, are
+# imported on first use, keeping the start of e.g. a run that only
+# renders its output quick.
 
 
 class Error(Exception):
@@ -215,26 +197,56 @@ class QueryArgumentError(Error):
     """A query did not have a suitable set of arguments."""
 
 
+class CaptchaError(HTTPError):
+    """
+    Scholar answered with a CAPTCHA instead of the page asked for, at
+    times with a 200 status. It gets the status of a block (429), so
+    that it is retried, and eventually raised, like one.
+    """
+    def __init__(self, url, hdrs):
+        HTTPError.__init__(self, url, 429, 'CAPTCHA', hdrs, None)
+
+
 class SoupKitchen(object):
     """Factory for creating BeautifulSoup instances."""
 
-    @staticmethod
-    def make_soup(markup, parser=None):
+    _BeautifulSoup = None
+
+    @classmethod
+    def make_soup(cls, markup, parser=None):
         """Factory method returning a BeautifulSoup instance. The created
         instance will use a parser of the given name, if supported by
         the underlying BeautifulSoup instance.
         """
-        if 'bs4' in sys.modules:
-            # We support parser specification. If the caller didn't
-            # specify one, leave it to BeautifulSoup to pick the most
-            # suitable one, but suppress the user warning that asks to
-            # select the most suitable parser ... which BS then
-            # selects anyway.
-            if parser is None:
-                warnings.filterwarnings('ignore', 'No parser was explicitly specified')
-            return BeautifulSoup(markup, parser)
+        if cls._BeautifulSoup is None:
+            try:
+                from bs4 import BeautifulSoup
+            except ImportError:
+                print('We need BeautifulSoup, sorry...')
+                sys.exit(1)
+            # If the caller didn't specify a parser, leave it to
+            # BeautifulSoup to pick the most suitable one, but suppress
+            # the user warning that asks to select the most suitable
+            # parser ... which BS then selects anyway. Once is enough:
+            # every new filter resets the warnings caches.
+            warnings.filterwarnings('ignore', 'No parser was explicitly specified')
+            cls._BeautifulSoup = BeautifulSoup
+        return cls._BeautifulSoup(markup, parser)
 
-        return BeautifulSoup(markup)
+    @staticmethod
+    def release(soup):
+        """Takes apart a BeautifulSoup instance made by make_soup(), so
+        that its memory gets freed right away: the tree is full of
+        reference cycles, which would keep it around until the next
+        garbage collection. The instance is unusable afterwards.
+        """
+        # Decomposing the instance itself leaves its contents alone.
+        for child in list(soup.contents):
+            if hasattr(child, 'decompose'):
+                child.decompose()
+            else:
+                child.extract()
+        soup.decompose()
 
 class ScholarConf(object):
     """Helper class for global settings."""
@@ -242,6 +254,9 @@ class ScholarConf(object):
     VERSION = '2.10'
     LOG_LEVEL = 1
     MAX_PAGE_RESULTS = 10 # Current default for per-page results
+    # Scholar serves at most this many results of a query, however
+    # many it reports. Pages past that come back empty.
+    MAX_RESULTS = 1000
     SCHOLAR_SITE = 'http://scholar.google.com'
 
     # USER_AGENT = 'Mozilla/5.0 (X11; U; FreeBSD i386; en-US; rv:1.9.2.9) Gecko/20100913 Firefox/3.6.9'
@@ -252,6 +267,62 @@ class ScholarConf(object):
     # cookie use across sessions.
     COOKIE_JAR_FILE = None
 
+    # Results page parser, "bs4" (BeautifulSoup), "lxml" (faster,
+    # requires lxml) or "stream" (parses pages while they download).
+    # See ScholarQuerier.PARSERS.
+    PARSER = 'bs4'
+
+    # Size of the chunks in which streaming parsers get fed.
+    STREAM_CHUNK_SIZE = 16 * 1024
+
+    # Maximum number of citation export requests (e.g. BibTeX) a
+    # querier keeps in flight at once for the articles of a results
+    # page. 1 retrieves them one after another.
+    CITATION_WORKERS = 1
+
+    # AsyncScholarQuerier keeps at most this many connections open to
+    # any one host, and gives up on a connection that stays silent for
+    # ASYNC_TIMEOUT seconds.
+    ASYNC_HOST_CONNECTIONS = 8
+    ASYNC_TIMEOUT = 60
+
+    # Results pages a ScholarPagePipeline fetches ahead of the one its
+    # caller works on, and the number of processes parsing them. With
+    # 0, pages get parsed in the pipeline's thread.
+    PREFETCH_PAGES = 2
+    PARSE_WORKERS = 0
+
+    # If set, HTTP responses get cached in this directory and reused
+    # while fresh, see ScholarCache.
+    CACHE_DIR = None
+    CACHE_MAX_SIZE = 200 * 1024 * 1024 # bytes on disk
+
+    # Seconds a cached response stays fresh, per resource type (see
+    # ScholarUtils.resource_type). Zero disables caching of a type.
+    # The settings form carries a per-session token and submitting
+    # settings has to set cookies, so neither is cached by default.
+    CACHE_TTL = {'citation': 90 * 24 * 3600,
+                 'results':  24 * 3600,
+                 'settings': 0,
+                 'other':    0}
+
+    # Citation export data gets indexed by cluster ID for the lifetime
+    # of the process, see ScholarClusterIndex. If set, the index is
+    # also kept in this SQLite file, for reuse by later runs.
+    CLUSTER_INDEX = None
+
+    # Failed requests get retried with exponential backoff, see
+    # ScholarRetryPolicy. RETRIES is the number of retries when Scholar
+    # blocks us (503, 429), RETRY_ERRORS the number for other transient
+    # failures. RETRY_BUDGET caps the retries of the whole process, None
+    # meaning no cap. Delays are in seconds.
+    RETRIES = 3
+    RETRY_ERRORS = 2
+    RETRY_BACKOFF = 30 # First delay when blocked, doubling every retry
+    RETRY_ERROR_BACKOFF = 1 # Same for other failures
+    RETRY_MAX_DELAY = 600
+    RETRY_BUDGET = 50
+
 class ScholarUtils(object):
     """A wrapper for various utensils that come in handy."""
 
@@ -267,6 +338,22 @@ class ScholarUtils(object):
         except ValueError:
             raise FormatError(msg)
 
+    @staticmethod
+    def resource_type(url):
+        """
+        Classifies a Scholar URL as 'citation' (citation exports),
+        'results' (results pages), 'settings' (settings form and
+        submission) or 'other'.
+        """
+        path = urlsplit(url).path
+        if path.startswith('/scholar.') or path.startswith('/citations'):
+            return 'citation'
+        if path.startswith('/scholar_set'):
+            return 'settings'
+        if path == '/scholar':
+            return 'results'
+        return 'other'
+
     @staticmethod
     def log(level, msg):
         if level not in ScholarUtils.LOG_LEVELS.keys():
@@ -277,54 +364,1097 @@ class ScholarUtils(object):
         sys.stderr.flush()
 
 
+class ScholarRateLimiter(object):
+    """
+    A token bucket capping the request rate of any number of queriers,
+    which may run in separate threads. Every HTTP request takes one
+    token; tokens refill continuously at the given rate, up to the
+    bucket's burst capacity.
+    """
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise FormatError('request rate must be positive, is "%s"' % rate)
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.paused_until = self.stamp
+        self.lock = threading.Lock()
+
+    def pause(self, delay):
+        """
+        Holds back every request for the given number of seconds, e.g.
+        while Scholar is blocking us.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            delay = self._take()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Like acquire(), but waits without blocking the event loop."""
+        import asyncio
+        while True:
+            delay = self._take()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def _take(self):
+        """
+        Takes a token if one is available, returning 0. Otherwise
+        returns the seconds to wait before trying again.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class ScholarRetryPolicy(object):
+    """
+    Decides whether and when to retry a failed request. Delays grow
+    exponentially with every retry of a request, with random jitter so
+    that parallel workers don't retry in lockstep, and honor the
+    Retry-After header of a response when given. Blocking responses
+    (see BLOCKING_STATUSES) and other transient failures have separate
+    numbers of retries and backoff; anything else isn't retried, since
+    asking again won't change the answer.
+
+    A retry budget caps the number of retries of all requests made
+    through the policy, so that a long block ends the run instead of
+    stretching it out. Use ScholarRetryPolicy.shared() to get the
+    process-wide instance configured by ScholarConf.
+    """
+    BLOCKING_STATUSES = (429, 503)
+    # Other failures worth retrying; None stands for connection errors.
+    TRANSIENT_STATUSES = (None, 408, 500, 502, 504)
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, retries=None, error_retries=None, backoff=None,
+                 error_backoff=None, max_delay=None, budget=None):
+        def default(value, conf):
+            return conf if value is None else value
+        self.retries = default(retries, ScholarConf.RETRIES)
+        self.error_retries = default(error_retries, ScholarConf.RETRY_ERRORS)
+        self.backoff = default(backoff, ScholarConf.RETRY_BACKOFF)
+        self.error_backoff = default(error_backoff, ScholarConf.RETRY_ERROR_BACKOFF)
+        self.max_delay = default(max_delay, ScholarConf.RETRY_MAX_DELAY)
+        self.budget = budget if budget is not None else ScholarConf.RETRY_BUDGET
+        self.spent = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """Returns the process-wide policy, created on first use."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Returns the seconds a Retry-After header value (delay in
+        seconds or HTTP date) asks to wait, None if unparseable.
+        """
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        from email.utils import mktime_tz, parsedate_tz
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - time.time())
+
+    def delay(self, status, attempt, retry_after=None):
+        """
+        Returns the seconds to wait before retrying a request that
+        failed with the given HTTP status (None for connection errors)
+        after attempt earlier retries, or None to give up. A retry
+        granted counts against the budget.
+        """
+        if status in self.BLOCKING_STATUSES:
+            retries, backoff = self.retries, self.backoff
+        elif status in self.TRANSIENT_STATUSES:
+            retries, backoff = self.error_retries, self.error_backoff
+        else:
+            return None
+        if attempt >= retries:
+            return None
+
+        delay = backoff * 2 ** attempt
+        delay = min(self.max_delay, random.uniform(delay / 2, delay))
+        wait = self.parse_retry_after(retry_after)
+        if wait is not None:
+            if wait > self.max_delay:
+                ScholarUtils.log('info', 'not waiting the %d seconds Scholar asks for' % wait)
+                return None
+            delay = max(delay, wait)
+
+        with self.lock:
+            if self.budget is not None and self.spent >= self.budget:
+                ScholarUtils.log('warn', 'retry budget of %d retries used up' % self.budget)
+                return None
+            self.spent += 1
+        return delay
+
+
+class ScholarMetrics(object):
+    """
+    Process-wide counters and latency histograms, safe to update from
+    any number of threads. Metrics are named the Prometheus way and
+    distinguished by labels given as keyword arguments, e.g.
+
+      ScholarMetrics.inc('scholar_requests_total', type='results', status='200')
+      with ScholarMetrics.timer('scholar_parse_seconds', parser='lxml'):
+          ...
+
+    summary() and prometheus() render everything recorded so far,
+    write() saves both next to each other.
+    """
+    # Upper bounds in seconds of the histogram buckets
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    # Buckets of histograms that need finer ones
+    METRIC_BUCKETS = {
+        'scholar_bibtex_parse_seconds': (0.00001, 0.00005, 0.0001, 0.0005,
+                                         0.001, 0.005, 0.01, 0.05),
+        'scholar_render_seconds': (0.001, 0.01, 0.1, 1, 10, 60),
+        'scholar_retry_wait_seconds': (1, 5, 15, 30, 60, 120, 300, 600),
+    }
+
+    HELP = {
+        'scholar_requests_total':
+            'HTTP requests sent, by resource type and status',
+        'scholar_cache_hits_total':
+            'Responses served from the response cache, by resource type',
+        'scholar_downloaded_bytes_total':
+            'Response body bytes downloaded (decoded), by resource type',
+        'scholar_empty_pages_total':
+            'Results pages without any article',
+        'scholar_rendered_citations_total':
+            'Citations rendered to the output',
+        'scholar_request_seconds':
+            'Time from sending a request to having read its response, by resource type',
+        'scholar_rate_limit_wait_seconds':
+            'Time spent waiting for the rate limiter before a request',
+        'scholar_parse_seconds':
+            'Time spent parsing a results page, by parser',
+        'scholar_bibtex_parse_seconds':
+            'Time spent parsing a BibTeX entry',
+        'scholar_render_seconds':
+            'Time spent rendering the citations',
+        'scholar_cluster_index_hits_total':
+            'Citation exports reused from the cluster index instead of requested',
+        'scholar_retries_total':
+            'Retries of failed requests, by resource type and status',
+        'scholar_retry_wait_seconds':
+            'Time waited before retrying a failed request',
+    }
+
+    _lock = threading.Lock()
+    _counters = {}
+    _histograms = {} # key -> [count per bucket..., count, sum, max]
+    _started = time.time()
+
+    @classmethod
+    def inc(cls, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with cls._lock:
+            cls._counters[key] = cls._counters.get(key, 0) + amount
+
+    @classmethod
+    def observe(cls, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = cls.METRIC_BUCKETS.get(name, cls.BUCKETS)
+        with cls._lock:
+            hist = cls._histograms.get(key)
+            if hist is None:
+                hist = cls._histograms[key] = [0] * len(buckets) + [0, 0.0, 0.0]
+            for idx, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[idx] += 1
+                    break
+            hist[-3] += 1
+            hist[-2] += value
+            hist[-1] = max(hist[-1], value)
+
+    @classmethod
+    @contextmanager
+    def timer(cls, name, **labels):
+        """Context manager observing the time its block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - start, **labels)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._counters.clear()
+            cls._histograms.clear()
+            cls._started = time.time()
+
+    @staticmethod
+    def _series(name, labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return name
+        return '%s{%s}' % (name, ','.join(
+            '%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"'))
+            for key, val in labels))
+
+    @classmethod
+    def _quantile(cls, name, hist, q):
+        """
+        Estimates a quantile from the buckets, interpolating within the
+        bucket it falls in like Prometheus' histogram_quantile() does.
+        """
+        buckets = cls.METRIC_BUCKETS.get(name, cls.BUCKETS)
+        rank = q * hist[-3]
+        seen, lower = 0, 0.0
+        for idx, bound in enumerate(buckets):
+            if hist[idx] and seen + hist[idx] >= rank:
+                return min(hist[-1], lower + (bound - lower) * (rank - seen) / hist[idx])
+            seen += hist[idx]
+            lower = bound
+        return hist[-1] # Beyond the last bucket
+
+    @classmethod
+    def summary(cls):
+        """Returns a dict of everything recorded, suitable for JSON."""
+        with cls._lock:
+            counters = dict(cls._counters)
+            histograms = dict((key, list(hist)) for key, hist in cls._histograms.items())
+        res = {'started': cls._started,
+               'elapsed': time.time() - cls._started,
+               'counters': {},
+               'histograms': {}}
+        for (name, labels), value in sorted(counters.items()):
+            res['counters'][cls._series(name, labels)] = value
+        for (name, labels), hist in sorted(histograms.items()):
+            res['histograms'][cls._series(name, labels)] = {
+                'count': hist[-3],
+                'sum': hist[-2],
+                'mean': hist[-2] / hist[-3],
+                'p50': cls._quantile(name, hist, 0.5),
+                'p90': cls._quantile(name, hist, 0.9),
+                'p99': cls._quantile(name, hist, 0.99),
+                'max': hist[-1]}
+        return res
+
+    @classmethod
+    def prometheus(cls):
+        """Returns everything recorded in the Prometheus text format."""
+        with cls._lock:
+            counters = dict(cls._counters)
+            histograms = dict((key, list(hist)) for key, hist in cls._histograms.items())
+        lines = []
+        described = set()
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in cls.HELP:
+                    lines.append('# HELP %s %s' % (name, cls.HELP[name]))
+                lines.append('# TYPE %s %s' % (name, kind))
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append('%s %s' % (cls._series(name, labels), value))
+        for (name, labels), hist in sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0
+            for idx, bound in enumerate(cls.METRIC_BUCKETS.get(name, cls.BUCKETS)):
+                cumulative += hist[idx]
+                series = cls._series(name + '_bucket', labels, [('le', repr(float(bound)))])
+                lines.append('%s %d' % (series, cumulative))
+            series = cls._series(name + '_bucket', labels, [('le', '+Inf')])
+            lines.append('%s %d' % (series, hist[-3]))
+            lines.append('%s %r' % (cls._series(name + '_sum', labels), hist[-2]))
+            lines.append('%s %d' % (cls._series(name + '_count', labels), hist[-3]))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def write(cls, path):
+        """
+        Writes the summary to path.json and the Prometheus text to
+        path.prom. Each file is replaced at once, so that readers (e.g.
+        node_exporter's textfile collector) never see a partial one.
+        """
+        summary = json.dumps(cls.summary(), indent=2, sort_keys=True)
+        for suffix, text in (('.json', summary), ('.prom', cls.prometheus())):
+            fname = path + suffix
+            tmpname = '%s.%d.tmp' % (fname, os.getpid())
+            try:
+                with open(tmpname, 'w') as fd:
+                    fd.write(text)
+                os.replace(tmpname, fname)
+            except OSError as msg:
+                ScholarUtils.log('warn', 'could not write metrics: %s' % msg)
+
+
+class ScholarProfiler(object):
+    """
+    Profiles of a run by phase, to find out where its time and memory
+    go. The phases are 'fetch' (getting results pages and citation
+    exports, from Scholar or from the cache), 'parse' (results pages),
+    'bibtex' (citation exports) and 'render' (the output), e.g.
+
+      with ScholarProfiler.phase('parse'):
+          ...
+
+    Phases cost next to nothing until start() gets called. From then
+    on, every thread profiles each phase with a cProfile profile of its
+    own, pausing the one of the phase it was in before, if any, and
+    tracemalloc traces allocations, telling the phases apart by the
+    code in their tracebacks. write() saves both per phase. Python 3.12
+    and later profile one thread at a time though, so there the
+    profiles of threads running at once get mixed up.
+    """
+    PHASES = ('fetch', 'parse', 'bibtex', 'render')
+    # Frames traced per allocation; enough to reach the phase code
+    FRAMES = 48
+    # Lines of each allocation report
+    TOP_ALLOCATIONS = 25
+    # Smallest growth of memory in a phase to snapshot allocations for
+    SNAPSHOT_GROWTH = 64 * 1024
+
+    _lock = threading.Lock()
+    _local = threading.local()
+    _enabled = False
+    _profiles = {} # phase -> profiles, one per thread
+    _code = {}     # (code object, line) -> phase
+    _ranges = {}   # filename -> [(first line, last line, phase), ...]
+    _growth = {}   # phase -> [calls, largest growth, snapshot after it]
+
+    @classmethod
+    def start(cls, frames=None):
+        """Starts profiling, forgetting earlier profiles."""
+        with cls._lock:
+            cls._profiles.clear()
+            cls._code.clear()
+            cls._ranges.clear()
+            cls._growth.clear()
+            cls._enabled = True
+        import tracemalloc
+        tracemalloc.start(frames or cls.FRAMES)
+
+    @classmethod
+    @contextmanager
+    def phase(cls, name):
+        """Context manager profiling its block as part of phase name."""
+        if not cls._enabled:
+            yield
+            return
+        import cProfile
+        import tracemalloc
+
+        # Allocations get told apart by the lines from here to the end
+        # of the caller's code showing up in their traceback.
+        caller = sys._getframe(2)
+        if (caller.f_code, caller.f_lineno) not in cls._code:
+            cls._register(name, caller)
+
+        local = cls._local
+        if not hasattr(local, 'stack'):
+            local.stack = []
+            local.profiles = {}
+        prof = local.profiles.get(name)
+        if prof is None:
+            prof = local.profiles[name] = cProfile.Profile()
+            with cls._lock:
+                cls._profiles.setdefault(name, []).append(prof)
+
+        outer = local.stack[-1] if local.stack else None
+        if outer is not prof:
+            if outer is not None:
+                outer.disable()
+            cls._enable(prof)
+        local.stack.append(prof)
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            growth = tracemalloc.get_traced_memory()[0] - before
+            local.stack.pop()
+            if outer is not prof:
+                prof.disable()
+                if outer is not None:
+                    cls._enable(outer)
+            cls._grown(name, growth)
+
+    @staticmethod
+    def _enable(prof):
+        try:
+            prof.enable()
+        except ValueError:
+            pass # Another thread's profile is on (Python 3.12+)
+
+    @classmethod
+    def _register(cls, name, frame):
+        import dis
+        code = frame.f_code
+        last = max([line for _, line in dis.findlinestarts(code) if line] + [frame.f_lineno])
+        with cls._lock:
+            cls._code[(code, frame.f_lineno)] = name
+            cls._ranges.setdefault(code.co_filename, []).append((frame.f_lineno, last, name))
+
+    @classmethod
+    def _grown(cls, name, growth):
+        """
+        Counts a call of the phase, and snapshots the allocations when
+        it left clearly more memory allocated than any call before.
+        """
+        import tracemalloc
+        with cls._lock:
+            stats = cls._growth.setdefault(name, [0, 0, None])
+            stats[0] += 1
+            if growth >= cls.SNAPSHOT_GROWTH and growth > stats[1] * 1.25:
+                stats[1] = growth
+                stats[2] = tracemalloc.take_snapshot()
+
+    @classmethod
+    def _phase_of(cls, traceback, frames):
+        """
+        Returns the phase of the most recent phase code in traceback,
+        remembering the phase of every frame looked at in frames.
+        """
+        for frame in reversed(traceback): # most recent first
+            name = frames.get(frame, False)
+            if name is False:
+                name = frames[frame] = next((name for first, last, name
+                                             in cls._ranges.get(frame.filename, ())
+                                             if first <= frame.lineno <= last), None)
+            if name is not None:
+                return name
+        return None
+
+    @classmethod
+    def allocations(cls, snapshot):
+        """
+        Sums up the allocations of a tracemalloc snapshot by phase and
+        line, returning a dict from phase to [size, count, frame] lists,
+        largest first.
+        """
+        phases = {}
+        frames = {}
+        for stat in snapshot.statistics('traceback'):
+            name = cls._phase_of(stat.traceback, frames)
+            if name is None:
+                continue
+            lines = phases.setdefault(name, {})
+            frame = stat.traceback[-1]
+            entry = lines.get(frame)
+            if entry is None:
+                entry = lines[frame] = [0, 0, frame]
+            entry[0] += stat.size
+            entry[1] += stat.count
+        return dict((name, sorted(lines.values(), key=lambda entry: entry[0], reverse=True))
+                    for name, lines in phases.items())
+
+    @classmethod
+    def _report(cls, title, entries):
+        lines = [title, '']
+        for size, count, frame in entries[:cls.TOP_ALLOCATIONS]:
+            lines.append('%10.1f KiB %8d  %s:%d' % (size / 1024.0, count, frame.filename, frame.lineno))
+        if len(entries) > cls.TOP_ALLOCATIONS:
+            rest = entries[cls.TOP_ALLOCATIONS:]
+            lines.append('%10.1f KiB %8d  (%d more lines)' % (sum(entry[0] for entry in rest) / 1024.0,
+                                                              sum(entry[1] for entry in rest), len(rest)))
+        if not entries:
+            lines.append('  (nothing)')
+        return lines
+
+    @classmethod
+    def write(cls, path):
+        """
+        Stops profiling and writes each phase's profile to
+        path.<phase>.pstats, for pstats or any viewer of its files, and
+        its top allocations to path.<phase>.alloc.txt: those still in
+        use after the call of the phase that grew memory the most, and
+        at the end of the run.
+        """
+        if not cls._enabled:
+            return
+        import pstats
+        import tracemalloc
+        cls._enabled = False
+        final = cls.allocations(tracemalloc.take_snapshot())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        with cls._lock:
+            profiles = dict(cls._profiles)
+            growth = dict(cls._growth)
+
+        names = [name for name in cls.PHASES if name in growth] + \
+            sorted(name for name in growth if name not in cls.PHASES)
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        except OSError as msg:
+            ScholarUtils.log('warn', 'could not write profiles: %s' % msg)
+            return
+        for name in names:
+            calls, grown, snapshot = growth[name]
+            lines = ['Phase %s: %d calls, peak of all traced memory %.1f KiB' % (name, calls, peak / 1024.0), '']
+            if snapshot is not None:
+                lines += cls._report('Allocated by the phase and in use after the call that grew '
+                                     'memory the most (+%.1f KiB):' % (grown / 1024.0),
+                                     cls.allocations(snapshot).get(name, []))
+                lines.append('')
+            lines += cls._report('Allocated by the phase and in use at the end of the run:',
+                                 final.get(name, []))
+            try:
+                stats = pstats.Stats(*profiles[name])
+                stats.dump_stats('%s.%s.pstats' % (path, name))
+                with open('%s.%s.alloc.txt' % (path, name), 'w') as fd:
+                    fd.write('\n'.join(lines) + '\n')
+            except (OSError, TypeError) as msg:
+                ScholarUtils.log('warn', 'could not write %s profile: %s' % (name, msg))
+
+
+class ScholarCache(object):
+    """
+    An on-disk cache of HTTP response bodies, keyed by canonical URL.
+    Each body is stored gzip-compressed in a file of its own. The
+    file's modification time records when the response was stored,
+    and is checked against the TTL of the URL's resource type (see
+    ScholarConf.CACHE_TTL); its access time records the last hit. When
+    the cache outgrows its maximum size, the least recently used
+    entries get evicted.
+
+    Use ScholarCache.open() to get the instance for a directory, so
+    that all queriers of a process share one view of its size.
+    """
+    # URL arguments that vary from session to session without changing
+    # the response, such as the signature Scholar puts in export links:
+    VOLATILE_ARGS = ('scisig', 'scisdr', 'cd')
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, max_size=None, ttl=None):
+        self.path = path
+        self.max_size = max_size or ScholarConf.CACHE_MAX_SIZE
+        self.ttl = ttl or ScholarConf.CACHE_TTL
+        self.size = None # Computed on first store
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        """Returns the shared cache instance for the given directory."""
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    @classmethod
+    def canonical_url(cls, url):
+        """
+        Normalizes a URL so that equivalent requests share an entry:
+        lower-case scheme and host, no fragment, sorted arguments,
+        minus volatile ones.
+        """
+        parts = urlsplit(url)
+        args = [arg for arg in parts.query.split('&')
+                if arg and arg.split('=', 1)[0] not in cls.VOLATILE_ARGS]
+        return '%s://%s%s?%s' % (parts.scheme.lower(), parts.netloc.lower(),
+                                 parts.path, '&'.join(sorted(args)))
+
+    def get(self, url):
+        """Returns the cached body for the URL if fresh, None otherwise."""
+        ttl = self.ttl.get(ScholarUtils.resource_type(url), 0)
+        if not ttl:
+            return None
+        fname = self._filename(url)
+        try:
+            stat = os.stat(fname)
+            now = time.time()
+            if now - stat.st_mtime > ttl:
+                return None
+            with open(fname, 'rb') as fd:
+                data = gzip.decompress(fd.read())
+            os.utime(fname, (now, stat.st_mtime))
+            return data
+        except (OSError, EOFError, zlib.error):
+            return None
+
+    def put(self, url, data):
+        """Stores the body for the URL, if its resource type is cached."""
+        if not self.ttl.get(ScholarUtils.resource_type(url), 0):
+            return
+        fname = self._filename(url)
+        tmpname = '%s.%d.%d.tmp' % (fname, os.getpid(), threading.get_ident())
+        data = gzip.compress(data)
+        try:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            try:
+                old_size = os.stat(fname).st_size
+            except OSError:
+                old_size = 0
+            with open(tmpname, 'wb') as fd:
+                fd.write(data)
+            os.replace(tmpname, fname)
+        except OSError as msg:
+            ScholarUtils.log('warn', 'could not write cache entry: %s' % msg)
+            return
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self._entries())
+            else:
+                self.size += len(data) - old_size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _filename(self, url):
+        import hashlib
+        digest = hashlib.sha1(self.canonical_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:] + '.gz')
+
+    def _entries(self):
+        """Yields (access time, size, filename) of every entry on disk."""
+        for dirpath, _, fnames in os.walk(self.path):
+            for fname in fnames:
+                if not fname.endswith('.gz'):
+                    continue
+                fname = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(fname)
+                except OSError:
+                    continue
+                yield stat.st_atime, stat.st_size, fname
+
+    def _evict(self):
+        # Shrink well below the maximum, so that eviction (which
+        # needs a scan of the whole cache) doesn't run on every store.
+        target = self.max_size * 0.9
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, fname in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(fname)
+                self.size -= size
+            except OSError:
+                pass
+        ScholarUtils.log('info', 'evicted cache entries, now %d bytes' % self.size)
+
+
+class ScholarClusterIndex(object):
+    """
+    Citation export data of articles by cluster ID, so that an article
+    that comes up again (say, a paper co-authored by several of the
+    authors queried) doesn't need another export request. Entries are
+    keyed by cluster ID and export format, as told by the export URL
+    (scholar.bib for BibTeX, scholar.enw for EndNote, etc).
+
+    The index lives in memory and, if given a path, in an SQLite file
+    too, where later processes find it. Use ScholarClusterIndex.open()
+    to get the instance that all queriers of a process share.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            try:
+                self.db = sqlite3.connect(path, isolation_level=None,
+                                          check_same_thread=False)
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute('CREATE TABLE IF NOT EXISTS scholar_clusters '
+                                '(cluster_id TEXT, format TEXT, data BLOB, '
+                                'PRIMARY KEY (cluster_id, format))')
+            except sqlite3.Error as msg:
+                ScholarUtils.log('warn', 'could not open cluster index %s: %s' % (path, msg))
+                self.db = None
+
+    @classmethod
+    def open(cls, path=None):
+        """
+        Returns the shared index persisted in the given file, or the
+        shared in-memory one if path is None.
+        """
+        if path is not None:
+            path = os.path.abspath(path)
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    @staticmethod
+    def export_format(url):
+        """Returns the export format of a citation export URL."""
+        path = urlsplit(url).path
+        return path.rsplit('.', 1)[-1] if '.' in path else path
+
+    def get(self, cluster_id, url):
+        """
+        Returns the data of the article with the given cluster ID in
+        the format of the given export URL, None if unknown.
+        """
+        key = (cluster_id, self.export_format(url))
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None and self.db is not None:
+                try:
+                    row = self.db.execute('SELECT data FROM scholar_clusters '
+                                          'WHERE cluster_id = ? AND format = ?', key).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is not None:
+                    data = self.entries[key] = bytes(row[0])
+        return data
+
+    def put(self, cluster_id, url, data):
+        """Stores the data retrieved from the given export URL."""
+        key = (cluster_id, self.export_format(url))
+        with self.lock:
+            self.entries[key] = data
+            if self.db is None:
+                return
+            try:
+                self.db.execute('INSERT OR REPLACE INTO scholar_clusters VALUES (?, ?, ?)',
+                                key + (sqlite3.Binary(data),))
+            except sqlite3.Error as msg:
+                ScholarUtils.log('warn', 'could not store in cluster index: %s' % msg)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+class ScholarContentDecoder(object):
+    """
+    Undoes the gzip or deflate content encoding of a response body,
+    given in chunks as it arrives. Bodies without (or with an unknown)
+    encoding pass through unchanged.
+    """
+    def __init__(self, encoding):
+        encoding = (encoding or '').strip().lower()
+        self._decoder = None
+        self._raw_deflate = False
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            # wbits of MAX_WBITS|32 accepts both gzip and zlib headers.
+            self._decoder = zlib.decompressobj(zlib.MAX_WBITS | 32)
+            self._raw_deflate = encoding == 'deflate'
+
+    def decode(self, data, final=False):
+        if self._decoder is None:
+            return data
+        try:
+            res = self._decoder.decompress(data)
+        except zlib.error:
+            if not self._raw_deflate:
+                raise
+            # Some servers send raw deflate streams without zlib header.
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._raw_deflate = False
+            res = self._decoder.decompress(data)
+        if final:
+            res += self._decoder.flush()
+        return res
+
+
+class ScholarKeepAliveResponse(object):
+    """
+    File-like wrapper around an HTTP response obtained through
+    ScholarKeepAliveHandler. It undoes gzip/deflate content encoding on
+    the fly and, once the body has been read completely, hands the
+    underlying connection back to the handler for reuse.
+    """
+    def __init__(self, resp, release):
+        self._resp = resp
+        self._release = release
+        self._done = False
+        self._pending = b''
+        self.code = self.status = resp.status
+        self.msg = self.reason = resp.reason
+        self.headers = resp.msg
+        self.url = resp.url
+
+        self._decoder = ScholarContentDecoder(resp.getheader('Content-Encoding'))
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self._pending + self._decoder.decode(self._resp.read(), final=True)
+            self._pending = b''
+        else:
+            while len(self._pending) < amt and not self._resp.isclosed():
+                chunk = self._resp.read(amt)
+                if not chunk and self._resp.length:
+                    # http.client takes a connection closed before all
+                    # of Content-Length arrived for the end of the body.
+                    import http.client
+                    self._finish(reusable=False)
+                    raise http.client.IncompleteRead(self._pending, self._resp.length)
+                self._pending += self._decoder.decode(chunk, final=not chunk)
+                if not chunk:
+                    break
+            data, self._pending = self._pending[:amt], self._pending[amt:]
+        if self._resp.isclosed() and not self._pending:
+            self._finish(reusable=True)
+        return data
+
+    def close(self):
+        # Closing before the body is consumed leaves unread data on the
+        # connection, so it can't be reused.
+        self._finish(reusable=self._resp.isclosed())
+        self._resp.close()
+
+    def _finish(self, reusable):
+        if self._done:
+            return
+        self._done = True
+        self._release(reusable and not self._resp.will_close)
+
+
+class ScholarKeepAliveHandler(object):
+    """
+    A urllib handler for HTTP and HTTPS that keeps connections open
+    across requests and reuses them for later requests to the same
+    host. It also requests compressed transfers, which the returned
+    ScholarKeepAliveResponse decodes transparently. It is safe to use
+    from several threads: each in-flight request gets a connection of
+    its own.
+
+    Like any urllib handler, it needs no base class, only the methods
+    urllib.request.BaseHandler would give it. Preparing requests is
+    left to the stock HTTP(S)Handler, which build_opener adds too.
+    """
+    # Go before the stock HTTP(S)Handler:
+    handler_order = 490
+
+    def __init__(self):
+        self.parent = None
+        self._idle = {} # (scheme, host) -> list of idle connections
+        self._lock = threading.Lock()
+
+    def add_parent(self, parent):
+        self.parent = parent
+
+    def __lt__(self, other):
+        # How the opener orders its handlers
+        if not hasattr(other, 'handler_order'):
+            return True
+        return self.handler_order < other.handler_order
+
+    def http_open(self, req):
+        import http.client
+        return self._open(http.client.HTTPConnection, req)
+
+    def https_open(self, req):
+        import http.client
+        return self._open(http.client.HTTPSConnection, req)
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _open(self, conn_class, req):
+        import http.client
+        if not req.host:
+            raise URLError('no host given')
+
+        # Mirrors AbstractHTTPHandler.do_open(), minus "Connection: close":
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Connection'] = 'keep-alive'
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        key = (conn_class, req.host, req._tunnel_host)
+        conn = self._checkout(key)
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = conn_class(req.host, timeout=req.timeout)
+                if req._tunnel_host:
+                    conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            try:
+                conn.request(req.get_method(), req.selector, req.data, headers)
+                resp = conn.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as err:
+                conn.close()
+                # The server may have timed out an idle connection
+                # since we last used it; try once more with a new one.
+                if reused:
+                    conn = None
+                    continue
+                raise URLError(err)
+
+        resp.url = req.get_full_url()
+        def release(reusable):
+            if reusable:
+                with self._lock:
+                    self._idle.setdefault(key, []).append(conn)
+            else:
+                conn.close()
+        return ScholarKeepAliveResponse(resp, release)
+
+    def _checkout(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            return conns.pop() if conns else None
+
+
 class ScholarArticle(object):
     """
     A class representing articles listed on Google Scholar.  The class
     provides basic dictionary-like behavior.
+
+    Since there are many articles to a query, the standard attributes
+    are kept in slots, their labels and ordering shared in FIELDS.
+    Other keys may still be set; those go to a dict made on first use.
     """
+    # The standard attributes, each with a user-suitable label, in
+    # report order. An attribute's ordering index is its position.
+    FIELDS = (('title',         'Title'),
+              ('url',           'URL'),
+              ('year',          'Year'),
+              ('num_citations', 'Citations'),
+              ('num_versions',  'Versions'),
+              ('cluster_id',    'Cluster ID'),
+              ('url_pdf',       'PDF link'),
+              ('url_citations', 'Citations list'),
+              ('url_versions',  'Versions list'),
+              ('url_citation',  'Citation link'),
+              ('excerpt',       'Excerpt'))
+    LABELS = dict(FIELDS)
+
+    __slots__ = tuple(LABELS) + ('citation_data', 'citation_loader', 'extra')
+
     def __init__(self):
-        # The triplets for each keyword correspond to (1) the actual
-        # value, (2) a user-suitable label for the item, and (3) an
-        # ordering index:
-        self.attrs = {
-            'title':         [None, 'Title',          0],
-            'url':           [None, 'URL',            1],
-            'year':          [None, 'Year',           2],
-            'num_citations': [0,    'Citations',      3],
-            'num_versions':  [0,    'Versions',       4],
-            'cluster_id':    [None, 'Cluster ID',     5],
-            'url_pdf':       [None, 'PDF link',       6],
-            'url_citations': [None, 'Citations list', 7],
-            'url_versions':  [None, 'Versions list',  8],
-            'url_citation':  [None, 'Citation link',  9],
-            'excerpt':       [None, 'Excerpt',       10],
-        }
+        for key in self.LABELS:
+            setattr(self, key, None)
+        self.num_citations = 0
+        self.num_versions = 0
+
+        # Values of keys other than the standard ones, if any.
+        self.extra = None
 
         # The citation data in one of the standard export formats,
         # e.g. BibTeX.
         self.citation_data = None
 
+        # Callable retrieving the citation data on first access, see
+        # as_citation(). Queriers set this in lazy mode.
+        self.citation_loader = None
+
+    @property
+    def attrs(self):
+        """
+        The attributes as the triplets articles used to keep for each
+        key: (1) the actual value, (2) a user-suitable label for the
+        item, and (3) an ordering index. This is a read-only snapshot,
+        so writes to it raise TypeError; set attributes through
+        item assignment on the article instead.
+        """
+        attrs = {}
+        for idx, (key, label) in enumerate(self.FIELDS):
+            # A deleted standard attribute leaves its slot empty.
+            if hasattr(self, key):
+                attrs[key] = (getattr(self, key), label, idx)
+        for idx, (key, value) in enumerate((self.extra or {}).items(), len(self.FIELDS)):
+            attrs[key] = (value, key, idx)
+        return MappingProxyType(attrs)
+
     def __getitem__(self, key):
-        if key in self.attrs:
-            return self.attrs[key][0]
+        if key in self.LABELS:
+            return getattr(self, key, None)
+        if self.extra is not None:
+            return self.extra.get(key)
         return None
 
     def __len__(self):
-        return len(self.attrs)
+        return sum(hasattr(self, key) for key in self.LABELS) + len(self.extra or ())
 
     def __setitem__(self, key, item):
-        if key in self.attrs:
-            self.attrs[key][0] = item
+        if key in self.LABELS:
+            setattr(self, key, item)
         else:
-            self.attrs[key] = [item, key, len(self.attrs)]
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = item
 
     def __delitem__(self, key):
-        if key in self.attrs:
-            del self.attrs[key]
+        if key in self.LABELS:
+            if hasattr(self, key):
+                delattr(self, key)
+        elif self.extra is not None:
+            self.extra.pop(key, None)
+
+    def as_record(self):
+        """
+        Returns the attributes as a plain dict, e.g. to send to another
+        process. ScholarArticle.from_record() makes an article of it.
+        """
+        record = dict((key, getattr(self, key)) for key in self.LABELS
+                      if hasattr(self, key))
+        record.update(self.extra or {})
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        art = cls()
+        for key in cls.LABELS:
+            if key not in record:
+                del art[key]
+        for key, value in record.items():
+            art[key] = value
+        return art
 
     def set_citation_data(self, citation_data):
         self.citation_data = citation_data
 
+    def set_citation_loader(self, loader):
+        """
+        Sets a callable that as_citation() invokes with this article
+        when no citation data has been retrieved yet. The callable is
+        expected to store the data via set_citation_data().
+        """
+        self.citation_loader = loader
+
     def as_txt(self):
         # Get items sorted in specified order:
         items = sorted(list(self.attrs.values()), key=lambda item: item[2])
@@ -339,21 +1469,26 @@ class ScholarArticle(object):
 
     def as_csv(self, header=False, sep='|'):
         # Get keys sorted in specified order:
+        attrs = self.attrs
         keys = [pair[0] for pair in \
-                sorted([(key, val[2]) for key, val in list(self.attrs.items())],
+                sorted([(key, val[2]) for key, val in list(attrs.items())],
                        key=lambda pair: pair[1])]
         res = []
         if header:
             res.append(sep.join(keys))
-        res.append(sep.join([unicode(self.attrs[key][0]) for key in keys]))
+        res.append(sep.join([str(attrs[key][0]) for key in keys]))
         return '\n'.join(res)
 
     def as_citation(self):
         """
         Reports the article in a standard citation format. This works only
         if you have configured the querier to retrieve a particular
-        citation export format. (See ScholarSettings.)
+        citation export format. (See ScholarSettings.) In lazy mode
+        (see ScholarQuerier.lazy_citations), the first call retrieves
+        the data.
         """
+        if self.citation_data is None and self.citation_loader is not None:
+            self.citation_loader(self)
         return self.citation_data or b''
 
 
@@ -363,6 +1498,10 @@ class ScholarArticleParser(object):
     Google Scholar. This is a base class; concrete implementations
     adapting to tweaks made by Google over time follow below.
     """
+    # Whether the parser can be fed a document in chunks, see
+    # ScholarArticleParserStream.
+    streaming = False
+
     def __init__(self, site=None):
         self.soup = None
         self.article = None
@@ -389,16 +1528,20 @@ class ScholarArticleParser(object):
         resulting instances via the handle_article callback.
         """
         self.soup = SoupKitchen.make_soup(html)
-
-        # This parses any global, non-itemized attributes from the page.
-        self._parse_globals()
-
-        # Now parse out listed articles:
-        for div in self.soup.findAll(ScholarArticleParser._tag_results_checker):
-            self._parse_article(div)
-            self._clean_article()
-            if self.article['title']:
-                self.handle_article(self.article)
+        try:
+            # This parses any global, non-itemized attributes from the page.
+            self._parse_globals()
+
+            # Now parse out listed articles:
+            for div in self.soup.findAll(ScholarArticleParser._tag_results_checker):
+                self._parse_article(div)
+                self._clean_article()
+                if self.article['title']:
+                    self.handle_article(self.article)
+        finally:
+            # Articles only keep strings taken from the tree.
+            SoupKitchen.release(self.soup)
+            self.soup = None
 
     def _clean_article(self):
         """
@@ -623,6 +1766,419 @@ class ScholarArticleParser120726(ScholarArticleParser):
                         self.article['excerpt'] = raw_text
 
 
+class ScholarArticleParserLxml(ScholarArticleParser):
+    """
+    This class parses the same results page layout as
+    ScholarArticleParser120726, producing identical articles, but
+    works directly on an lxml tree with XPath rather than on a
+    BeautifulSoup one, which is considerably faster. It requires the
+    lxml package.
+    """
+    # Matches divs that have the given class, among others:
+    XPATH_DIV = "div[contains(concat(' ', normalize-space(@class), ' '), ' %s ')]"
+    XPATH_RESULTS = '//' + XPATH_DIV % 'gs_r'
+    XPATH_TTSS = './/' + XPATH_DIV % 'gs_ttss'
+    XPATH_A = './/' + XPATH_DIV % 'gs_a'
+    XPATH_FL = './/' + XPATH_DIV % 'gs_fl'
+    XPATH_RS = './/' + XPATH_DIV % 'gs_rs'
+
+    def parse(self, html):
+        from lxml import html as lxml_html
+        if isinstance(html, bytes):
+            parser = lxml_html.HTMLParser(encoding='utf-8')
+            self.soup = lxml_html.document_fromstring(html, parser=parser)
+        else:
+            self.soup = lxml_html.document_fromstring(html)
+
+        try:
+            self._parse_globals()
+
+            for div in self.soup.xpath(self.XPATH_RESULTS):
+                self._parse_article(div)
+                self._clean_article()
+                if self.article['title']:
+                    self.handle_article(self.article)
+        finally:
+            self.soup = None
+
+    def _parse_globals(self):
+        tags = self.soup.xpath("//div[@id='gs_ab_md']")
+        if tags:
+            raw_text = next(tags[0].itertext(), None)
+            if raw_text is not None:
+                try:
+                    num_results = raw_text.split()[1]
+                    num_results = num_results.replace(',', '')
+                    num_results = int(num_results)
+                    self.handle_num_results(num_results)
+                except (IndexError, ValueError):
+                    pass
+
+    def _parse_article(self, div):
+        self.article = ScholarArticle()
+
+        for tag in div:
+            if not isinstance(tag.tag, str):
+                continue # Comments and the like
+
+            ttss = tag.xpath(self.XPATH_TTSS)
+            if ttss:
+                self._parse_links(ttss[0])
+
+            if tag.tag == 'div' and self._has_class(tag, 'gs_ri'):
+                # See ScholarArticleParser120726 for the two formats
+                # of titles, with link and without.
+                h3 = next(tag.iter('h3'), None)
+                if h3 is None:
+                    continue
+                atag = next(h3.iter('a'), None)
+                if atag is not None and atag.get('href') is not None:
+                    self.article['title'] = self._text(atag)
+                    self.article['url'] = self._path2url(atag.get('href'))
+                    if self.article['url'].endswith('.pdf'):
+                        self.article['url_pdf'] = self.article['url']
+                else:
+                    # Leave out spans with unneeded content (e.g. [CITATION])
+                    self.article['title'] = self._text(h3, skip='span')
+
+                tags = tag.xpath(self.XPATH_A)
+                if tags:
+                    year = self.year_re.findall(self._text(tags[0]))
+                    self.article['year'] = year[0] if len(year) > 0 else None
+
+                tags = tag.xpath(self.XPATH_FL)
+                if tags:
+                    self._parse_links(tags[0])
+
+                tags = tag.xpath(self.XPATH_RS)
+                if tags:
+                    # These are the content excerpts rendered into the results.
+                    raw_text = list(tags[0].itertext())
+                    if len(raw_text) > 0:
+                        self.article['excerpt'] = ''.join(raw_text).replace('\n', '')
+
+    def _parse_links(self, span):
+        for tag in span:
+            if tag.tag != 'a' or tag.get('href') is None:
+                continue
+            href = tag.get('href')
+
+            if href.startswith('/scholar?cites'):
+                string = self._string(tag)
+                if string is not None and string.startswith('Cited by'):
+                    self.article['num_citations'] = \
+                        self._as_int(string.split()[-1])
+
+                self.article['url_citations'] = \
+                    self._strip_url_arg('num', self._path2url(href))
+
+                args = self.article['url_citations'].split('?', 1)[1]
+                for arg in args.split('&'):
+                    if arg.startswith('cites='):
+                        self.article['cluster_id'] = arg[6:]
+
+            if href.startswith('/scholar?cluster'):
+                string = self._string(tag)
+                if string is not None and string.startswith('All '):
+                    self.article['num_versions'] = \
+                        self._as_int(string.split()[1])
+                self.article['url_versions'] = \
+                    self._strip_url_arg('num', self._path2url(href))
+
+            if self._text(tag).startswith('Import'):
+                self.article['url_citation'] = self._path2url(href)
+
+    @staticmethod
+    def _has_class(tag, klass):
+        return klass in (tag.get('class') or '').split()
+
+    @staticmethod
+    def _text(tag, skip=None):
+        """
+        Returns all text inside the element, like BeautifulSoup's
+        getText(), leaving out the content of any skip elements.
+        """
+        if skip is None:
+            return ''.join(tag.itertext())
+        res = [tag.text or '']
+        for child in tag:
+            if isinstance(child.tag, str) and child.tag != skip:
+                res.append(ScholarArticleParserLxml._text(child, skip))
+            res.append(child.tail or '')
+        return ''.join(res)
+
+    @staticmethod
+    def _string(tag):
+        """
+        Returns the element's only string, like BeautifulSoup's .string:
+        its text if it has no children, the only child's string if it
+        contains nothing else, and None otherwise.
+        """
+        if len(tag) == 0:
+            return tag.text
+        if len(tag) == 1 and not tag.text and not tag[0].tail:
+            return ScholarArticleParserLxml._string(tag[0])
+        return None
+
+
+class ScholarArticleParserStream(ScholarArticleParser):
+    """
+    This class extracts the same articles as ScholarArticleParser120726
+    without building a document tree. It follows the parser events of
+    Python's html.parser and keeps state only for the regions of a
+    result it takes data from (gs_r, gs_ri, gs_a, gs_fl, ...). Articles
+    are handed to handle_article as soon as their result ends.
+
+    Since it is incremental, the document may be fed in chunks as they
+    arrive over the network, via feed() and a final close(); parse()
+    does both for a complete document.
+    """
+    streaming = True
+
+    # Elements that never have content or an end tag:
+    VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img',
+                           'input', 'link', 'meta', 'param', 'source',
+                           'track', 'wbr'])
+
+    class Extractor(HTMLParser):
+        """Translates html.parser events into the owner's callbacks."""
+        def __init__(self, owner):
+            HTMLParser.__init__(self, convert_charrefs=True)
+            self.owner = owner
+
+        def handle_starttag(self, tag, attrs):
+            self.owner._start(tag, attrs)
+
+        def handle_startendtag(self, tag, attrs):
+            self.owner._start(tag, attrs)
+            if tag not in self.owner.VOID_TAGS:
+                self.owner._end(tag)
+
+        def handle_endtag(self, tag):
+            self.owner._end(tag)
+
+        def handle_data(self, data):
+            self.owner._data(data)
+
+    def __init__(self, site=None):
+        ScholarArticleParser.__init__(self, site)
+        self._extractor = None
+        self._decoder = None
+        self._stack = [] # (tag, role) of each open element
+        self._result = None # State of the result being parsed
+        self._in_globals = False
+        self._globals_text = None
+
+    def parse(self, html):
+        self.feed(html)
+        self.close()
+
+    def feed(self, chunk):
+        """Parses the next chunk of the document, bytes or str."""
+        if self._extractor is None:
+            self._extractor = self.Extractor(self)
+            self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            self._stack = []
+            self._result = None
+            self._in_globals = False
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        self._extractor.feed(chunk)
+
+    def close(self):
+        """Finishes parsing the document fed so far."""
+        if self._extractor is None:
+            return
+        self._extractor.feed(self._decoder.decode(b'', final=True))
+        self._extractor.close()
+        # Unclosed elements end with the document:
+        while self._stack:
+            self._pop()
+        self._extractor = None
+
+    def _start(self, tag, attrs):
+        self._end_string()
+        attrs = dict(attrs)
+        klass = (attrs.get('class') or '').split()
+        res = self._result
+        role = None
+
+        if tag == 'div' and attrs.get('id') == 'gs_ab_md':
+            role = 'globals'
+            self._globals_text = None
+            self._in_globals = True
+        elif res is None:
+            if tag == 'div' and 'gs_r' in klass:
+                role = 'result'
+                self.article = ScholarArticle()
+                # Per-result state: depth of the result element, and
+                # which of its regions we have seen, are in, or gather
+                # text for.
+                res = self._result = {'depth': len(self._stack) + 1,
+                                      'seen': set(), 'in': set(),
+                                      'links': None, 'link': None,
+                                      'h3_text': [], 'a_text': None,
+                                      'a_href': None, 'span': 0,
+                                      'text': None}
+        else:
+            depth = len(self._stack) + 1 - res['depth']
+            parent_role = self._stack[-1][1]
+            if depth == 1:
+                res['seen'].discard('ttss')
+            if tag == 'div' and 'gs_ri' in klass and depth == 1:
+                role = 'ri'
+                res['seen'] -= set(['h3', 'gs_a', 'gs_fl', 'gs_rs'])
+            elif tag == 'div' and 'gs_ttss' in klass and depth > 1 \
+                    and 'ttss' not in res['seen']:
+                role = 'links'
+                res['seen'].add('ttss')
+            elif 'ri' in res['in'] and not res['in'] & set(['h3', 'gs_a', 'links', 'gs_rs']):
+                if tag == 'h3' and 'h3' not in res['seen']:
+                    role = 'h3'
+                    res['h3_text'], res['a_text'], res['a_href'] = [], None, None
+                elif tag == 'div' and 'gs_a' in klass and 'gs_a' not in res['seen']:
+                    role = 'gs_a'
+                    res['text'] = []
+                elif tag == 'div' and 'gs_fl' in klass and 'gs_fl' not in res['seen']:
+                    role = 'links'
+                    res['seen'].add('gs_fl')
+                elif tag == 'div' and 'gs_rs' in klass and 'gs_rs' not in res['seen']:
+                    role = 'gs_rs'
+                    res['text'] = []
+            elif 'h3' in res['in']:
+                if tag == 'a' and res['a_text'] is None:
+                    role = 'h3_a'
+                    res['a_text'], res['a_href'] = [], attrs.get('href')
+                elif tag == 'span':
+                    role = 'h3_span'
+            elif parent_role == 'links' and tag == 'a':
+                role = 'link'
+                res['link'] = {'href': attrs.get('href'), 'text': [], 'children': 0}
+            elif res['link'] is not None and parent_role == 'link':
+                res['link']['children'] += 1
+
+        if role is not None and res is not None and role != 'result':
+            if role == 'h3_span':
+                res['span'] += 1
+            else:
+                res['in'].add(role)
+                res['seen'].add(role)
+        if tag not in self.VOID_TAGS:
+            self._stack.append((tag, role))
+
+    def _end(self, tag):
+        self._end_string()
+        # Tolerate stray end tags, and close unclosed elements like
+        # browsers do.
+        for idx in range(len(self._stack) - 1, -1, -1):
+            if self._stack[idx][0] == tag:
+                while len(self._stack) > idx:
+                    self._pop()
+                return
+
+    def _pop(self):
+        _, role = self._stack.pop()
+        if role is None:
+            return
+        if role == 'globals':
+            self._in_globals = False
+            self._parse_globals()
+            return
+        res = self._result
+        if role == 'result':
+            self._clean_article()
+            if self.article['title']:
+                self.handle_article(self.article)
+            self._result = None
+        elif role == 'h3_span':
+            res['span'] -= 1
+        else:
+            res['in'].discard(role)
+            if role == 'h3':
+                if res['a_text'] is not None and res['a_href'] is not None:
+                    self.article['title'] = ''.join(res['a_text'])
+                    self.article['url'] = self._path2url(res['a_href'])
+                    if self.article['url'].endswith('.pdf'):
+                        self.article['url_pdf'] = self.article['url']
+                else:
+                    # Leave out spans with unneeded content (e.g. [CITATION])
+                    self.article['title'] = ''.join(res['h3_text'])
+            elif role == 'gs_a':
+                year = self.year_re.findall(''.join(res['text']))
+                self.article['year'] = year[0] if len(year) > 0 else None
+            elif role == 'gs_rs':
+                # These are the content excerpts rendered into the results.
+                if len(res['text']) > 0:
+                    self.article['excerpt'] = ''.join(res['text']).replace('\n', '')
+            elif role == 'link':
+                self._parse_link(res['link'])
+                res['link'] = None
+
+    def _end_string(self):
+        # html.parser may report a string in several pieces, but any
+        # tag ends it.
+        if self._globals_text is not None:
+            self._in_globals = False
+
+    def _data(self, data):
+        if self._in_globals:
+            self._globals_text = (self._globals_text or '') + data
+        res = self._result
+        if res is None or not res['in']:
+            return
+        if 'h3' in res['in']:
+            if res['span'] == 0:
+                res['h3_text'].append(data)
+            if 'h3_a' in res['in']:
+                res['a_text'].append(data)
+        if 'gs_a' in res['in'] or 'gs_rs' in res['in']:
+            res['text'].append(data)
+        if 'link' in res['in']:
+            res['link']['text'].append(data)
+
+    def _parse_globals(self):
+        raw_text = self._globals_text
+        if raw_text is not None:
+            try:
+                num_results = raw_text.split()[1]
+                num_results = num_results.replace(',', '')
+                num_results = int(num_results)
+                self.handle_num_results(num_results)
+            except (IndexError, ValueError):
+                pass
+
+    def _parse_link(self, link):
+        href = link['href']
+        if href is None:
+            return
+        text = ''.join(link['text'])
+        # Like BeautifulSoup's .string, only defined for plain links:
+        string = text if link['children'] <= 1 else None
+
+        if href.startswith('/scholar?cites'):
+            if string is not None and string.startswith('Cited by'):
+                self.article['num_citations'] = \
+                    self._as_int(string.split()[-1])
+
+            self.article['url_citations'] = \
+                self._strip_url_arg('num', self._path2url(href))
+
+            args = self.article['url_citations'].split('?', 1)[1]
+            for arg in args.split('&'):
+                if arg.startswith('cites='):
+                    self.article['cluster_id'] = arg[6:]
+
+        if href.startswith('/scholar?cluster'):
+            if string is not None and string.startswith('All '):
+                self.article['num_versions'] = \
+                    self._as_int(string.split()[1])
+            self.article['url_versions'] = \
+                self._strip_url_arg('num', self._path2url(href))
+
+        if text.startswith('Import'):
+            self.article['url_citation'] = self._path2url(href)
+
+
 class ScholarQuery(object):
     """
     The base class for any kind of results query we send to Scholar.
@@ -707,7 +2263,7 @@ class ClusterScholarQuery(ScholarQuery):
     This version just pulls up an article cluster whose ID we already
     know about.
     """
-    SCHOLAR_CLUSTER_URL = ScholarConf.SCHOLAR_SITE + '/scholar?' \
+    SCHOLAR_CLUSTER_URL = '%(site)s/scholar?' \
         + 'cluster=%(cluster)s' \
         + '%(num)s'
 
@@ -731,13 +2287,15 @@ class ClusterScholarQuery(ScholarQuery):
         urlargs = {'cluster': self.cluster }
 
         for key, val in urlargs.items():
-            urlargs[key] = quote(encode(val))
+            urlargs[key] = quote(str(val))
 
         # The following URL arguments must not be quoted, or the
         # server will not recognize them:
         urlargs['num'] = ('&num=%d' % self.num_results
                           if self.num_results is not None else '')
 
+        urlargs['site'] = ScholarConf.SCHOLAR_SITE
+
         return self.SCHOLAR_CLUSTER_URL % urlargs
 
 
@@ -746,7 +2304,7 @@ class SearchScholarQuery(ScholarQuery):
     This version represents the search query parameters the user can
     configure on the Scholar website, in the advanced search options.
     """
-    SCHOLAR_QUERY_URL = ScholarConf.SCHOLAR_SITE + '/scholar?' \
+    SCHOLAR_QUERY_URL = '%(site)s/scholar?' \
         + 'as_q=%(words)s' \
         + '&as_epq=%(phrase)s' \
         + '&as_oq=%(words_some)s' \
@@ -760,6 +2318,7 @@ class SearchScholarQuery(ScholarQuery):
         + '&as_vis=%(citations)s' \
         + '&btnG=&hl=en' \
         + '%(num)s' \
+        + '%(sort)s' \
         + '&as_sdt=%(patents)s%%2C5'
 
     def __init__(self):
@@ -776,6 +2335,7 @@ class SearchScholarQuery(ScholarQuery):
         self.timeframe = [None, None]
         self.include_patents = True
         self.include_citations = True
+        self.sort_by_date = False
 
     def set_words(self, words):
         """Sets words that *all* must be found in the result."""
@@ -832,6 +2392,14 @@ class SearchScholarQuery(ScholarQuery):
     def set_include_patents(self, yesorno):
         self.include_patents = yesorno
 
+    def set_sort_by_date(self, yesorno):
+        """
+        Sets Boolean indicating whether to list the most recently added
+        results first, instead of the most relevant ones. Scholar then
+        only lists results added during the last year or so.
+        """
+        self.sort_by_date = yesorno
+
     def get_url(self):
         if self.words is None and self.words_some is None \
            and self.words_none is None and self.phrase is None \
@@ -866,12 +2434,14 @@ class SearchScholarQuery(ScholarQuery):
                    'citations': '0' if self.include_citations else '1'}
 
         for key, val in urlargs.items():
-            urlargs[key] = quote(encode(val))
+            urlargs[key] = quote(str(val))
 
         # The following URL arguments must not be quoted, or the
         # server will not recognize them:
         urlargs['num'] = ('&num=%d' % self.num_results
                           if self.num_results is not None else '')
+        urlargs['sort'] = '&scisbd=1' if self.sort_by_date else ''
+        urlargs['site'] = ScholarConf.SCHOLAR_SITE
 
         return self.SCHOLAR_QUERY_URL % urlargs
 
@@ -920,11 +2490,12 @@ class ScholarQuerier(object):
     ScholarArticle instances.
     """
 
-    # Default URLs for visiting and submitting Settings pane, as of 3/14
-    GET_SETTINGS_URL = ScholarConf.SCHOLAR_SITE + '/scholar_settings?' \
+    # Default URLs for visiting and submitting Settings pane, as of 3/14.
+    # %(site)s is ScholarConf.SCHOLAR_SITE at the time of the request.
+    GET_SETTINGS_URL = '%(site)s/scholar_settings?' \
         + 'sciifh=1&hl=en&as_sdt=0,5'
 
-    SET_SETTINGS_URL = ScholarConf.SCHOLAR_SITE + '/scholar_setprefs?' \
+    SET_SETTINGS_URL = '%(site)s/scholar_setprefs?' \
         + 'q=' \
         + '&scisig=%(scisig)s' \
         + '&inststart=0' \
@@ -938,11 +2509,12 @@ class ScholarQuerier(object):
     # Older URLs:
     # ScholarConf.SCHOLAR_SITE + '/scholar?q=%s&hl=en&btnG=Search&as_sdt=2001&as_sdtp=on
 
-    class Parser(ScholarArticleParser120726):
-        def __init__(self, querier):
-            ScholarArticleParser120726.__init__(self)
-            self.querier = querier
+    # What gives away the CAPTCHA pages of Scholar, and of the Google
+    # page it sends suspected robots to:
+    CAPTCHA_MARKERS = (b'id="gs_captcha_ccl"', b'id="captcha-form"', b'class="g-recaptcha"')
 
+    class ParserCallbacks(object):
+        """Mixin handing the parser's results to the querier."""
         def handle_num_results(self, num_results):
             if self.querier is not None and self.querier.query is not None:
                 self.querier.query['num_results'] = num_results
@@ -950,11 +2522,108 @@ class ScholarQuerier(object):
         def handle_article(self, art):
             self.querier.add_article(art)
 
-    def __init__(self):
+    class Parser(ParserCallbacks, ScholarArticleParser120726):
+        def __init__(self, querier):
+            ScholarArticleParser120726.__init__(self)
+            self.querier = querier
+
+    class LxmlParser(ParserCallbacks, ScholarArticleParserLxml):
+        def __init__(self, querier):
+            ScholarArticleParserLxml.__init__(self)
+            self.querier = querier
+
+    class StreamParser(ParserCallbacks, ScholarArticleParserStream):
+        def __init__(self, querier):
+            ScholarArticleParserStream.__init__(self)
+            self.querier = querier
+
+    # Parser implementations selectable via ScholarConf.PARSER:
+    PARSERS = {'bs4': Parser, 'lxml': LxmlParser, 'stream': StreamParser}
+
+    class QueryResults(object):
+        """
+        The results of one query. Stands in for the querier in the
+        callbacks of the query's parser, so that a page can be parsed
+        apart from the querier's articles: along with other pages in
+        AsyncScholarQuerier, or in another process by
+        parse_results_page().
+        """
+        def __init__(self, query):
+            self.query = query
+            self.articles = []
+
+        def add_article(self, art):
+            self.articles.append(art)
+
+    class PageConsumer(object):
+        """
+        Parses the results page of a query while it downloads, timing
+        the parser only. When the download breaks off midway, the retry
+        starts over from the first byte, so _get_http_response()
+        restart()s the consumer first: with a fresh parser, and none of
+        the articles of the failed attempt.
+        """
+        def __init__(self, querier, query):
+            self.querier = querier
+            self.query = query
+            self.restart()
+
+        def restart(self):
+            self.results = self.querier.QueryResults(self.query)
+            self.parser = self.querier._make_parser(self.results)
+            self.elapsed = 0.0
+
+        def __call__(self, data):
+            start = time.perf_counter()
+            with ScholarProfiler.phase('parse'):
+                self.parser.feed(data)
+            self.elapsed += time.perf_counter() - start
+
+        def close(self):
+            """Finishes the parse, returning the articles found."""
+            start = time.perf_counter()
+            with ScholarProfiler.phase('parse'):
+                self.parser.close()
+            self.elapsed += time.perf_counter() - start
+            ScholarMetrics.observe('scholar_parse_seconds', self.elapsed, parser=self.querier.parser)
+            return self.results.articles
+
+    def __init__(self, rate_limiter=None, retry_policy=None):
         self.articles = []
         self.query = None
+        from http.cookiejar import MozillaCookieJar
         self.cjar = MozillaCookieJar()
 
+        # An optional ScholarRateLimiter, possibly shared with other
+        # queriers, that every outgoing request must pass through:
+        self.rate_limiter = rate_limiter
+        # The ScholarRetryPolicy deciding on retries of failed requests,
+        # by default the process-wide one so the budget is shared too:
+        self.retry_policy = retry_policy or ScholarRetryPolicy.shared()
+        self.citation_workers = max(1, ScholarConf.CITATION_WORKERS)
+        self.cache = None
+        if ScholarConf.CACHE_DIR:
+            self.cache = ScholarCache.open(ScholarConf.CACHE_DIR)
+        # Citation data of articles seen before, by cluster ID:
+        self.cluster_index = ScholarClusterIndex.open(ScholarConf.CLUSTER_INDEX)
+
+        # In lazy mode, parsed articles don't have their citation data
+        # retrieved up front; ScholarArticle.as_citation() fetches it
+        # on first access, or callers can pick the articles they need
+        # and pass them to fetch_citation_data(). In eager mode, an
+        # optional predicate limits up-front retrieval to the articles
+        # it accepts; the others remain retrievable lazily.
+        self.lazy_citations = False
+        self.citation_filter = None
+        # An optional predicate telling whether citation data is what
+        # was asked for, e.g. a BibTeX entry and not an error page.
+        # Data it rejects is neither cached nor kept in the cluster
+        # index, and its retrieval counts as failed.
+        self.citation_check = None
+
+        # Name of the results page parser to use, see PARSERS.
+        self.parser = ScholarConf.PARSER
+
         # If we have a cookie file, load it:
         if ScholarConf.COOKIE_JAR_FILE and \
            os.path.exists(ScholarConf.COOKIE_JAR_FILE):
@@ -966,8 +2635,11 @@ class ScholarQuerier(object):
                 ScholarUtils.log('warn', 'could not load cookies file: %s' % msg)
                 self.cjar = MozillaCookieJar() # Just to be safe
 
-        self.opener = build_opener(HTTPCookieProcessor(self.cjar))
+        from urllib.request import HTTPCookieProcessor, build_opener
+        self.opener = build_opener(ScholarKeepAliveHandler(),
+                                   HTTPCookieProcessor(self.cjar))
         self.settings = None # Last settings object, if any
+        self.scisig = None # Token from the Settings pane, once retrieved
 
     def apply_settings(self, settings):
         """
@@ -981,29 +2653,61 @@ class ScholarQuerier(object):
         # This is a bit of work. We need to actually retrieve the
         # contents of the Settings pane HTML in order to extract
         # hidden fields before we can compose the query for updating
-        # the settings.
-        html = self._get_http_response(url=self.GET_SETTINGS_URL,
-                                       log_msg='dump of settings form HTML',
-                                       err_msg='requesting settings failed')
+        # the settings. We keep the "scisig" token we get there, so
+        # that applying settings again needs just one request.
+        cached_scisig = self.scisig is not None
+        if not cached_scisig:
+            self.scisig = self._get_scisig()
+            if self.scisig is None:
+                return False
+
+        html = self._get_http_response(url=self._settings_url(settings),
+                                       log_msg='dump of settings result HTML',
+                                       err_msg='applying setttings failed')
         if html is None:
+            self.scisig = None
+            if cached_scisig:
+                # The token may have expired, retry with a fresh one.
+                return self.apply_settings(settings)
             return False
 
-        # Now parse the required stuff out of the form. We require the
-        # "scisig" token to make the upload of our settings acceptable
-        # to Google.
-        soup = SoupKitchen.make_soup(html)
-
-        tag = soup.find(name='form', attrs={'id': 'gs_bdy_frm'})
-        if tag is None:
-            ScholarUtils.log('info', 'parsing settings failed: no form')
-            return False
+        ScholarUtils.log('info', 'settings applied')
+        return True
 
-        tag = tag.find('input', attrs={'type':'hidden', 'name':'scisig'})
-        if tag is None:
-            ScholarUtils.log('info', 'parsing settings failed: scisig')
-            return False
+    def has_settings_cookie(self, settings):
+        """
+        Checks whether the cookies hold the given settings, as Scholar
+        records them in its GSP cookie (e.g. "...:CF=4:NR=10:...").
+        """
+        if settings is None or not settings.is_configured():
+            return True
+        expected = []
+        if settings.citform != 0:
+            expected.append('CF=%d' % settings.citform)
+        if settings.per_page_results is not None:
+            expected.append('NR=%d' % settings.per_page_results)
+        for cookie in self.cjar:
+            if cookie.name == 'GSP' and cookie.value is not None:
+                fields = cookie.value.split(':')
+                return all(field in fields for field in expected)
+        return False
+
+    def _get_scisig(self):
+        """
+        Retrieves the Settings pane and returns the "scisig" token
+        Google requires to accept an upload of settings, or None.
+        """
+        html = self._get_http_response(url=self.GET_SETTINGS_URL % {'site': ScholarConf.SCHOLAR_SITE},
+                                       log_msg='dump of settings form HTML',
+                                       err_msg='requesting settings failed')
+        if html is None:
+            return None
+        return self._parse_scisig(html)
 
-        urlargs = {'scisig': tag['value'],
+    def _settings_url(self, settings):
+        """Returns the URL uploading the settings, given the scisig token."""
+        urlargs = {'site': ScholarConf.SCHOLAR_SITE,
+                   'scisig': self.scisig,
                    'num': settings.per_page_results,
                    'scis': 'no',
                    'scisf': ''}
@@ -1011,15 +2715,26 @@ class ScholarQuerier(object):
         if settings.citform != 0:
             urlargs['scis'] = 'yes'
             urlargs['scisf'] = '&scisf=%d' % settings.citform
+        return self.SET_SETTINGS_URL % urlargs
 
-        html = self._get_http_response(url=self.SET_SETTINGS_URL % urlargs,
-                                       log_msg='dump of settings result HTML',
-                                       err_msg='applying setttings failed')
-        if html is None:
-            return False
+    @staticmethod
+    def _parse_scisig(html):
+        """Returns the scisig token of the Settings pane HTML, or None."""
+        soup = SoupKitchen.make_soup(html)
+        try:
+            tag = soup.find(name='form', attrs={'id': 'gs_bdy_frm'})
+            if tag is None:
+                ScholarUtils.log('info', 'parsing settings failed: no form')
+                return None
 
-        ScholarUtils.log('info', 'settings applied')
-        return True
+            tag = tag.find('input', attrs={'type':'hidden', 'name':'scisig'})
+            if tag is None:
+                ScholarUtils.log('info', 'parsing settings failed: scisig')
+                return None
+
+            return str(tag['value'])
+        finally:
+            SoupKitchen.release(soup)
 
     def send_query(self, query):
         """
@@ -1029,6 +2744,20 @@ class ScholarQuerier(object):
         self.clear_articles()
         self.query = query
 
+        if self.PARSERS[self.parser].streaming:
+            # Parse the page while it downloads.
+            consumer = self.PageConsumer(self, query)
+            if self._get_http_response(url=query.get_url(),
+                                       log_msg='dump of query response HTML',
+                                       err_msg='results retrieval failed',
+                                       consumer=consumer) is None:
+                return
+            self.articles = consumer.close()
+            if not self.articles:
+                ScholarMetrics.inc('scholar_empty_pages_total')
+            self._articles_parsed(self.articles)
+            return
+
         html = self._get_http_response(url=query.get_url(),
                                        log_msg='dump of query response HTML',
                                        err_msg='results retrieval failed')
@@ -1037,6 +2766,34 @@ class ScholarQuerier(object):
 
         self.parse(html)
 
+    def fetch_query(self, query):
+        """
+        Retrieves the results page of a query without parsing it, and
+        returns its HTML, None on failure. Unlike send_query(), it
+        leaves the querier's articles alone, so it may run in another
+        thread meanwhile, see ScholarPagePipeline.
+        """
+        return self._get_http_response(url=query.get_url(),
+                                       log_msg='dump of query response HTML',
+                                       err_msg='results retrieval failed')
+
+    def load_page(self, query, page):
+        """
+        Takes the results page of the query parsed elsewhere, as
+        parse_results_page() returns it, as if send_query() had parsed
+        it.
+        """
+        num_results, records, seconds = page
+        self.clear_articles()
+        self.query = query
+        if num_results is not None:
+            query['num_results'] = num_results
+        self.articles = [ScholarArticle.from_record(record) for record in records]
+        ScholarMetrics.observe('scholar_parse_seconds', seconds, parser=self.parser)
+        if not self.articles:
+            ScholarMetrics.inc('scholar_empty_pages_total')
+        self._articles_parsed(self.articles)
+
     def get_citation_data(self, article):
         """
         Given an article, retrieves citation link. Note, this requires that
@@ -1045,28 +2802,106 @@ class ScholarQuerier(object):
         """
         if article['url_citation'] is None:
             return False
-        if article.citation_data is not None:
+        if self._reuse_citation_data(article):
             return True
 
         ScholarUtils.log('info', 'retrieving citation export data')
         data = self._get_http_response(url=article['url_citation'],
                                        log_msg='citation data response',
-                                       err_msg='requesting citation data failed')
+                                       err_msg='requesting citation data failed',
+                                       check=self.citation_check)
         if data is None:
             return False
 
-        article.set_citation_data(data)
+        self._store_citation_data(article, data)
         return True
 
+    def _reuse_citation_data(self, article):
+        """
+        Checks whether the article has its citation data already, and
+        if not, whether it came up before, e.g. in another author's
+        results. Then it gets that article's data.
+        """
+        if article.citation_data is not None:
+            return True
+
+        cluster_id = article['cluster_id']
+        if cluster_id is not None:
+            data = self.cluster_index.get(cluster_id, article['url_citation'])
+            if data is not None and self.citation_check is not None and \
+               not self.citation_check(data):
+                data = None
+            if data is not None:
+                ScholarUtils.log('info', 'reusing citation export data of cluster %s' % cluster_id)
+                ScholarMetrics.inc('scholar_cluster_index_hits_total')
+                article.set_citation_data(data)
+                return True
+        return False
+
+    def _store_citation_data(self, article, data):
+        if article['cluster_id'] is not None:
+            self.cluster_index.put(article['cluster_id'], article['url_citation'], data)
+        article.set_citation_data(data)
+
+    def fetch_citation_data(self, articles):
+        """
+        Retrieves citation data for several articles, keeping up to
+        citation_workers requests in flight at once. Each article
+        receives its own data regardless of the order in which the
+        responses arrive.
+        """
+        articles = [art for art in articles
+                    if art['url_citation'] is not None and art.citation_data is None]
+        if self.citation_workers == 1 or len(articles) < 2:
+            for art in articles:
+                self.get_citation_data(art)
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(self.citation_workers, len(articles))) as pool:
+            # Consuming the results re-raises the first failure, e.g. a 503.
+            list(pool.map(self.get_citation_data, articles))
+
     def parse(self, html):
         """
         This method allows parsing of provided HTML content.
         """
-        parser = self.Parser(self)
-        parser.parse(html)
+        first = len(self.articles)
+        with ScholarMetrics.timer('scholar_parse_seconds', parser=self.parser), \
+             ScholarProfiler.phase('parse'):
+            self._make_parser().parse(html)
+        if len(self.articles) == first:
+            ScholarMetrics.inc('scholar_empty_pages_total')
+        self._articles_parsed(self.articles[first:])
+
+    def _make_parser(self, target=None):
+        """
+        Returns a parser handing its results to target, by default the
+        querier itself.
+        """
+        if target is None:
+            target = self
+        if self.parser == 'bs4':
+            return self.Parser(target)
+        return self.PARSERS[self.parser](target)
+
+    def _articles_parsed(self, articles):
+        """
+        Prepares retrieval of citation data for newly parsed articles,
+        and retrieves it unless in lazy mode.
+        """
+        for art in articles:
+            art.set_citation_loader(self.get_citation_data)
+        self.fetch_citation_data(self._citations_wanted(articles))
+
+    def _citations_wanted(self, articles):
+        """Returns the articles to retrieve citation data for up front."""
+        if self.lazy_citations:
+            return []
+        if self.citation_filter is not None:
+            return [art for art in articles if self.citation_filter(art)]
+        return articles
 
     def add_article(self, art):
-        self.get_citation_data(art)
         self.articles.append(art)
 
     def clear_articles(self):
@@ -1089,35 +2924,884 @@ class ScholarQuerier(object):
             ScholarUtils.log('warn', 'could not save cookies file: %s' % msg)
             return False
 
-    def _get_http_response(self, url, log_msg=None, err_msg=None):
+    def _get_http_response(self, url, log_msg=None, err_msg=None, consumer=None, check=None):
         """
         Helper method, sends HTTP request and returns response payload.
+        If a consumer (see PageConsumer) is given, it instead receives
+        the payload in chunks as they arrive, and the return value is
+        True on success. Failures return None either way, after
+        retrying as the querier's retry policy allows. When Scholar
+        keeps blocking us (see ScholarRetryPolicy.BLOCKING_STATUSES),
+        the HTTPError gets raised instead. A payload the optional check
+        predicate rejects is a failure too, and doesn't get cached.
         """
         if log_msg is None:
             log_msg = 'HTTP response data follow'
         if err_msg is None:
             err_msg = 'request failed'
-        try:
-            ScholarUtils.log('info', 'requesting %s' % unquote(url))
+        rtype = ScholarUtils.resource_type(url)
+        if self.cache is not None:
+            with ScholarProfiler.phase('fetch'):
+                html = self._cached_response(url, rtype, check)
+            if html is not None:
+                if consumer is None:
+                    return html
+                consumer(html)
+                return True
+
+        attempt = 0
+        while True:
+            try:
+                with ScholarProfiler.phase('fetch'):
+                    return self._request(url, rtype, log_msg, consumer, check)
+            except URLError as err:
+                delay = self._retry_delay(err, attempt, rtype, err_msg)
+            if delay is None:
+                return None
+            time.sleep(delay)
+            attempt += 1
+            if consumer is not None:
+                # It may have had part of the body already.
+                consumer.restart()
+
+    def _cached_response(self, url, rtype, check=None):
+        html = self.cache.get(url)
+        if html is not None and (self._is_captcha(html) or check is not None and not check(html)):
+            # Stored by versions that didn't tell CAPTCHAs from pages,
+            # or didn't check the payload.
+            html = None
+        if html is not None:
+            ScholarUtils.log('info', 'using cached response for %s' % unquote(url))
+            ScholarMetrics.inc('scholar_cache_hits_total', type=rtype)
+        return html
+
+    @classmethod
+    def _is_captcha(cls, data):
+        return any(marker in data for marker in cls.CAPTCHA_MARKERS)
+
+    def _retry_delay(self, err, attempt, rtype, err_msg):
+        """
+        Decides on the retry of a request that failed with the given
+        HTTPError or URLError: returns the seconds to wait before it,
+        or None to give up. Blocks and connection failures that outlast
+        the retries re-raise the error.
+        """
+        if isinstance(err, HTTPError):
+            status = err.code
+            delay = self.retry_policy.delay(status, attempt, err.headers.get('Retry-After'))
+            if delay is None:
+                if status in self.retry_policy.BLOCKING_STATUSES:
+                    raise err
+                ScholarUtils.log('info', err_msg + ': %s' % err)
+                return None
+            reason = err
+        else:
+            status = None
+            delay = self.retry_policy.delay(status, attempt)
+            if delay is None:
+                raise err
+            reason = err.reason
+
+        ScholarUtils.log('warn', '%s: %s, retrying in %.1f seconds' % (err_msg, reason, delay))
+        ScholarMetrics.inc('scholar_retries_total', type=rtype, status=str(status or 'error'))
+        ScholarMetrics.observe('scholar_retry_wait_seconds', delay)
+        if status in self.retry_policy.BLOCKING_STATUSES and self.rate_limiter is not None:
+            # Hold back the other queriers sharing the limiter too.
+            self.rate_limiter.pause(delay)
+        return delay
+
+    def _request(self, url, rtype, log_msg, consumer=None, check=None):
+        """
+        Sends a single HTTP request for _get_http_response(), raising
+        HTTPError or URLError on failure.
+        """
+        if self.rate_limiter is not None:
+            with ScholarMetrics.timer('scholar_rate_limit_wait_seconds'):
+                self.rate_limiter.acquire()
 
-            req = Request(url=url, headers={'User-Agent': ScholarConf.USER_AGENT})
+        ScholarUtils.log('info', 'requesting %s' % unquote(url))
+
+        start = time.perf_counter()
+        from urllib.request import Request
+        req = Request(url=url, headers={'User-Agent': ScholarConf.USER_AGENT})
+        try:
             hdl = self.opener.open(req)
-            html = hdl.read()
+        except HTTPError as err:
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status=str(err.code))
+            raise
+        except URLError:
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status='error')
+            raise
+        import http.client
+        try:
+            if consumer is None:
+                html = hdl.read()
+                size = len(html)
+                captcha = self._is_captcha(html)
+            else:
+                # Only hold on to the whole payload if we need it later.
+                keep = self.cache is not None or \
+                    ScholarConf.LOG_LEVEL >= ScholarUtils.LOG_LEVELS['debug']
+                chunks = []
+                size = 0
+                captcha = False
+                tail = b''
+                while True:
+                    chunk = hdl.read(ScholarConf.STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    consumer(chunk)
+                    size += len(chunk)
+                    if keep:
+                        chunks.append(chunk)
+                    # A marker may straddle two chunks.
+                    captcha = captcha or self._is_captcha(tail + chunk)
+                    tail = chunk[-64:]
+                html = b''.join(chunks)
+        except (http.client.HTTPException, OSError, zlib.error) as err:
+            # A body cut short or garbled is no better than a failed
+            # connection, and gets retried like one.
+            hdl.close()
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status='error')
+            raise URLError(err)
+        ScholarMetrics.observe('scholar_request_seconds', time.perf_counter() - start,
+                               type=rtype)
+        ScholarMetrics.inc('scholar_downloaded_bytes_total', size, type=rtype)
+        if captcha:
+            # Never cached, see CaptchaError.
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status='captcha')
+            raise CaptchaError(hdl.geturl(), hdl.info())
+        ScholarMetrics.inc('scholar_requests_total', type=rtype, status=str(hdl.getcode()))
+
+        self._log_response(log_msg, hdl, html)
+
+        if check is not None and not check(html):
+            ScholarUtils.log('info', 'unexpected response for %s' % unquote(url))
+            return None
+        if self.cache is not None:
+            self.cache.put(url, html)
+        return html if consumer is None else True
 
-            ScholarUtils.log('debug', log_msg)
-            ScholarUtils.log('debug', '>>>>' + '-'*68)
-            ScholarUtils.log('debug', 'url: %s' % hdl.geturl())
-            ScholarUtils.log('debug', 'result: %s' % hdl.getcode())
-            ScholarUtils.log('debug', 'headers:\n' + str(hdl.info()))
-            ScholarUtils.log('debug', 'data:\n' + html.decode('utf-8')) # For Python 3
-            ScholarUtils.log('debug', '<<<<' + '-'*68)
+    @staticmethod
+    def _log_response(log_msg, hdl, html):
+        if ScholarConf.LOG_LEVEL < ScholarUtils.LOG_LEVELS['debug']:
+            return
+        ScholarUtils.log('debug', log_msg)
+        ScholarUtils.log('debug', '>>>>' + '-'*68)
+        ScholarUtils.log('debug', 'url: %s' % hdl.geturl())
+        ScholarUtils.log('debug', 'result: %s' % hdl.getcode())
+        ScholarUtils.log('debug', 'headers:\n' + str(hdl.info()))
+        ScholarUtils.log('debug', 'data:\n' + html.decode('utf-8'))
+        ScholarUtils.log('debug', '<<<<' + '-'*68)
 
-            return html
-        except HTTPError as err:
-            if err.code == 503:
-                raise
-            ScholarUtils.log('info', err_msg + ': %s' % err)
+
+class ScholarSession(object):
+    """
+    A long-lived querier together with the settings its queries need,
+    meant to be reused for any number of queries. The settings get
+    applied once, and only again when Scholar appears to have lost
+    them: that is, when a results page comes back without the citation
+    export links the settings ask for. Since Scholar keeps settings in
+    a cookie, a session started with a cookie file saved by an earlier
+    one (see ScholarConf.COOKIE_JAR_FILE) doesn't apply them at all.
+
+    A session is not safe to use from several threads at once; use
+    one per thread instead.
+    """
+    def __init__(self, settings, rate_limiter=None, retry_policy=None):
+        self.settings = settings
+        self.querier = ScholarQuerier(rate_limiter=rate_limiter, retry_policy=retry_policy)
+        self.applied = self.querier.has_settings_cookie(settings)
+        if self.applied:
+            ScholarUtils.log('info', 'settings found in cookies')
+
+    def ensure_settings(self):
+        """Applies the settings unless already done."""
+        if not self.applied:
+            self.applied = self.querier.apply_settings(self.settings)
+        return self.applied
+
+    def send_query(self, query):
+        """
+        Like ScholarQuerier.send_query(), re-applying the settings and
+        re-sending the query if the response shows they were lost.
+        """
+        self.ensure_settings()
+        self.querier.send_query(query)
+        self._check_settings(query)
+
+    def load_page(self, query, page):
+        """
+        Like ScholarQuerier.load_page(), re-applying the settings and
+        re-sending the query if the page shows they were lost.
+        """
+        self.querier.load_page(query, page)
+        self._check_settings(query)
+
+    def close(self):
+        """Saves the session's cookies, settings included, if configured."""
+        self.querier.save_cookies()
+
+    def _check_settings(self, query):
+        if self._settings_lost():
+            ScholarUtils.log('info', 'settings were lost, applying them again')
+            # Scholar may have started a new session, with a new token.
+            self.querier.scisig = None
+            self.applied = False
+            if self.ensure_settings():
+                self.querier.send_query(query)
+
+    def _settings_lost(self):
+        if self.settings is None or self.settings.citform == 0:
+            return False
+        articles = self.querier.articles
+        return len(articles) > 0 and \
+            all(art['url_citation'] is None for art in articles)
+
+
+def parse_results_page(html, parser='bs4', site=None):
+    """
+    Parses a results page with the given parser (see
+    ScholarQuerier.PARSERS) into plain records, for
+    ScholarQuerier.load_page(): returns the number of results the page
+    reports (None if it doesn't), a list of the attributes of every
+    article found, as ScholarArticle.as_record() gives them, and the
+    seconds parsing took. Since its arguments and results are plain
+    data, it can run in another process, e.g. in a ProcessPoolExecutor;
+    site should then be ScholarConf.SCHOLAR_SITE of the calling one.
+    """
+    start = time.perf_counter()
+    results = ScholarQuerier.QueryResults({})
+    page_parser = ScholarQuerier.PARSERS[parser](results)
+    page_parser.site = site or ScholarConf.SCHOLAR_SITE
+    with ScholarProfiler.phase('parse'):
+        page_parser.parse(html)
+    records = [art.as_record() for art in results.articles]
+    return results.query.get('num_results'), records, time.perf_counter() - start
+
+
+class ScholarPagePipeline(object):
+    """
+    Fetches the results pages of a series of queries, e.g. the next
+    pages of a search, ahead of the one the caller is working on, so
+    that waiting for Scholar, parsing and what the caller does with the
+    articles (such as retrieving their citation data) all overlap.
+
+    Pages get fetched in order by a thread of the pipeline's own, at
+    most depth (by default ScholarConf.PREFETCH_PAGES) ahead of the
+    caller, and each one gets parsed as soon as it has arrived: by a
+    pool of ScholarConf.PARSE_WORKERS processes shared by all
+    pipelines, so that parsing can use several cores, or else by the
+    fetching thread. The caller takes the pages in order with
+    next_page(), and closes the pipeline when done with it. Once done
+    with all pipelines, shutdown_pool() stops the parsing processes.
+    """
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, session, queries, depth=None):
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        self.session = session
+        self.queries = deque(queries)
+        self.depth = max(1, depth or ScholarConf.PREFETCH_PAGES)
+        self.pending = deque() # (query, future of its page), in order
+        self.fetcher = ThreadPoolExecutor(max_workers=1)
+        self._fill()
+
+    @classmethod
+    def parse_pool(cls):
+        """
+        Returns the process pool parsing the pages of all pipelines,
+        None if ScholarConf.PARSE_WORKERS is 0.
+        """
+        if not ScholarConf.PARSE_WORKERS:
+            return None
+        with cls._pool_lock:
+            if cls._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Forking while other threads hold locks could leave the
+                # workers deadlocked, so they start from scratch.
+                cls._pool = ProcessPoolExecutor(max_workers=ScholarConf.PARSE_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            return cls._pool
+
+    @classmethod
+    def shutdown_pool(cls):
+        """
+        Stops the processes parsing pages, if started. Left running,
+        they keep a program running them from exiting when it is a
+        multiprocessing child itself. A later pipeline starts new ones.
+        """
+        with cls._pool_lock:
+            pool, cls._pool = cls._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def next_page(self):
+        """
+        Loads the articles of the next query's page into the session's
+        querier, as its send_query() would, and returns the query, or
+        None when there are no more queries. Failures to fetch or parse
+        the page are raised here, e.g. an HTTPError when Scholar keeps
+        blocking us.
+        """
+        from concurrent.futures import Future
+        if not self.pending:
+            return None
+        query, future = self.pending.popleft()
+        self._fill()
+        page = future.result()
+        if isinstance(page, Future):
+            page = page.result()
+        if page is None:
+            # Like a failed send_query(), leaves no articles.
+            self.session.querier.clear_articles()
+            self.session.querier.query = query
+        else:
+            self.session.load_page(query, page)
+        return query
+
+    def close(self):
+        """Stops fetching pages. Those on their way get dropped."""
+        self.queries.clear()
+        self.fetcher.shutdown(wait=False, cancel_futures=True)
+
+    def _fill(self):
+        while self.queries and len(self.pending) < self.depth:
+            query = self.queries.popleft()
+            self.pending.append((query, self.fetcher.submit(self._fetch, query)))
+
+    def _fetch(self, query):
+        """
+        Fetches the page of the query, returning it parsed, or the
+        future of it being parsed in the pool, None on failure.
+        """
+        html = self.session.querier.fetch_query(query)
+        if html is None:
             return None
+        args = (html, self.session.querier.parser, ScholarConf.SCHOLAR_SITE)
+        pool = self.parse_pool()
+        if pool is None:
+            return parse_results_page(*args)
+        return pool.submit(parse_results_page, *args)
+
+
+class ScholarAsyncResponse(object):
+    """
+    An HTTP response received by ScholarAsyncClient. Its info() makes
+    it look like a urllib response to the cookie jar.
+    """
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+
+class ScholarAsyncClient(object):
+    """
+    A minimal HTTP/1.1 client on asyncio streams, for the requests of
+    AsyncScholarQuerier. Like ScholarKeepAliveHandler, it keeps
+    connections open for reuse by later requests to the same host and
+    requests compressed transfers, which it decodes. At most
+    max_connections requests to a host are in flight at once (by
+    default ScholarConf.ASYNC_HOST_CONNECTIONS); the others wait for a
+    connection to come free. It only sends GET requests, and doesn't
+    go through proxies.
+
+    A client must only be used from the event loop it was first used
+    in, but the queriers of that loop may share it.
+    """
+    def __init__(self, max_connections=None, timeout=None):
+        self.max_connections = max_connections or ScholarConf.ASYNC_HOST_CONNECTIONS
+        self.timeout = timeout or ScholarConf.ASYNC_TIMEOUT
+        self._idle = {} # (scheme, host, port) -> list of idle connections
+        self._slots = {} # (scheme, host, port) -> asyncio.Semaphore
+        self._ssl = None
+
+    async def get(self, url, headers, consumer=None):
+        """
+        Sends a GET request for the URL with the given headers, and
+        returns the ScholarAsyncResponse. If a consumer callable is
+        given, it receives the body of a successful (2xx) response in
+        chunks as they arrive, and the response's body is None.
+        Connection failures and timeouts raise URLError.
+        """
+        import asyncio
+        import http.client
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise URLError('unknown url type: %s' % scheme)
+        if not parts.hostname:
+            raise URLError('no host given')
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Host'] = parts.netloc.rsplit('@', 1)[-1]
+        headers['Connection'] = 'keep-alive'
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        lines = ['GET %s HTTP/1.1' % ((parts.path or '/') + ('?' + parts.query if parts.query else ''))]
+        lines.extend('%s: %s' % item for item in headers.items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1')
+
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = asyncio.Semaphore(self.max_connections)
+        async with slots:
+            conn = None
+            reusable = False
+            try:
+                conn, version, status, reason, msg = await self._send(key, request)
+                body, reusable = await self._read_body(conn[0], version, status, msg,
+                                                       consumer if 200 <= status < 300 else None)
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError,
+                    http.client.HTTPException) as err:
+                raise URLError(err)
+            finally:
+                if conn is not None:
+                    if reusable:
+                        self._idle.setdefault(key, []).append(conn)
+                    else:
+                        conn[1].close()
+        return ScholarAsyncResponse(url, status, reason, msg, body)
+
+    async def close(self):
+        """Closes all idle connections."""
+        import asyncio
+        idle, self._idle = self._idle, {}
+        writers = [writer for conns in idle.values() for _, writer in conns]
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*[writer.wait_closed() for writer in writers],
+                             return_exceptions=True)
+
+    async def _send(self, key, request):
+        """
+        Sends the request on an idle connection to the host if there
+        is one, or on a new one, and reads the head of the response.
+        """
+        import http.client
+        conns = self._idle.get(key)
+        conn = conns.pop() if conns else None
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect(key)
+            try:
+                conn[1].write(request)
+                await self._wait(conn[1].drain())
+                return (conn,) + await self._wait(self._read_head(conn[0]))
+            except BaseException as err:
+                conn[1].close()
+                # The server may have timed out an idle connection
+                # since we last used it; try once more with a new one.
+                if not reused or not isinstance(err, (OSError, EOFError,
+                                                      http.client.HTTPException)):
+                    raise
+                conn = None
+
+    async def _connect(self, key):
+        import asyncio
+        scheme, host, port = key
+        context = None
+        if scheme == 'https':
+            if self._ssl is None:
+                import ssl
+                self._ssl = ssl.create_default_context()
+            context = self._ssl
+        return await self._wait(asyncio.open_connection(host, port, ssl=context))
+
+    async def _wait(self, awaitable):
+        import asyncio
+        return await asyncio.wait_for(awaitable, self.timeout)
+
+    @staticmethod
+    async def _read_head(reader):
+        """Reads the status line and headers, skipping 1xx responses."""
+        import http.client
+        import io
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise http.client.RemoteDisconnected('Remote end closed connection without response')
+            fields = line.decode('iso-8859-1').split(None, 2)
+            if len(fields) < 2 or not fields[0].startswith('HTTP/'):
+                raise http.client.BadStatusLine(line)
+            lines = []
+            while line not in (b'\r\n', b'\n', b''):
+                line = await reader.readline()
+                lines.append(line)
+            status = int(fields[1])
+            if status >= 200:
+                reason = fields[2].strip() if len(fields) > 2 else ''
+                return fields[0], status, reason, http.client.parse_headers(io.BytesIO(b''.join(lines)))
+
+    async def _read_body(self, reader, version, status, msg, consumer):
+        """
+        Reads the body of the response, as told by its headers. Returns
+        the body, None if it went to the consumer, and whether the
+        connection can be reused.
+        """
+        decoder = ScholarContentDecoder(msg.get('Content-Encoding'))
+        chunks = []
+        def emit(data, final=False):
+            data = decoder.decode(data, final)
+            if not data:
+                return
+            if consumer is None:
+                chunks.append(data)
+            else:
+                consumer(data)
+
+        reusable = version == 'HTTP/1.1' and \
+            'close' not in (msg.get('Connection') or '').lower()
+        length = msg.get('Content-Length')
+        if status in (204, 304):
+            pass
+        elif 'chunked' in (msg.get('Transfer-Encoding') or '').lower():
+            while True:
+                line = await self._wait(reader.readline())
+                size = int(line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    break
+                while size > 0:
+                    data = await self._wait(reader.readexactly(min(size, ScholarConf.STREAM_CHUNK_SIZE)))
+                    size -= len(data)
+                    emit(data)
+                await self._wait(reader.readexactly(2))
+            # Skip the trailers, if any.
+            while line not in (b'\r\n', b'\n', b''):
+                line = await self._wait(reader.readline())
+        elif length is not None:
+            size = int(length)
+            while size > 0:
+                data = await self._wait(reader.readexactly(min(size, ScholarConf.STREAM_CHUNK_SIZE)))
+                size -= len(data)
+                emit(data)
+        else:
+            # The body ends with the connection.
+            reusable = False
+            while True:
+                data = await self._wait(reader.read(ScholarConf.STREAM_CHUNK_SIZE))
+                if not data:
+                    break
+                emit(data)
+        emit(b'', final=True)
+        return (b''.join(chunks) if consumer is None else None), reusable
+
+
+class AsyncScholarQuerier(ScholarQuerier):
+    """
+    A ScholarQuerier for asyncio programs: send_query(), fetch_query(),
+    load_page(), parse(), apply_settings(), get_citation_data() and
+    fetch_citation_data() are coroutines, and requests go out through
+    a ScholarAsyncClient instead of urllib. Parsers, query URLs,
+    cookies, the response cache, the cluster index, retries and rate
+    limiting all work as for ScholarQuerier; the cache and the index
+    are read and written in the loop's default executor.
+
+    Unlike a ScholarQuerier, a querier can have any number of queries
+    in flight at once, e.g. one per author in asyncio.gather():
+    send_query() returns the articles found by its query, and sets the
+    articles member just for use of one query at a time. The client's
+    limit on connections per host, and the rate limiter if given, keep
+    Scholar from getting all of the requests at once.
+
+    Parsed articles have no citation loader, as as_citation() can't
+    wait for a request. In lazy mode, await fetch_citation_data() for
+    the articles whose citation data you need.
+    """
+    # Redirects followed per request, as many as urllib follows.
+    MAX_REDIRECTS = 10
+
+    def __init__(self, rate_limiter=None, retry_policy=None, client=None):
+        ScholarQuerier.__init__(self, rate_limiter=rate_limiter, retry_policy=retry_policy)
+        self.opener = None # Requests go through the client instead
+        # Several queriers may share a client, and so its connections:
+        self.client = client or ScholarAsyncClient()
+
+    async def apply_settings(self, settings):
+        """
+        Applies settings as provided by a ScholarSettings instance.
+        """
+        if settings is None or not settings.is_configured():
+            return True
+
+        self.settings = settings
+        cached_scisig = self.scisig is not None
+        if not cached_scisig:
+            self.scisig = await self._get_scisig()
+            if self.scisig is None:
+                return False
+
+        html = await self._get_http_response(url=self._settings_url(settings),
+                                             log_msg='dump of settings result HTML',
+                                             err_msg='applying setttings failed')
+        if html is None:
+            self.scisig = None
+            if cached_scisig:
+                # The token may have expired, retry with a fresh one.
+                return await self.apply_settings(settings)
+            return False
+
+        ScholarUtils.log('info', 'settings applied')
+        return True
+
+    async def _get_scisig(self):
+        html = await self._get_http_response(url=self.GET_SETTINGS_URL % {'site': ScholarConf.SCHOLAR_SITE},
+                                             log_msg='dump of settings form HTML',
+                                             err_msg='requesting settings failed')
+        if html is None:
+            return None
+        return self._parse_scisig(html)
+
+    async def send_query(self, query):
+        """
+        Sends a search query (a ScholarQuery instance), parses the
+        response and returns the articles found, with their citation
+        data unless in lazy mode.
+        """
+        if self.PARSERS[self.parser].streaming:
+            # Parse the page while it downloads.
+            consumer = self.PageConsumer(self, query)
+            received = await self._get_http_response(url=query.get_url(),
+                                                     log_msg='dump of query response HTML',
+                                                     err_msg='results retrieval failed',
+                                                     consumer=consumer)
+            articles = consumer.close() if received is not None else []
+        else:
+            received = await self.fetch_query(query)
+            articles = self._parse_page(query, received) if received is not None else []
+
+        if received is not None:
+            if not articles:
+                ScholarMetrics.inc('scholar_empty_pages_total')
+            await self.fetch_citation_data(self._citations_wanted(articles))
+        self.query = query
+        self.articles = articles
+        return articles
+
+    async def fetch_query(self, query):
+        """
+        Retrieves the results page of a query without parsing it, see
+        ScholarQuerier.fetch_query().
+        """
+        return await self._get_http_response(url=query.get_url(),
+                                             log_msg='dump of query response HTML',
+                                             err_msg='results retrieval failed')
+
+    async def load_page(self, query, page):
+        """
+        Takes the results page of the query parsed elsewhere, see
+        ScholarQuerier.load_page(), and returns its articles.
+        """
+        num_results, records, seconds = page
+        if num_results is not None:
+            query['num_results'] = num_results
+        articles = [ScholarArticle.from_record(record) for record in records]
+        ScholarMetrics.observe('scholar_parse_seconds', seconds, parser=self.parser)
+        if not articles:
+            ScholarMetrics.inc('scholar_empty_pages_total')
+        await self.fetch_citation_data(self._citations_wanted(articles))
+        self.query = query
+        self.articles = articles
+        return articles
+
+    async def parse(self, html):
+        """
+        Parses the provided HTML content as a results page of the
+        current query, adds the articles found to the articles member
+        and returns them.
+        """
+        articles = self._parse_page(self.query, html)
+        if not articles:
+            ScholarMetrics.inc('scholar_empty_pages_total')
+        await self.fetch_citation_data(self._citations_wanted(articles))
+        self.articles.extend(articles)
+        return articles
+
+    async def get_citation_data(self, article):
+        """
+        Given an article, retrieves its citation data, see
+        ScholarQuerier.get_citation_data().
+        """
+        if article['url_citation'] is None:
+            return False
+        if await self._blocking(self._reuse_citation_data, article):
+            return True
+
+        ScholarUtils.log('info', 'retrieving citation export data')
+        data = await self._get_http_response(url=article['url_citation'],
+                                             log_msg='citation data response',
+                                             err_msg='requesting citation data failed',
+                                             check=self.citation_check)
+        if data is None:
+            return False
+
+        await self._blocking(self._store_citation_data, article, data)
+        return True
+
+    async def fetch_citation_data(self, articles):
+        """
+        Retrieves citation data for several articles, keeping up to
+        citation_workers requests in flight at once.
+        """
+        import asyncio
+        articles = [art for art in articles
+                    if art['url_citation'] is not None and art.citation_data is None]
+        slots = asyncio.Semaphore(self.citation_workers)
+        async def fetch(art):
+            async with slots:
+                return await self.get_citation_data(art)
+        # Like ScholarQuerier's, raises the first failure, e.g. a 503.
+        await asyncio.gather(*[fetch(art) for art in articles])
+
+    async def close(self):
+        """Closes the client's idle connections."""
+        await self.client.close()
+
+    def _parse_page(self, query, html):
+        """Parses a results page of the query, returning its articles."""
+        results = self.QueryResults(query)
+        with ScholarMetrics.timer('scholar_parse_seconds', parser=self.parser), \
+             ScholarProfiler.phase('parse'):
+            self._make_parser(results).parse(html)
+        return results.articles
+
+    @staticmethod
+    async def _blocking(func, *args):
+        """
+        Runs func, which reads or writes the response cache or the
+        cluster index, in the loop's default executor, so that other
+        queries' requests go on meanwhile.
+        """
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _get_http_response(self, url, log_msg=None, err_msg=None, consumer=None, check=None):
+        """
+        Like ScholarQuerier._get_http_response(). Fetching isn't
+        profiled, since the requests of all queries interleave in the
+        event loop's thread.
+        """
+        import asyncio
+        if log_msg is None:
+            log_msg = 'HTTP response data follow'
+        if err_msg is None:
+            err_msg = 'request failed'
+        rtype = ScholarUtils.resource_type(url)
+        if self.cache is not None:
+            html = await self._blocking(self._cached_response, url, rtype, check)
+            if html is not None:
+                if consumer is None:
+                    return html
+                consumer(html)
+                return True
+
+        attempt = 0
+        while True:
+            try:
+                return await self._request(url, rtype, log_msg, consumer, check)
+            except URLError as err:
+                delay = self._retry_delay(err, attempt, rtype, err_msg)
+            if delay is None:
+                return None
+            await asyncio.sleep(delay)
+            attempt += 1
+            if consumer is not None:
+                # It may have had part of the body already.
+                consumer.restart()
+
+    async def _request(self, url, rtype, log_msg, consumer=None, check=None):
+        """
+        Sends a single HTTP request for _get_http_response(), raising
+        HTTPError or URLError on failure.
+        """
+        if self.rate_limiter is not None:
+            with ScholarMetrics.timer('scholar_rate_limit_wait_seconds'):
+                await self.rate_limiter.acquire_async()
+
+        ScholarUtils.log('info', 'requesting %s' % unquote(url))
+
+        start = time.perf_counter()
+        chunks = []
+        size = [0]
+        captcha = [False]
+        tail = [b'']
+        # Only hold on to the whole payload if we need it later.
+        keep = self.cache is not None or \
+            ScholarConf.LOG_LEVEL >= ScholarUtils.LOG_LEVELS['debug']
+        def on_chunk(chunk):
+            consumer(chunk)
+            size[0] += len(chunk)
+            if keep:
+                chunks.append(chunk)
+            # A marker may straddle two chunks.
+            captcha[0] = captcha[0] or self._is_captcha(tail[0] + chunk)
+            tail[0] = chunk[-64:]
+        receive = on_chunk if consumer is not None else None
+        try:
+            resp = await self._open(url, receive)
+        except URLError:
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status='error')
+            raise
+        if not 200 <= resp.status < 300:
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status=str(resp.status))
+            raise HTTPError(resp.url, resp.status, resp.reason, resp.headers, None)
+        if consumer is None:
+            html = resp.body
+            size[0] = len(html)
+            captcha[0] = self._is_captcha(html)
+        else:
+            html = b''.join(chunks)
+        ScholarMetrics.observe('scholar_request_seconds', time.perf_counter() - start,
+                               type=rtype)
+        ScholarMetrics.inc('scholar_downloaded_bytes_total', size[0], type=rtype)
+        if captcha[0]:
+            # Never cached, see CaptchaError.
+            ScholarMetrics.inc('scholar_requests_total', type=rtype, status='captcha')
+            raise CaptchaError(resp.url, resp.headers)
+        ScholarMetrics.inc('scholar_requests_total', type=rtype, status=str(resp.status))
+
+        self._log_response(log_msg, resp, html)
+
+        if check is not None and not check(html):
+            ScholarUtils.log('info', 'unexpected response for %s' % unquote(url))
+            return None
+        if self.cache is not None:
+            await self._blocking(self.cache.put, url, html)
+        return html if consumer is None else True
+
+    async def _open(self, url, consumer):
+        """
+        Sends a GET request for the URL with the querier's cookies,
+        following redirects like urllib, and returns the response.
+        """
+        from urllib.parse import urljoin
+        from urllib.request import Request
+        for _ in range(self.MAX_REDIRECTS + 1):
+            req = Request(url=url, headers={'User-Agent': ScholarConf.USER_AGENT})
+            self.cjar.add_cookie_header(req)
+            resp = await self.client.get(url, dict(req.header_items()), consumer)
+            self.cjar.extract_cookies(resp, req)
+            location = resp.headers.get('Location')
+            if resp.status not in (301, 302, 303, 307, 308) or location is None:
+                return resp
+            url = urljoin(url, location)
+        raise HTTPError(url, resp.status, 'too many redirects', resp.headers, None)
 
 
 def txt(querier, with_globals):
@@ -1139,17 +3823,17 @@ def txt(querier, with_globals):
             if item[0] is not None:
                 print(fmt % (item[1], item[0]))
         if len(items) > 0:
-            print
+            print()
 
     articles = querier.articles
     for art in articles:
-        print(encode(art.as_txt()) + '\n')
+        print(art.as_txt() + '\n')
 
 def csv(querier, header=False, sep='|'):
     articles = querier.articles
     for art in articles:
         result = art.as_csv(header=header, sep=sep)
-        print(encode(result))
+        print(result)
         header = False
 
 def citation_export(querier):
@@ -1174,6 +3858,7 @@ scholar.py -c 1 -C 17749203648027613321 --citation bt
 # does not contain the words "quantum" and "theory":
 scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
 
+    import optparse
     fmt = optparse.IndentedHelpFormatter(max_help_position=50, width=100)
     parser = optparse.OptionParser(usage=usage, formatter=fmt)
     group = optparse.OptionGroup(parser, 'Query arguments',
@@ -1223,6 +3908,16 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
     group = optparse.OptionGroup(parser, 'Miscellaneous')
     group.add_option('--cookie-file', metavar='FILE', default=None,
                      help='File to use for cookie storage. If given, will read any existing cookies if found at startup, and save resulting cookies in the end.')
+    group.add_option('--parser', metavar='PARSER', default=None, choices=sorted(ScholarQuerier.PARSERS),
+                     help='Results page parser, one of %s. Default is "bs4". "lxml" is faster but needs the lxml package, "stream" parses pages while they download.' % ', '.join('"%s"' % name for name in sorted(ScholarQuerier.PARSERS)))
+    group.add_option('--cache-dir', metavar='DIR', default=None,
+                     help='Directory in which to cache HTTP responses. If given, results pages and citation exports are reused from it while fresh.')
+    group.add_option('--citation-workers', metavar='N', type='int', default=None,
+                     help='Retrieve up to N citation exports in parallel. Default is one at a time.')
+    group.add_option('--retries', metavar='N', type='int', default=None,
+                     help='Retry requests up to N times when Scholar blocks us (503, 429), with exponential backoff. Default is %d.' % ScholarConf.RETRIES)
+    group.add_option('--profile', metavar='PATH', default=None,
+                     help='Profile fetching, parsing and printing the results, writing a cProfile profile of each to PATH.<phase>.pstats and its top memory allocations to PATH.<phase>.alloc.txt.')
     group.add_option('-d', '--debug', action='count', default=0,
                      help='Enable verbose logging to stderr. Repeated options increase detail of debug output.')
     group.add_option('-v', '--version', action='store_true', default=False,
@@ -1248,6 +3943,18 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
     if options.cookie_file:
         ScholarConf.COOKIE_JAR_FILE = options.cookie_file
 
+    if options.citation_workers is not None:
+        ScholarConf.CITATION_WORKERS = options.citation_workers
+
+    if options.cache_dir:
+        ScholarConf.CACHE_DIR = options.cache_dir
+
+    if options.parser:
+        ScholarConf.PARSER = options.parser
+
+    if options.retries is not None:
+        ScholarConf.RETRIES = options.retries
+
     # Sanity-check the options: if they include a cluster ID query, it
     # makes no sense to have search arguments:
     if options.cluster_id is not None:
@@ -1257,7 +3964,6 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
             print('Cluster ID queries do not allow additional search arguments.')
             return 1
 
-    querier = ScholarQuerier()
     settings = ScholarSettings()
 
     if options.citation == 'bt':
@@ -1272,7 +3978,8 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
         print('Invalid citation link format, must be one of "bt", "en", "rm", or "rw".')
         return 1
 
-    querier.apply_settings(settings)
+    session = ScholarSession(settings)
+    querier = session.querier
 
     if options.cluster_id:
         query = ClusterScholarQuery(cluster=options.cluster_id)
@@ -1303,19 +4010,32 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
         options.count = min(options.count, ScholarConf.MAX_PAGE_RESULTS)
         query.set_num_page_results(options.count)
 
-    querier.send_query(query)
-
-    if options.csv:
-        csv(querier)
-    elif options.csv_header:
-        csv(querier, header=True)
-    elif options.citation is not None:
-        citation_export(querier)
-    else:
-        txt(querier, with_globals=options.txt_globals)
+    if options.profile:
+        # Rather than finding out once the query is done:
+        try:
+            os.makedirs(os.path.dirname(options.profile) or '.', exist_ok=True)
+        except OSError as msg:
+            print('Cannot write profiles to %s: %s' % (options.profile, msg))
+            return 1
+        ScholarProfiler.start()
+    try:
+        session.send_query(query)
+
+        with ScholarProfiler.phase('render'):
+            if options.csv:
+                csv(querier)
+            elif options.csv_header:
+                csv(querier, header=True)
+            elif options.citation is not None:
+                citation_export(querier)
+            else:
+                txt(querier, with_globals=options.txt_globals)
+    finally:
+        if options.profile:
+            ScholarProfiler.write(options.profile)
 
     if options.cookie_file:
-        querier.save_cookies()
+        session.close()
 
     return 0
 